@@ -1,33 +1,136 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import Activity, Institution, LegalStatus, Municipality
+from django.contrib.admin.views.main import ChangeList
+from django.db.models import Prefetch
+
+from .models import Activity, Institution, LegalStatus, LegalUnit, Municipality
+from .paginators import EstimatedCountPaginator
+
+AFTER_VAR = "after"
+
+
+class InstitutionChangeList(ChangeList):
+    """Changelist paginated by siret keyset instead of OFFSET
+
+    Pages are reached with ``?after=<siret>``, so every page is a short
+    indexed query whatever its position in the table.
+    """
+
+    keyset_pagination = True
+
+    def __init__(self, request, *args, **kwargs):
+        self.after = request.GET.get(AFTER_VAR, "")
+        super().__init__(request, *args, **kwargs)
+
+    def get_queryset(self, request, *args, **kwargs):
+        # like the page number, the position is dropped from the filters and
+        # from the links to other filters or searches
+        self.params.pop(AFTER_VAR, None)
+        if hasattr(self, "filter_params"):
+            self.filter_params.pop(AFTER_VAR, None)
+        return super().get_queryset(request, *args, **kwargs)
+
+    def get_results(self, request):
+        queryset = self.queryset.order_by("siret")
+        if self.after:
+            queryset = queryset.filter(siret__gt=self.after)
+        result_list = list(queryset[:self.list_per_page + 1])
+
+        self.paginator = self.model_admin.get_paginator(
+            request, self.queryset, self.list_per_page
+        )
+        self.result_count = self.paginator.count
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.result_list = result_list[:self.list_per_page]
+        # page links are replaced by first/next links
+        self.can_show_all = False
+        self.multi_page = False
+
+        self.first_url = self.after and self.get_query_string(remove=[AFTER_VAR])
+        self.next_url = None
+        if len(result_list) > self.list_per_page:
+            self.next_url = self.get_query_string({AFTER_VAR: self.result_list[-1].siret})
 
 
 class InstitutionAdmin(admin.ModelAdmin):
-    search_fields = ("siret", "name", "commercial_name")
-    list_select_related = (
-        "legal_status",
-        "headquarter",
-        "municipality",
-        "activity",
-    )
+    # estimate counts and paginate by siret for tables of tens of millions rows
+    scalable_changelist = getattr(settings, "DJANGO_SIRENE_ADMIN_SCALABLE_CHANGELIST", False)
+
+    search_fields = ("siret", "legal_unit__name", "commercial_name")
+    # names are joined from the legal units, municipalities come from the
+    # process cache and headquarters are prefetched for the displayed page
+    # only, see get_queryset
+    list_select_related = ("legal_unit",)
     list_display = (
         "siret",
         "__str__",
         "zipcode",
-        "municipality",
+        "municipality_label",
         "headquarter",
         "is_headquarter",
         "is_expired",
         "updated",
         "created",
     )
-    autocomplete_fields = ("activity", "legal_status", "municipality")
-    raw_id_fields = ("headquarter",)
+    autocomplete_fields = ("activity", "municipality")
+    raw_id_fields = ("headquarter", "legal_unit")
+
+    def municipality_label(self, obj):
+        return obj.cached_municipality
+    municipality_label.short_description = "municipality"
+    municipality_label.admin_order_field = "municipality"
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            Prefetch(
+                "headquarter",
+                queryset=Institution.objects.select_related("legal_unit").only(
+                    "siret", "commercial_name", "legal_unit__name"
+                ),
+            )
+        )
+
+    def get_changelist(self, request, **kwargs):
+        if self.scalable_changelist:
+            return InstitutionChangeList
+        return super().get_changelist(request, **kwargs)
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        if self.scalable_changelist:
+            return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super().get_paginator(
+            request, queryset, per_page, orphans, allow_empty_first_page
+        )
+
+    def get_sortable_by(self, request):
+        if self.scalable_changelist:
+            # keyset pagination requires the siret ordering
+            return ()
+        return super().get_sortable_by(request)
+
+    def get_search_results(self, request, queryset, search_term):
+        """Use the indexed full text search instead of LIKE scans
+        """
+        if not search_term:
+            return queryset, False
+        return queryset.search(search_term, ranked=False), False
 
 
 admin.site.register(Institution, InstitutionAdmin)
 
 
+class LegalUnitAdmin(admin.ModelAdmin):
+    search_fields = ("siren", "name")
+    list_display = ("siren", "name", "legal_status", "headquarter_nic", "updated")
+    autocomplete_fields = ("legal_status",)
+
+
+admin.site.register(LegalUnit, LegalUnitAdmin)
+
+
 class DjangoSireneBaseAdmin:
     search_fields = ("code", "name")
 
@@ -3,3 +3,15 @@ from django.apps import AppConfig
 
 class DjangoSireneConfig(AppConfig):
     name = 'django_sirene'
+
+    def ready(self):
+        from .lookups import Any
+        from .routers import mark_import_write
+        from .signals import institutions_created, institutions_updated
+
+        # only the lookups of cached records, other CharField and ForeignKey are left alone
+        institution = self.get_model('Institution')
+        institution._meta.get_field('siret').register_lookup(Any)
+        institution._meta.get_field('legal_unit').register_lookup(Any)
+        institutions_created.connect(mark_import_write)
+        institutions_updated.connect(mark_import_write)
@@ -0,0 +1,86 @@
+import logging
+import sys
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+def get_rss():
+    """Resident memory of the process in bytes, None when unknown
+    """
+    if resource is None:
+        return None
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        # peak and not current memory, in kilobytes on linux and bytes on macOS
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+class AdaptiveBatchSize:
+    """Batch size adapted to the measured throughput and to the process memory
+
+    The size grows while the rows written by second improve, goes back when
+    they degrade and is halved as soon as the resident memory gets near the
+    budget.
+    """
+
+    growth = 1.5
+    backoff = 0.5
+    # share of the memory budget from which batches are reduced
+    memory_threshold = 0.8
+    # throughput changes below this ratio are noise
+    tolerance = 0.05
+
+    def __init__(self, size, memory_budget=None, minimum=100, maximum=100000):
+        """
+        :param size: initial batch size
+        :param memory_budget: resident memory allowed to the process, in bytes
+        :param minimum: smallest batch size
+        :param maximum: largest batch size
+        """
+        self.memory_budget = memory_budget
+        self.minimum = minimum
+        self.maximum = maximum
+        self.size = self._bound(size)
+        self.throughput = None
+
+    def _bound(self, size):
+        return int(min(max(size, self.minimum), self.maximum))
+
+    def _resize(self, size, reason):
+        size = self._bound(size)
+        if size != self.size:
+            logger.info("Batch size %d -> %d (%s)", self.size, size, reason)
+            self.size = size
+
+    def update(self, count, duration):
+        """Adapt the size after a batch was written
+
+        :param count: rows of the batch
+        :param duration: seconds spent writing the batch
+        :return: size of the next batch
+        """
+        rss = get_rss()
+        if self.memory_budget and rss and rss >= self.memory_budget * self.memory_threshold:
+            self._resize(self.size * self.backoff, "memory %d MB" % (rss // 2 ** 20))
+            # start measuring again from the smaller size
+            self.throughput = None
+            return self.size
+
+        if not count or duration <= 0:
+            return self.size
+
+        throughput = count / duration
+        if self.throughput is None or throughput > self.throughput * (1 + self.tolerance):
+            self._resize(self.size * self.growth, "%d rows/sec" % throughput)
+        elif throughput < self.throughput * (1 - self.tolerance):
+            self._resize(self.size / self.growth, "%d rows/sec" % throughput)
+        self.throughput = throughput
+        return self.size
@@ -0,0 +1,167 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .helpers import get_siren
+
+KEY_PREFIX = "django_sirene"
+
+# fields of the records served by the lookup API, stored as tuples in cache
+RECORD_FIELDS = (
+    "id",
+    "siret",
+    "name",
+    "commercial_name",
+    "address",
+    "zipcode",
+    "department",
+    "municipality_id",
+    "activity_id",
+    "legal_status_id",
+    "headquarter_id",
+    "is_headquarter",
+    "is_expired",
+    "creation_date",
+    "workforce",
+    "updated",
+)
+# record fields read from the legal unit of the institution
+RECORD_LEGAL_UNIT_FIELDS = {
+    "name": "legal_unit__name",
+    "legal_status_id": "legal_unit__legal_status_id",
+}
+
+
+def get_cache():
+    return caches[getattr(settings, "DJANGO_SIRENE_CACHE", "default")]
+
+
+def get_timeout():
+    return getattr(settings, "DJANGO_SIRENE_CACHE_TIMEOUT", 24 * 60 * 60)
+
+
+def get_references_check_interval():
+    return getattr(settings, "DJANGO_SIRENE_REFERENCES_CHECK_INTERVAL", 60)
+
+
+RECORDS_VERSION_KEY = "%s:records:version" % KEY_PREFIX
+
+
+def get_records_version():
+    """Marker of the cached records, part of their keys
+
+    It changes when the whole table is replaced, leaving every record cached
+    before behind.
+    """
+    cache = get_cache()
+    version = cache.get(RECORDS_VERSION_KEY)
+    if version is None:
+        # an evicted marker can't bring back the records cached before it
+        cache.add(RECORDS_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(RECORDS_VERSION_KEY)
+    return version
+
+
+def bump_records_version():
+    """Invalidate the cached records of every siret and siren
+    """
+    get_cache().set(RECORDS_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def siret_key(siret, version):
+    return "%s:siret:%s:%s" % (KEY_PREFIX, version, siret)
+
+
+def siren_key(siren, version):
+    return "%s:siren:%s:%s" % (KEY_PREFIX, version, siren)
+
+
+def to_record(values):
+    """Compact a values() dict, None (unknown siret) is cached as an empty tuple
+    """
+    if values is None:
+        return ()
+    return tuple(values[field] for field in RECORD_FIELDS)
+
+
+def from_record(record):
+    if not record:
+        return None
+    return dict(zip(RECORD_FIELDS, record))
+
+
+def invalidate_sirets(sirets):
+    """Remove cached records of sirets and of their sirens
+
+    :param sirets: iterable of sirets created or updated
+    """
+    sirets = list(sirets)
+    if not sirets:
+        return
+    version = get_records_version()
+    keys = set()
+    for siret in sirets:
+        keys.add(siret_key(siret, version))
+        keys.add(siren_key(get_siren(siret), version))
+    if keys:
+        get_cache().delete_many(list(keys))
+
+
+class ReferenceCache:
+    """Process local copy of the small reference tables
+
+    Each table is loaded once as a dict {code: instance} and reloaded only when
+    the version marker shared through Django's cache changes, which happens when
+    an import creates references. The marker is read at most once per
+    DJANGO_SIRENE_REFERENCES_CHECK_INTERVAL seconds.
+    """
+
+    version_key = "%s:references:version" % KEY_PREFIX
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._objects = {}
+        self._version = None
+        self._checked_at = None
+
+    def _check_version(self, force=False):
+        now = time.monotonic()
+        if (
+            not force
+            and self._checked_at is not None
+            and now - self._checked_at < get_references_check_interval()
+        ):
+            return
+        self._checked_at = now
+
+        version = get_cache().get(self.version_key)
+        if version != self._version:
+            self._objects = {}
+            self._version = version
+
+    def get_objects(self, model, force_check=False, using=None):
+        """Return all instances of a reference model as a dict {code: instance}
+
+        :param model: Activity, LegalStatus or Municipality
+        :param force_check: read the version marker whatever the check interval
+        :param using: alias of the database read, routed for reads when None
+        """
+        self._check_version(force=force_check)
+        objects = self._objects.get((model, using))
+        if objects is None:
+            objects = {obj.pk: obj for obj in model._base_manager.using(using)}
+            self._objects[(model, using)] = objects
+        return objects
+
+    def bump_version(self):
+        """Invalidate the copies of every process
+        """
+        get_cache().set(self.version_key, uuid.uuid4().hex, None)
+        self.clear()
+
+
+reference_cache = ReferenceCache()
@@ -1,8 +1,261 @@
-from django.db import connection
+from contextlib import contextmanager
+from io import StringIO
 
+from django.db import connections
 
-def toggle_postgres_vacuum(autovacuum_enabled):
-    with connection.cursor() as cursor:
+from .readers import READ_BUFFER_SIZE
+
+# serialization failure and deadlock detected, the transaction can be replayed
+TRANSIENT_SQLSTATES = frozenset(["40001", "40P01"])
+
+
+def is_transient_error(error):
+    """Is a database error worth retrying the transaction
+    """
+    cause = error.__cause__
+    sqlstate = getattr(cause, "pgcode", None) or getattr(cause, "sqlstate", None)
+    return sqlstate in TRANSIENT_SQLSTATES
+
+
+def copy_from(cursor, sql, data, size=READ_BUFFER_SIZE):
+    """Run a COPY ... FROM STDIN reading the file like data, with psycopg2 or psycopg
+
+    Errors are raised as Django's database errors, like those of execute.
+    """
+    with cursor.db.wrap_database_errors:
+        if hasattr(cursor, "copy_expert"):
+            # psycopg2, size is positional for the debug cursor of Django
+            cursor.copy_expert(sql, data, size)
+            return
+        with cursor.copy(sql) as copy:
+            while True:
+                chunk = data.read(size)
+                if not chunk:
+                    break
+                copy.write(chunk)
+
+
+def _copy_text(value):
+    """Value in the text format of COPY
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def toggle_postgres_vacuum(autovacuum_enabled, using="default"):
+    with connections[using].cursor() as cursor:
         cursor.execute(
             f"ALTER TABLE django_sirene_institution SET (autovacuum_enabled={autovacuum_enabled})"
         )
+
+
+class DatabaseBackend:
+    """Tuning of a database while populate_sirene_database writes to it
+
+    The base class leaves the database as it is, subclasses are picked by
+    get_backend from the vendor of the connection.
+    """
+
+    # can refresh the materialized view of InstitutionStats
+    materialized_views = False
+
+    def __init__(self, using="default"):
+        self.using = using
+        self.connection = connections[using]
+
+    def execute(self, sql):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql)
+
+    def start_import(self):
+        pass
+
+    def finish_import(self):
+        pass
+
+    def insert(self, model, objs, batch_size=None):
+        """Insert new instances of a model, within the transaction of the caller
+
+        The base class uses bulk_create, the primary keys of the instances may
+        be left unset by subclasses.
+        """
+        model._base_manager.using(self.using).bulk_create(objs, batch_size=batch_size)
+
+    @contextmanager
+    def bulk_load(self):
+        """Tune the database for the duration of an import, even a failing one
+        """
+        self.start_import()
+        try:
+            yield
+        finally:
+            self.finish_import()
+
+
+class PostgresBackend(DatabaseBackend):
+    """Autovacuum paused, commits not waiting for the WAL flush, inserts with COPY
+
+    An import interrupted by a crash can lose its last batches, which the
+    next import writes again.
+    """
+
+    materialized_views = True
+
+    def start_import(self):
+        toggle_postgres_vacuum(autovacuum_enabled=False, using=self.using)
+        # the session may not use the server default, it gets its own back
+        with self.connection.cursor() as cursor:
+            cursor.execute("SHOW synchronous_commit")
+            self.synchronous_commit = cursor.fetchone()[0]
+        self.execute("SET synchronous_commit TO OFF")
+
+    def finish_import(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config('synchronous_commit', %s, false)", [self.synchronous_commit]
+            )
+        toggle_postgres_vacuum(autovacuum_enabled=True, using=self.using)
+
+    def insert(self, model, objs, batch_size=None):
+        """Insert all the instances with a single COPY, batch_size is ignored
+
+        Values are prepared like bulk_create does, the primary keys are not
+        set on the instances.
+        """
+        if not objs:
+            return
+        opts = model._meta
+        fields = [field for field in opts.concrete_fields if field is not opts.auto_field]
+        data = StringIO()
+        for obj in objs:
+            data.write("\t".join(
+                _copy_text(field.get_db_prep_save(field.pre_save(obj, True), self.connection))
+                for field in fields
+            ))
+            data.write("\n")
+        data.seek(0)
+
+        quote_name = self.connection.ops.quote_name
+        sql = "COPY %s (%s) FROM STDIN" % (
+            quote_name(opts.db_table), ", ".join(quote_name(field.column) for field in fields)
+        )
+        with self.connection.cursor() as cursor:
+            copy_from(cursor, sql, data)
+
+
+# the migrations of django_sirene run PostgreSQL only SQL (indexes, triggers,
+# materialized view), other vendors can't hold its tables
+BACKENDS = {
+    "postgresql": PostgresBackend,
+}
+
+
+def get_backend(using="default"):
+    """Import tuning for the vendor of a database alias
+    """
+    return BACKENDS.get(connections[using].vendor, DatabaseBackend)(using)
+
+
+def get_wal_position(using="default"):
+    """Position of the write-ahead log of a PostgreSQL primary, None on other databases
+    """
+    if connections[using].vendor != "postgresql":
+        return None
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT pg_current_wal_lsn()::text")
+        return cursor.fetchone()[0]
+
+
+def has_replayed(position, using):
+    """Has a replica replayed the write-ahead log of its primary up to a position
+
+    A database which isn't a standby has nothing to replay.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT coalesce(pg_last_wal_replay_lsn() >= %s::pg_lsn, true)", [position]
+        )
+        return cursor.fetchone()[0]
+
+
+def estimate_count(model, using="default"):
+    """Estimate the number of rows of a model table from the planner statistics
+
+    Returns None when the table has never been analyzed.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+            [model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    if not row or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+def get_histogram_bounds(model, column, using="default"):
+    """Return the histogram bounds of a column from the planner statistics
+
+    Bounds split the values of the column in buckets of about the same number of
+    rows. The list is empty when the table has never been analyzed.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT histogram_bounds::text::text[] FROM pg_stats "
+            "WHERE tablename = %s AND attname = %s",
+            [model._meta.db_table, column],
+        )
+        row = cursor.fetchone()
+    if not row or not row[0]:
+        return []
+    return row[0]
+
+
+def bulk_upsert(model, rows, fields, batch_size=1000, using="default"):
+    """Insert rows, updating the existing ones, with INSERT ... ON CONFLICT DO UPDATE
+
+    :param model: model of the table, conflicts are detected on its primary key
+    :param rows: iterable of tuples of values, primary key first,
+        the last row of a duplicated key wins
+    :param fields: names of the columns of the tuples, primary key first
+    :param using: alias of the database written
+    :return: number of rows sent
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = [model._meta.get_field(field).column for field in fields]
+    pk_column = model._meta.pk.column
+    sql = "INSERT INTO %s (%s) VALUES %%s ON CONFLICT (%s) DO UPDATE SET %s" % (
+        table,
+        ", ".join(connection.ops.quote_name(column) for column in columns),
+        connection.ops.quote_name(pk_column),
+        ", ".join(
+            "%s = EXCLUDED.%s" % ((connection.ops.quote_name(column),) * 2)
+            for column in columns
+            if column != pk_column
+        ),
+    )
+    row_placeholder = "(%s)" % ", ".join(["%s"] * len(columns))
+
+    # a row can't be updated twice by the same statement
+    rows = list({row[0]: row for row in rows}.values())
+    count = 0
+    with connection.cursor() as cursor:
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            cursor.execute(
+                sql % ", ".join([row_placeholder] * len(batch)),
+                [value for row in batch for value in row],
+            )
+            count += len(batch)
+    return count
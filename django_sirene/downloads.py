@@ -0,0 +1,187 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from .readers import READ_BUFFER_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadError(Exception):
+    """A downloaded file is incomplete or corrupt"""
+
+
+def file_checksum(path, buffer_size=READ_BUFFER_SIZE):
+    """SHA-256 of a file, read by chunks
+    """
+    checksum = hashlib.sha256()
+    with open(path, "rb") as data:
+        for chunk in iter(lambda: data.read(buffer_size), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+class BandwidthLimiter:
+    """Token bucket shared by concurrent downloads
+    """
+
+    def __init__(self, rate):
+        """
+        :param rate: bytes by second allowed to all downloads together
+        """
+        self.rate = rate
+        self.allowance = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def chunk_size(self):
+        # small chunks keep the rate smooth
+        return int(min(READ_BUFFER_SIZE, max(self.rate // 10, 2 ** 14)))
+
+    def consume(self, size):
+        """Wait until size bytes can be received
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.rate, self.allowance + (now - self.last) * self.rate)
+            self.last = now
+            self.allowance -= size
+            wait = -self.allowance / self.rate if self.allowance < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class DownloadRegistry:
+    """Files downloaded to the local path, recorded in a json file
+
+    Entries are keyed by source uri, which holds the date of the stock
+    files, and store the local path, size, checksum, ETag and
+    Last-Modified of the downloaded file.
+    """
+
+    def __init__(self, path, bandwidth=None):
+        """
+        :param path: json file of the registry
+        :param bandwidth: bytes by second allowed to all downloads together
+        """
+        self.path = path
+        self.limiter = BandwidthLimiter(bandwidth) if bandwidth else None
+        # files may be downloaded by several threads
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        try:
+            with open(path) as registry_file:
+                self.entries = json.load(registry_file)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    def get(self, uri):
+        return self.entries.get(uri)
+
+    def _record(self, uri, entry):
+        with self.lock:
+            self.entries[uri] = entry
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as registry_file:
+                json.dump(self.entries, registry_file, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    def cancel(self):
+        """Stop the downloads in progress
+        """
+        self.cancelled.set()
+
+    def verify(self, uri, path):
+        """Is the file at path the intact file downloaded from uri
+        """
+        entry = self.get(uri)
+        if not entry or entry["path"] != path:
+            return False
+        try:
+            if os.path.getsize(path) != entry["size"]:
+                return False
+        except OSError:
+            return False
+        return file_checksum(path) == entry["checksum"]
+
+    def fetch(self, uri, path, force=False):
+        """Download uri to path unless the local copy is up to date
+
+        The local copy is revalidated with If-None-Match and
+        If-Modified-Since, a copy which doesn't match its recorded size and
+        checksum is downloaded again.
+
+        :return: True if the file was downloaded
+        """
+        headers = {}
+        known = not force and self.verify(uri, path)
+        if known:
+            entry = self.get(uri)
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            response = urlopen(Request(uri, headers=headers))
+        except HTTPError as error:
+            if known and error.code == 304:
+                logger.info("%s not modified, using %s", uri, path)
+                return False
+            raise
+        except URLError as error:
+            if known:
+                logger.warning("Failed to revalidate %s (%s), using %s", uri, error, path)
+                return False
+            raise
+
+        with response:
+            self._download(uri, path, response)
+        return True
+
+    def _download(self, uri, path, response):
+        logger.info("Downloading %s to %s", uri, path)
+        expected_size = response.headers.get("Content-Length")
+        checksum = hashlib.sha256()
+        size = 0
+
+        chunk_size = self.limiter.chunk_size if self.limiter else READ_BUFFER_SIZE
+
+        # the previous file stays in place until the download is complete
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as local_file:
+            for chunk in iter(lambda: response.read(chunk_size), b""):
+                if self.cancelled.is_set():
+                    break
+                local_file.write(chunk)
+                checksum.update(chunk)
+                size += len(chunk)
+                if self.limiter:
+                    self.limiter.consume(len(chunk))
+
+        if self.cancelled.is_set():
+            os.remove(tmp_path)
+            raise DownloadError("Download of %s cancelled" % uri)
+
+        if expected_size is not None and size != int(expected_size):
+            os.remove(tmp_path)
+            raise DownloadError(
+                "%s is truncated: %d bytes received, %s expected" % (uri, size, expected_size)
+            )
+
+        os.replace(tmp_path, path)
+        self._record(uri, {
+            "path": path,
+            "size": size,
+            "checksum": checksum.hexdigest(),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "downloaded": datetime.now().isoformat(),
+        })
@@ -1,6 +1,105 @@
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SIREN_LENGTH = 9
+SIRET_LENGTH = 14
+
+# sirets of La Poste don't follow the Luhn algorithm,
+# the sum of their digits is a multiple of 5
+LA_POSTE_SIREN = "356000000"
+
+# str.isdigit accepts digits of any script, like "²" or "٧"
+SIREN_RE = re.compile("[0-9]{%d}" % SIREN_LENGTH)
+SIRET_RE = re.compile("[0-9]{%d}" % SIRET_LENGTH)
+
+
 def get_siren(siret):
     return siret[:9]
 
 
 def get_nic(siret):
     return siret[9:]
+
+
+def _luhn_is_valid(number):
+    total = 0
+    for i, digit in enumerate(reversed(number)):
+        digit = int(digit)
+        if i % 2:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return total % 10 == 0
+
+
+def is_valid_siren(siren):
+    """Check the length and the Luhn checksum of a siren
+    """
+    return (
+        isinstance(siren, str)
+        and SIREN_RE.fullmatch(siren) is not None
+        and _luhn_is_valid(siren)
+    )
+
+
+def is_valid_siret(siret):
+    """Check the length and the Luhn checksum of a siret
+    """
+    if not isinstance(siret, str) or not SIRET_RE.fullmatch(siret):
+        return False
+    if get_siren(siret) == LA_POSTE_SIREN:
+        return sum(int(digit) for digit in siret) % 5 == 0
+    return _luhn_is_valid(siret)
+
+
+def _validate_sirets_numpy(sirets):
+    sirets = numpy.asarray(sirets, dtype=object)
+    valid = numpy.zeros(len(sirets), dtype=bool)
+    well_formed = numpy.fromiter(
+        (isinstance(s, str) and SIRET_RE.fullmatch(s) is not None for s in sirets),
+        dtype=bool,
+        count=len(sirets),
+    )
+    if not well_formed.any():
+        return valid
+
+    candidates = sirets[well_formed]
+    digits = (
+        numpy.frombuffer("".join(candidates).encode("ascii"), dtype=numpy.uint8)
+        .reshape(-1, SIRET_LENGTH)
+        .astype(numpy.int16)
+        - ord("0")
+    )
+    # double every second digit from the right
+    doubled = digits[:, SIRET_LENGTH % 2::2] * 2
+    digits[:, SIRET_LENGTH % 2::2] = doubled - 9 * (doubled > 9)
+    luhn = digits.sum(axis=1) % 10 == 0
+
+    la_poste = numpy.fromiter(
+        (get_siren(s) == LA_POSTE_SIREN for s in candidates), dtype=bool, count=len(candidates)
+    )
+    if la_poste.any():
+        luhn[la_poste] = numpy.fromiter(
+            (is_valid_siret(s) for s in candidates[la_poste]), dtype=bool, count=la_poste.sum()
+        )
+
+    valid[well_formed] = luhn
+    return valid
+
+
+def validate_sirets(sirets):
+    """Validate many sirets at once
+
+    Vectorized with NumPy when it is installed.
+
+    :param sirets: sequence of sirets
+    :return: list of booleans, True for valid sirets
+    """
+    if numpy is not None:
+        return _validate_sirets_numpy(list(sirets)).tolist()
+    return [is_valid_siret(siret) for siret in sirets]
@@ -3,14 +3,38 @@ import time
 from collections import defaultdict
 from datetime import datetime, timedelta
 
-from django.db.models.functions import Substr
-
-from .models import Activity, Institution, LegalStatus, Municipality
+from django.conf import settings
+from django.db import DataError, IntegrityError, OperationalError, transaction
+
+from .batching import AdaptiveBatchSize
+from .cache import invalidate_sirets, reference_cache
+from .db_utils import get_backend, is_transient_error
+from .helpers import validate_sirets
+from .models import (
+    Activity,
+    Institution,
+    InstitutionChange,
+    LegalStatus,
+    LegalUnit,
+    Municipality,
+)
+from .pipeline import Pipeline
+from .rejects import RejectWriter
+from .routers import get_import_database
+from .signals import import_finished, institutions_created, institutions_updated
 
 logger = logging.getLogger(__name__)
 
 
 class BaseImporter:
+    # column holding the date of the last update of a row
+    date_field = None
+    # column identifying the institutions of a row
+    key_field = None
+    # attribute holding the number of rows written at once, adapted at
+    # runtime when a memory budget is given
+    batch_size_attribute = None
+
     def __init__(self, rows, *args, **kwargs):
         self.rows = rows
         self.date_from = kwargs.get("date_from") or datetime.now() - timedelta(days=32)
@@ -21,26 +45,195 @@ class BaseImporter:
         self.log = kwargs.get("log", False)
 
         self.offset = kwargs.get("offset", 0)
+        # resident memory allowed to the process, in bytes
+        self.memory_budget = kwargs.get("memory_budget")
+        self.batch_size = None
+
+        # transactions failing on deadlocks or serialization are replayed
+        self.max_retries = kwargs.get("max_retries", 3)
+        self.retry_delay = kwargs.get("retry_delay", 1)
+        # institutions rejected by the database are written there
+        reject_file = kwargs.get("reject_file")
+        self.rejects = RejectWriter(reject_file) if reject_file else None
+        self.rejected_count = 0
+
+        # append the changes to the log read by downstream consumers
+        self.log_changes = kwargs.get(
+            "log_changes", getattr(settings, "DJANGO_SIRENE_CHANGE_LOG", False)
+        )
+        self.import_run = kwargs.get("import_run")
+        # alias of the database written, reads of the importer go there too
+        self.using = kwargs.get("using") or get_import_database()
+        # fastest way of the database to insert new rows
+        self.backend = get_backend(self.using)
+
+        # parse rows in a thread while batches are written
+        self.pipelined = kwargs.get("pipelined", False)
+        # batches parsed ahead of the writer
+        self.queue_size = kwargs.get("queue_size", 4)
+        self.pipeline = None
+        self.parsed = False
 
         self.relateds_to_create = set()
 
+        self.rows_count = 0
+        self.fresh_rows_count = 0
+
+    def is_fresh(self, last_update):
+        """Is a row updated since date_from
+
+        :param last_update: iso formatted date of the last update of the row
+        """
+        try:
+            return datetime.fromisoformat(last_update) >= self.date_from
+        except ValueError:
+            return False
+
     def _preload_data(self):
         """
         Treatment done once before parsing the file.
         """
         return
 
-    def _create_relateds(self):
+    def _flush(self):
+        """
+        Treatment done once all rows are parsed, write the last batches.
+        """
+        return
+
+    def _write_batch(self, write, batch, *args):
+        """Write a batch, in the calling thread when pipelined
+
+        :param write: function called with the batch and args
+        """
+        # the last batches are partial, they tell nothing about the size
+        measure = not self.parsed
+        if self.pipeline is not None:
+            self.pipeline.put((measure, write, batch) + args)
+        else:
+            self._timed_write(measure, write, batch, *args)
+
+    def _timed_write(self, measure, write, batch, *args):
+        """Write a batch and adapt the size of the next ones
+        """
+        start = time.time()
+        write(batch, *args)
+        if measure and self.batch_size is not None:
+            setattr(
+                self,
+                self.batch_size_attribute,
+                self.batch_size.update(len(batch), time.time() - start),
+            )
+
+    def _take_relateds(self):
+        """Related instances to create before the current batch
+        """
+        relateds, self.relateds_to_create = self.relateds_to_create, set()
+        return relateds
+
+    def _create_relateds(self, relateds):
         """Bulk create in DB of related instances
         """
         # filter by class type
         filtered = defaultdict(set)
-        while self.relateds_to_create:
-            related_obj = self.relateds_to_create.pop()
+        for related_obj in relateds:
             filtered[related_obj.__class__].add(related_obj)
 
+        # the process cache of references may be behind the db
         for instance, objs in filtered.items():
-            instance.objects.bulk_create(objs)
+            instance.objects.using(self.using).bulk_create(objs, ignore_conflicts=True)
+
+        if filtered:
+            reference_cache.bump_version()
+
+    def _log_changes(self, changes):
+        """Append the changes of a batch to the change log, in its transaction
+
+        :param changes: iterable of (siret, change type, changed field names)
+        """
+        if not self.log_changes:
+            return
+        InstitutionChange.objects.using(self.using).bulk_create(
+            [
+                InstitutionChange(
+                    siret=siret,
+                    change_type=change_type,
+                    changed_fields=changed_fields,
+                    import_run=self.import_run,
+                )
+                for siret, change_type, changed_fields in changes
+            ],
+            batch_size=self.db_batch_size,
+        )
+
+    def _send_written(self, signal, sirets):
+        """Invalidate the cached records of the institutions a batch wrote and
+        tell receivers, once the batch is committed
+
+        Nothing is sent when an outer transaction rolls the batch back.
+        """
+        if not sirets:
+            return
+        sirets = frozenset(sirets)
+
+        def written():
+            invalidate_sirets(sirets)
+            signal.send(sender=self.__class__, importer=self, sirets=sirets)
+
+        transaction.on_commit(written, using=self.using)
+
+    def _reject(self, institution, action, reason):
+        self.rejected_count += 1
+        logger.warning(
+            "Failed to %s %s: %s", action, getattr(institution, "siret", institution.pk), reason
+        )
+        if self.rejects:
+            self.rejects.write(institution, action, reason)
+
+    def _log_rejects(self):
+        if self.rejected_count:
+            logger.warning(
+                "%d institutions rejected by the database%s",
+                self.rejected_count,
+                ", see %s" % self.rejects.path if self.rejects else "",
+            )
+
+    def _write_in_transaction(self, write, institutions, action):
+        """Write institutions in a transaction
+
+        A batch failing on its data is bisected until the offending
+        institutions are isolated and rejected, the others are written.
+
+        :param write: function writing a list of institutions, returning their sirets
+        :param action: create or update, for the rejects
+        :return: set of written sirets
+        """
+        if not institutions:
+            return set()
+
+        attempt = 0
+        while True:
+            try:
+                with transaction.atomic(using=self.using):
+                    return set(write(institutions))
+            except (DataError, IntegrityError) as error:
+                if len(institutions) == 1:
+                    self._reject(institutions[0], action, error)
+                    return set()
+                middle = len(institutions) // 2
+                return (
+                    self._write_in_transaction(write, institutions[:middle], action)
+                    | self._write_in_transaction(write, institutions[middle:], action)
+                )
+            except OperationalError as error:
+                if not is_transient_error(error) or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                logger.warning(
+                    "Failed to %s %d institutions (%s), retry %d",
+                    action, len(institutions), error, attempt,
+                )
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
 
     def run(self):
         """
@@ -48,12 +241,38 @@ class BaseImporter:
         preload data and parse rows
         """
         start = time.time()
+        if self.memory_budget and self.batch_size_attribute:
+            self.batch_size = AdaptiveBatchSize(
+                getattr(self, self.batch_size_attribute), memory_budget=self.memory_budget
+            )
         self._preload_data()
+        if not self.pipelined:
+            self._parse_rows(start)
+        else:
+            self.pipeline = Pipeline(self.queue_size)
+            try:
+                self.pipeline.run(
+                    lambda: self._parse_rows(start),
+                    lambda item: self._timed_write(*item),
+                )
+            finally:
+                self.pipeline = None
+
+        import_finished.send(
+            sender=self.__class__,
+            importer=self,
+            rows=self.rows_count,
+            fresh_rows=self.fresh_rows_count,
+            rejected=self.rejected_count,
+        )
+
+    def _parse_rows(self, start):
         for i, row in enumerate(self.rows, 1):
 
             if i < self.offset:
                 continue
 
+            self.rows_count += 1
             self._run_row(i, row)
 
             # make some log
@@ -61,12 +280,21 @@ class BaseImporter:
                 end = time.time()
                 items_by_sec = self.log_batch_size / (end - start)
                 logger.info(
-                    "Treated %d rows (%d items/sec)", i, items_by_sec,
+                    "Treated %d rows (%d items/sec, batches of %d)",
+                    i,
+                    items_by_sec,
+                    getattr(self, self.batch_size_attribute),
                 )
                 start = time.time()
 
+        self.parsed = True
+        self._flush()
+
 
 class CSVEtablissementImporter(BaseImporter):
+    date_field = "dateDernierTraitementEtablissement"
+    key_field = "siret"
+    batch_size_attribute = "local_batch_size"
 
     CSV_AUTO_FIELDS_MAPPING = (
         ("siret", "siret"),
@@ -79,6 +307,14 @@ class CSVEtablissementImporter(BaseImporter):
         super().__init__(rows, *args, **kwargs)
 
         self.local_batch_size = kwargs.get('local_batch_size', 10000)
+        # leave institutions with an invalid siret out of the import
+        self.quarantine_invalid = kwargs.get("quarantine_invalid", False)
+
+        self.invalid_sirets_count = 0
+        self.quarantined_sirets = []
+        # institutions written, unchanged ones are not updated
+        self.created_count = 0
+        self.updated_count = 0
 
         self.to_create = []
         self.to_update = []
@@ -115,7 +351,8 @@ class CSVEtablissementImporter(BaseImporter):
             "address": address,
             "department": row.get("codeCommuneEtablissement", "")[:-3].zfill(2),
             "zipcode": row.get("codePostalEtablissement", "").zfill(5),
-            "activity_id": row.get("activitePrincipaleEtablissement", "").replace(".", "") or None
+            "activity_id": row.get("activitePrincipaleEtablissement", "").replace(".", "") or None,
+            "legal_unit_id": row["siret"][:9],
         }
         params.update(
             {
@@ -132,10 +369,19 @@ class CSVEtablissementImporter(BaseImporter):
         """
         start = time.time()
 
-        self.db_activities_code = set(Activity.objects.values_list("code", flat=True))
-        self.db_legal_statuses_code = set(LegalStatus.objects.values_list("code", flat=True))
-        self.db_municipalities_code = set(Municipality.objects.values_list("code", flat=True))
-        self.db_all_sirets = set(Institution.objects.values_list("siret", flat=True))
+        # references are read where they are written, not from a replica
+        self.db_activities_code = set(
+            Activity.objects.using(self.using).cached(force_check=True)
+        )
+        self.db_legal_statuses_code = set(
+            LegalStatus.objects.using(self.using).cached(force_check=True)
+        )
+        self.db_municipalities_code = set(
+            Municipality.objects.using(self.using).cached(force_check=True)
+        )
+        self.db_all_sirets = set(
+            Institution.objects.using(self.using).values_list("siret", flat=True)
+        )
 
         end = time.time()
         logger.debug("Preload finished after {:0.0f}s".format(end - start))
@@ -146,7 +392,8 @@ class CSVEtablissementImporter(BaseImporter):
         :param params: dict containing attr of future institution instance
         :param row: dict containing the current row from csv {column: value}
 
-        TODO: Create update method to update label of relateds
+        Activities and legal statuses should be seeded with their labels by
+        sync_sirene_references, unknown ones are created without label.
         """
         # prepare precreate municipality if needed
         municipality_id = params.get("municipality_id")
@@ -158,42 +405,116 @@ class CSVEtablissementImporter(BaseImporter):
             self.db_municipalities_code.add(municipality.code)
 
         # prepare precreate activity if needed
-        # we will get its name in an other way
+        # its name is set by sync_sirene_references
         activity_id = params.get("activity_id")
         if activity_id and activity_id not in self.db_activities_code:
             activity = Activity(code=activity_id, name="")
             self.relateds_to_create.add(activity)
             self.db_activities_code.add(activity.code)
 
-    def _create_in_db(self):
-        """Bulk create relateds in first and then Institutions
+    def _check_sirets(self, institutions):
+        """Count invalid sirets of a batch, validated at once
+
+        :return: institutions to save, without the invalid ones when quarantined
         """
-        self._create_relateds()
-        Institution.objects.bulk_create(self.to_create, batch_size=self.db_batch_size)
-        logger.info("%s institutions created", len(self.to_create))
-        self.to_create = []
+        if not institutions:
+            return institutions
+
+        valid = validate_sirets([institution.siret for institution in institutions])
+        invalid_count = valid.count(False)
+        if not invalid_count:
+            return institutions
+
+        self.invalid_sirets_count += invalid_count
+        if not self.quarantine_invalid:
+            return institutions
+
+        for institution, ok in zip(institutions, valid):
+            if not ok:
+                self.quarantined_sirets.append(institution.siret)
+                if self.rejects:
+                    self.rejects.write(institution, "quarantine", "invalid siret checksum")
+        return [institution for institution, ok in zip(institutions, valid) if ok]
+
+    def _bulk_create(self, institutions):
+        for institution in institutions:
+            # pk set by a rolled back attempt
+            institution.pk = None
+        # named by the import of the unites legales
+        LegalUnit.objects.using(self.using).bulk_create(
+            [LegalUnit(siren=siren) for siren in {i.legal_unit_id for i in institutions}],
+            batch_size=self.db_batch_size,
+            ignore_conflicts=True,
+        )
+        self.backend.insert(Institution, institutions, batch_size=self.db_batch_size)
+        sirets = [institution.siret for institution in institutions]
+        self._log_changes((siret, InstitutionChange.CREATED, []) for siret in sirets)
+        return sirets
+
+    def _bulk_update(self, institutions):
+        changes = {}
+        updated_sirets = Institution.objects.using(self.using).bulk_update_no_pk(
+            institutions, batch_size=self.db_batch_size, changes=changes
+        )
+        expired_sirets = {
+            institution.siret for institution in institutions if institution.is_expired
+        }
+        self._log_changes(
+            (
+                siret,
+                InstitutionChange.EXPIRED
+                if siret in expired_sirets and "is_expired" in changed_fields
+                else InstitutionChange.UPDATED,
+                changed_fields,
+            )
+            for siret, changed_fields in changes.items()
+        )
+        return updated_sirets
 
-    def _update_db(self):
+    def _create_in_db(self, institutions, relateds):
+        """Bulk create relateds in first and then Institutions
+        """
+        institutions = self._check_sirets(institutions)
+        self._create_relateds(relateds)
+        created_sirets = self._write_in_transaction(self._bulk_create, institutions, "create")
+        self._send_written(institutions_created, created_sirets)
+        self.created_count += len(created_sirets)
+        logger.info("%s institutions created", len(created_sirets))
+
+    def _update_db(self, institutions, relateds):
         """Bulk create relateds in first and then update Institutions
         """
-        self._create_relateds()
-        Institution.objects.bulk_update_no_pk(self.to_update, batch_size=self.db_batch_size)
-        logger.info("%s institutions updated", len(self.to_update))
-        self.to_update = []
+        institutions = self._check_sirets(institutions)
+        self._create_relateds(relateds)
+        updated_sirets = self._write_in_transaction(self._bulk_update, institutions, "update")
+        self._send_written(institutions_updated, updated_sirets)
+        self.updated_count += len(updated_sirets)
+        logger.info(
+            "%s institutions updated, %s unchanged",
+            len(updated_sirets), len(institutions) - len(updated_sirets),
+        )
+
+    def _flush_to_create(self):
+        institutions, self.to_create = self.to_create, []
+        self._write_batch(self._create_in_db, institutions, self._take_relateds())
+
+    def _flush_to_update(self):
+        institutions, self.to_update = self.to_update, []
+        self._write_batch(self._update_db, institutions, self._take_relateds())
+
+    def _flush(self):
+        # Create/update remaining objects
+        self._flush_to_create()
+        self._flush_to_update()
 
     def _run_row(self, index, row):
         """
         Treatment for 1 row of the file
         """
         # Filter by date to lighten the import
-        try:
-            last_update = datetime.fromisoformat(row["dateDernierTraitementEtablissement"])
-            is_fresh = last_update and last_update >= self.date_from
-        except ValueError:
-            is_fresh = False
-
-        if not is_fresh and not self.force:
+        if not self.force and not self.is_fresh(row[self.date_field]):
             return
+        self.fresh_rows_count += 1
 
         already_exists = row["siret"] in self.db_all_sirets
         params = self._prepare_institution_params(row)
@@ -207,19 +528,36 @@ class CSVEtablissementImporter(BaseImporter):
 
         # treat in batch to control memory consumption
         if len(self.to_create) >= self.local_batch_size:
-            self._create_in_db()
+            self._flush_to_create()
         if len(self.to_update) >= self.local_batch_size:
-            self._update_db()
+            self._flush_to_update()
 
     def run(self):
         super().run()
 
-        # Create/update remaining objects
-        self._create_in_db()
-        self._update_db()
+        logger.info(
+            "%d institutions created, %d updated", self.created_count, self.updated_count
+        )
+        if self.invalid_sirets_count:
+            logger.warning(
+                "%d institutions with an invalid siret, %d quarantined",
+                self.invalid_sirets_count,
+                len(self.quarantined_sirets),
+            )
+            if self.quarantined_sirets:
+                logger.debug("Quarantined sirets: %s", ", ".join(self.quarantined_sirets))
+        self._log_rejects()
+
+
+# institution fields read from the fields of the legal unit
+INSTITUTION_FIELDS = {"name": "name", "legal_status_id": "legal_status"}
 
 
 class CSVUniteLegaleImporter(BaseImporter):
+    date_field = "dateDernierTraitementUniteLegale"
+    key_field = "siren"
+    batch_size_attribute = "process_batch_size"
+
     def __init__(self, rows, *args, **kwargs):
         super().__init__(rows, *args, **kwargs)
 
@@ -227,31 +565,43 @@ class CSVUniteLegaleImporter(BaseImporter):
 
         self.db_legal_statuses_code = set()
 
-        self.to_update = []
         self.batch = []
+        self.db_batch_legal_units = {}
+        self.db_batch_minimal_data = defaultdict(list)
+        # fields of the legal units which changed, by siren
+        self.legal_unit_changes = {}
+        # institutions whose headquarter changed, by siren
+        self.headquarter_changes = {}
+        # rows without any change, left unwritten
+        self.skipped_count = 0
+        # rows of sirens without institution
+        self.unknown_count = 0
 
     def _preload_data(self):
         start = time.time()
 
-        self.db_legal_statuses_code = set(LegalStatus.objects.values_list("code", flat=True))
+        self.db_legal_statuses_code = set(
+            LegalStatus.objects.using(self.using).cached(force_check=True)
+        )
 
         end = time.time()
         logger.debug("Preload finished after {:0.0f}s".format(end - start))
 
     def prepare_data_for_batch(self, sirens):
         """
-        Retrieve relevant institutions for the batch
+        Retrieve the legal units of the batch and their institutions
         """
         start = time.time()
 
+        self.db_batch_legal_units = LegalUnit.objects.using(self.using).in_bulk(sirens)
         db_batch_data = (
-            Institution.objects.annotate(db_siren=Substr("siret", 1, 9))
-            .filter(db_siren__in=sirens)
-            .only("siret", "pk")
+            Institution.objects.using(self.using)
+            .filter(legal_unit__in=list(self.db_batch_legal_units))
+            .only("siret", "pk", "legal_unit_id", "is_headquarter", "headquarter_id")
         )
         self.db_batch_minimal_data = defaultdict(list)
         for obj in db_batch_data:
-            self.db_batch_minimal_data[obj.db_siren].append(obj)
+            self.db_batch_minimal_data[obj.legal_unit_id].append(obj)
 
         end = time.time()
         logger.debug("Preload for batch finished after {:0.0f}s".format(end - start))
@@ -270,73 +620,153 @@ class CSVUniteLegaleImporter(BaseImporter):
             self.relateds_to_create.add(legal_status)
             self.db_legal_statuses_code.add(legal_status.code)
 
+    def update_legal_unit(self, legal_unit, row):
+        """Set the values of the row on the legal unit
+
+        :return: names of the fields which changed
+        """
+        values = {
+            "name": row["name"],
+            "legal_status_id": row["legal_status_id"] or None,
+            "headquarter_nic": row["nic"],
+        }
+        changed = [field for field, value in values.items() if getattr(legal_unit, field) != value]
+        for field in changed:
+            setattr(legal_unit, field, values[field])
+        if changed:
+            legal_unit.updated = datetime.now()
+        return changed
+
     def update_headquarter(self, headquarter, institutions):
+        """Point the institutions of a siren to their headquarter
+
+        :return: institutions which changed
+        """
+        changed = []
         for institution in institutions:
             if institution.pk == headquarter.pk:
-                institution.is_headquarter = True
-                institution.headquarter_id = None
+                is_headquarter, headquarter_id = True, None
             else:
-                institution.is_headquarter = False
-                institution.headquarter_id = headquarter.pk
-
-    def _update_db(self):
-        """Bulk create relateds in first and then Institutions
+                is_headquarter, headquarter_id = False, headquarter.pk
+            if (institution.is_headquarter, institution.headquarter_id) != (
+                is_headquarter, headquarter_id
+            ):
+                institution.is_headquarter = is_headquarter
+                institution.headquarter_id = headquarter_id
+                institution.updated = datetime.now()
+                changed.append(institution)
+        return changed
+
+    def _bulk_update(self, legal_units):
+        """Update the legal units which changed and the institutions whose headquarter changed
+
+        :return: sirets of the institutions of the legal units written and
+            of the institutions written
         """
-        self._create_relateds()
-        Institution.objects.bulk_update(
-            self.to_update,
-            ["name", "legal_status_id", "is_headquarter", "headquarter_id", "updated"],
+        changed_legal_units = [
+            legal_unit for legal_unit in legal_units if self.legal_unit_changes[legal_unit.siren]
+        ]
+        LegalUnit.objects.using(self.using).bulk_update(
+            changed_legal_units,
+            ["name", "legal_status_id", "headquarter_nic", "updated"],
             batch_size=self.db_batch_size,
         )
-        logger.info("%s institutions updated", len(self.to_update))
-        self.to_update = []
+        moved = [
+            institution
+            for legal_unit in legal_units
+            for institution in self.headquarter_changes.get(legal_unit.siren, [])
+        ]
+        Institution.objects.using(self.using).bulk_update(
+            moved,
+            ["is_headquarter", "headquarter_id", "updated"],
+            batch_size=self.db_batch_size,
+        )
+
+        moved_sirets = {institution.siret for institution in moved}
+        changes = {}
+        for legal_unit in changed_legal_units:
+            # the nic of the headquarter shows through the institutions which moved
+            changed_fields = [
+                INSTITUTION_FIELDS[field]
+                for field in self.legal_unit_changes[legal_unit.siren]
+                if field in INSTITUTION_FIELDS
+            ]
+            for institution in self.db_batch_minimal_data[legal_unit.siren]:
+                changes[institution.siret] = list(changed_fields)
+        for siret in moved_sirets:
+            changes.setdefault(siret, []).extend(["is_headquarter", "headquarter"])
+        self._log_changes(
+            (siret, InstitutionChange.UPDATED, changed_fields)
+            for siret, changed_fields in changes.items()
+            if changed_fields
+        )
+        # records carry the last update of the legal unit
+        return list(changes)
 
-    def process_batch(self):
+    def _update_db(self, legal_units):
+        """Bulk create relateds in first and then update legal units
+        """
+        self._create_relateds(self._take_relateds())
+        updated_sirets = self._write_in_transaction(self._bulk_update, legal_units, "update")
+        self._send_written(institutions_updated, updated_sirets)
+        logger.info(
+            "%s legal units updated, %s institutions", len(legal_units), len(updated_sirets)
+        )
+
+    def process_batch(self, batch):
         """
         Treatment for a batch :
         retrieve relevant institutions and update them
         """
         # prepare data
-        batch_sirens = [row["siren"] for row in self.batch]
+        batch_sirens = [row["siren"] for row in batch]
         self.prepare_data_for_batch(batch_sirens)
 
-        for row in self.batch:
+        legal_units = []
+        self.legal_unit_changes = {}
+        self.headquarter_changes = {}
+        for row in batch:
+            # legal units are created with the institutions
+            legal_unit = self.db_batch_legal_units.get(row["siren"])
+            if legal_unit is None:
+                self.unknown_count += 1
+                continue
+
+            # update name and legal status once for all institutions
+            self._prepare_relateds({"legal_status_id": row["legal_status_id"]})
+            changed_fields = self.update_legal_unit(legal_unit, row)
+
             institutions = self.db_batch_minimal_data[row["siren"]]
-            headquarter = None
-            # update name and legal status
-            # and get headquarter
-            for insitution in institutions:
-                insitution.name = row["name"]
-                insitution.updated = datetime.now()
-                insitution.legal_status_id = row["legal_status_id"] or None
-                self._prepare_relateds({"legal_status_id": row["legal_status_id"]})
-                if insitution.siret == row["siren"] + row["nic"]:
-                    headquarter = insitution
-
-            if headquarter:
-                self.update_headquarter(headquarter, institutions)
-
-            self.to_update.extend(institutions)
+            headquarter_siret = row["siren"] + row["nic"]
+            moved = []
+            for institution in institutions:
+                if institution.siret == headquarter_siret:
+                    moved = self.update_headquarter(institution, institutions)
+                    break
+
+            # unchanged rows would only leave dead tuples behind
+            if not changed_fields and not moved:
+                self.skipped_count += 1
+                continue
+            self.legal_unit_changes[row["siren"]] = changed_fields
+            self.headquarter_changes[row["siren"]] = moved
+            legal_units.append(legal_unit)
 
         # apply
-        self._update_db()
+        self._update_db(legal_units)
 
-        # reset
-        self.batch = []
+    def _flush(self):
+        batch, self.batch = self.batch, []
+        self._write_batch(self.process_batch, batch)
 
     def _run_row(self, index, row):
         """
         Treatment for 1 row of the file
         """
         # Filter by date to lighten the import
-        try:
-            last_update = datetime.fromisoformat(row["dateDernierTraitementUniteLegale"])
-            is_fresh = last_update and last_update >= self.date_from
-        except ValueError:
-            is_fresh = False
-
-        if not is_fresh and not self.force:
+        if not self.force and not self.is_fresh(row[self.date_field]):
             return
+        self.fresh_rows_count += 1
 
         # get data
         self.batch.append(
@@ -349,10 +779,16 @@ class CSVUniteLegaleImporter(BaseImporter):
         )
 
         # process
-        if len(self.batch) % self.process_batch_size == 0:
-            self.process_batch()
+        if len(self.batch) >= self.process_batch_size:
+            self._flush()
 
     def run(self):
         super().run()
 
-        self.process_batch()
+        if self.skipped_count or self.unknown_count:
+            logger.info(
+                "%d unites legales unchanged, %d without institution",
+                self.skipped_count,
+                self.unknown_count,
+            )
+        self._log_rejects()
@@ -0,0 +1,96 @@
+import asyncio
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+
+def get_batch_window():
+    return getattr(settings, "DJANGO_SIRENE_LOOKUP_BATCH_WINDOW", 0.005)
+
+
+class BatchLoader:
+    """Coalesce the lookups awaited in a short window into a single fetch
+
+    Every key requested during the window by any coroutine of the event loop is
+    fetched by one call of ``fetch``, run in a thread, so concurrent lookups share
+    one database round trip.
+
+    :param fetch: sync callable taking a list of keys, returning a dict {key: value}
+    :param max_batch_size: fetch without waiting the end of the window past this size
+    """
+
+    def __init__(self, fetch, max_batch_size=1000):
+        self.fetch = fetch
+        self.max_batch_size = max_batch_size
+        self.pending = {}
+        self.flush_task = None
+        # keep a reference on running flushes
+        self.running = set()
+
+    async def load_many(self, keys):
+        """Return a dict {key: value} of found keys
+        """
+        loop = asyncio.get_running_loop()
+        futures = {}
+        for key in set(keys):
+            future = self.pending.get(key)
+            if future is None:
+                future = self.pending[key] = loop.create_future()
+            futures[key] = future
+
+        if len(self.pending) >= self.max_batch_size:
+            self.flush_task = None
+            self._run(loop.create_task(self._flush(self._take_pending())))
+        elif self.pending and self.flush_task is None:
+            self.flush_task = self._run(loop.create_task(self._flush_later()))
+
+        values = await asyncio.gather(*futures.values())
+        return {key: value for key, value in zip(futures, values) if value is not None}
+
+    async def load(self, key):
+        return (await self.load_many([key])).get(key)
+
+    def _run(self, task):
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+        return task
+
+    def _take_pending(self):
+        pending, self.pending = self.pending, {}
+        return pending
+
+    async def _flush_later(self):
+        await asyncio.sleep(get_batch_window())
+        # a flush at max size may have replaced this task by a newer one
+        if self.flush_task is asyncio.current_task():
+            self.flush_task = None
+            await self._flush(self._take_pending())
+
+    async def _flush(self, pending):
+        if not pending:
+            return
+        try:
+            values = await sync_to_async(self.fetch)(list(pending))
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in pending.items():
+            if not future.done():
+                future.set_result(values.get(key))
+
+
+# loaders are bound to the event loop their futures belong to
+_loaders = weakref.WeakKeyDictionary()
+
+
+def get_loader(name, fetch):
+    """Return the loader called name for the running event loop
+    """
+    loop_loaders = _loaders.setdefault(asyncio.get_running_loop(), {})
+    loader = loop_loaders.get(name)
+    if loader is None:
+        loader = loop_loaders[name] = BatchLoader(fetch)
+    return loader
@@ -0,0 +1,19 @@
+from django.db.models import Lookup
+
+
+class Any(Lookup):
+    """``field = ANY(%s)`` with the values sent as a single array parameter
+
+    Unlike ``__in`` the statement doesn't grow with the number of values.
+    """
+
+    lookup_name = "any"
+    prepare_rhs = False
+
+    def get_db_prep_lookup(self, value, connection):
+        return ("%s", [list(value)])
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return "%s = ANY(%s)" % (lhs, rhs), list(lhs_params) + list(rhs_params)
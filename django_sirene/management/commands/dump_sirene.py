@@ -0,0 +1,167 @@
+import csv
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_sirene.models import Institution
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+
+# (queryset field, column name, parquet type name)
+EXPORT_FIELDS = (
+    ("siret", "siret", "string"),
+    ("legal_unit__name", "name", "string"),
+    ("commercial_name", "commercial_name", "string"),
+    ("address", "address", "string"),
+    ("zipcode", "zipcode", "string"),
+    ("department", "department", "string"),
+    ("municipality_id", "municipality_code", "string"),
+    ("municipality__name", "municipality_name", "string"),
+    ("activity_id", "activity_code", "string"),
+    ("activity__name", "activity_name", "string"),
+    ("legal_unit__legal_status_id", "legal_status_code", "string"),
+    ("legal_unit__legal_status__name", "legal_status_name", "string"),
+    ("is_headquarter", "is_headquarter", "bool_"),
+    ("is_expired", "is_expired", "bool_"),
+    ("workforce", "workforce", "string"),
+    ("creation_date", "creation_date", "date32"),
+    ("created", "created", "timestamp"),
+    ("updated", "updated", "timestamp"),
+)
+
+
+class CSVWriter:
+    def __init__(self, output):
+        self.writer = csv.writer(output)
+        self.writer.writerow([column for _, column, _ in EXPORT_FIELDS])
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        return
+
+
+class ParquetWriter:
+    """Write each chunk of rows as a parquet row group
+    """
+
+    def __init__(self, output):
+        fields = []
+        for _, column, type_name in EXPORT_FIELDS:
+            if type_name == "timestamp":
+                type_ = pyarrow.timestamp("us")
+            else:
+                type_ = getattr(pyarrow, type_name)()
+            fields.append(pyarrow.field(column, type_))
+        self.schema = pyarrow.schema(fields)
+        self.writer = pyarrow.parquet.ParquetWriter(output, self.schema)
+
+    def write(self, rows):
+        columns = list(zip(*rows))
+        self.writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+            schema=self.schema,
+        ))
+
+    def close(self):
+        self.writer.close()
+
+
+class Command(BaseCommand):
+    help = "Export institutions with their activity, municipality and legal status"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "output",
+            help="File to write, - for the standard output (csv only)",
+        )
+        parser.add_argument(
+            "--format",
+            choices=("csv", "parquet"),
+            default="csv",
+            dest="format",
+            help="Output format, parquet requires pyarrow",
+        )
+        parser.add_argument(
+            "--actives",
+            action="store_true",
+            dest="actives",
+            help="Export only institutions which are not expired",
+        )
+        parser.add_argument(
+            "--headquarters",
+            action="store_true",
+            dest="headquarters",
+            help="Export only headquarters",
+        )
+        parser.add_argument(
+            "--department",
+            action="append",
+            dest="departments",
+            help="Export only institutions of this department, can be repeated",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            action="store",
+            type=int,
+            default=10000,
+            dest="chunk_size",
+            help="Rows fetched from the server side cursor at once",
+        )
+
+    def get_queryset(self, **options):
+        queryset = Institution.objects.all()
+        if options["actives"]:
+            queryset = queryset.actives()
+        if options["headquarters"]:
+            queryset = queryset.headquarters()
+        if options["departments"]:
+            queryset = queryset.filter(department__in=options["departments"])
+        return queryset.order_by().values_list(*[field for field, _, _ in EXPORT_FIELDS])
+
+    def _iter_chunks(self, queryset, chunk_size):
+        chunk = []
+        # server side cursor, memory doesn't grow with the table
+        for row in queryset.iterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _dump(self, writer, **options):
+        start = time.time()
+        count = 0
+        for chunk in self._iter_chunks(self.get_queryset(**options), options["chunk_size"]):
+            writer.write(chunk)
+            count += len(chunk)
+            logger.info("%d institutions exported", count)
+        writer.close()
+        logger.info("Export finished after {:0.0f}s".format(time.time() - start))
+        return count
+
+    def handle(self, *args, **options):
+        output = options["output"]
+        if options["format"] == "parquet":
+            if pyarrow is None:
+                raise CommandError("pyarrow is required to export to parquet")
+            if output == "-":
+                raise CommandError("parquet can't be written to the standard output")
+            count = self._dump(ParquetWriter(output), **options)
+        elif output == "-":
+            count = self._dump(CSVWriter(self.stdout), **options)
+        else:
+            with open(output, "w", newline="", encoding="utf-8") as csv_file:
+                count = self._dump(CSVWriter(csv_file), **options)
+
+        logger.info("%d institutions exported to %s", count, output)
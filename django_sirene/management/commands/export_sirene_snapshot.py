@@ -0,0 +1,32 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from django_sirene.routers import get_import_database
+from django_sirene.snapshots import export_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the SIRENE tables to a directory with PostgreSQL binary COPY, "
+        "to be loaded by load_sirene_snapshot in another environment"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="Directory of the snapshot, created if needed")
+        parser.add_argument(
+            "--database",
+            action="store",
+            dest="database",
+            help="Alias of the database exported, default to DJANGO_SIRENE_IMPORT_DATABASE",
+        )
+
+    def handle(self, *args, **options):
+        manifest = export_snapshot(
+            options["directory"], using=options["database"] or get_import_database()
+        )
+        for table in manifest["tables"]:
+            logger.info("%s: %d rows", table["table"], table["rows"])
+        logger.info("Snapshot exported to %s", options["directory"])
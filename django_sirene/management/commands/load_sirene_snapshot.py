@@ -0,0 +1,46 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_sirene.routers import get_import_database
+from django_sirene.snapshots import SnapshotError, load_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Replace the SIRENE tables with a snapshot written by export_sirene_snapshot, "
+        "indexes are built once the tables are loaded"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="Directory of the snapshot")
+        parser.add_argument(
+            "--database",
+            action="store",
+            dest="database",
+            help="Alias of the database loaded, default to DJANGO_SIRENE_IMPORT_DATABASE",
+        )
+        parser.add_argument(
+            "--skip-checksums",
+            action="store_false",
+            dest="verify",
+            help="Do not compare the files with the checksums of the manifest",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            manifest = load_snapshot(
+                options["directory"],
+                using=options["database"] or get_import_database(),
+                verify=options["verify"],
+            )
+        except SnapshotError as e:
+            raise CommandError(str(e))
+        logger.info(
+            "Snapshot of %s loaded: %d institutions",
+            manifest["created"],
+            sum(table["rows"] for table in manifest["tables"]
+                if table["table"] == "django_sirene_institution"),
+        )
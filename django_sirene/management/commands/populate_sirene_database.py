@@ -1,16 +1,21 @@
 import csv
-import io
 import logging
 import os
 import zipfile
-from datetime import datetime
-from urllib.request import urlretrieve
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.utils import timezone
 
 from django_sirene.importers import CSVEtablissementImporter, CSVUniteLegaleImporter
-from django_sirene.db_utils import toggle_postgres_vacuum
+from django_sirene.db_utils import get_backend
+from django_sirene.downloads import DownloadRegistry
+from django_sirene.models import ImportRun, Institution, InstitutionStats
+from django_sirene.planning import SiretMembership, plan_import
+from django_sirene.readers import open_text, open_zip_member
+from django_sirene.routers import get_import_database
 
 logger = logging.getLogger(__name__)
 
@@ -25,11 +30,21 @@ filename_stockunitelegale = "unitelegale.zip"
 class Command(BaseCommand):
     help = "Import SIREN database"
     local_csv_path = getattr(settings, "DJANGO_SIRENE_LOCAL_PATH", "/tmp")
+    # kilobytes by second allowed to all downloads together
+    max_bandwidth = None
+    # shared by the download threads, created before they start
+    registry = None
 
     def add_arguments(self, parser):
         parser.add_argument(
             "--dry", action="store_true", dest="dry", help="Just show filename that will be parsed",
         )
+        parser.add_argument(
+            "--plan",
+            action="store_true",
+            dest="plan",
+            help="Read the files and show what would be imported, without writing",
+        )
         parser.add_argument(
             "--force",
             "-f",
@@ -61,6 +76,74 @@ class Command(BaseCommand):
             dest="offset_stock",
             help=("Ignore the first rows of the stock unité legale file"),
         )
+        parser.add_argument(
+            "--quarantine-invalid-sirets",
+            action="store_true",
+            dest="quarantine_invalid",
+            help="Do not import institutions whose siret checksum is invalid",
+        )
+        parser.add_argument(
+            "--reject-file",
+            action="store",
+            dest="reject_file",
+            help=("CSV file where institutions rejected by the database are appended "
+                  "with the reason. Default to sirene_rejects.csv in DJANGO_SIRENE_LOCAL_PATH"),
+        )
+        parser.add_argument(
+            "--max-bandwidth",
+            action="store",
+            type=int,
+            dest="max_bandwidth",
+            help="Kilobytes by second allowed to the downloads together",
+        )
+        parser.add_argument(
+            "--decompressor",
+            action="store",
+            dest="decompressor",
+            help=("Command extracting the csv to its standard output, called with the zip "
+                  "path and the csv name, e.g. 'unzip -p'"),
+        )
+        parser.add_argument(
+            "--pipelined",
+            action="store_true",
+            dest="pipelined",
+            help="Parse the file in a thread while batches are written to the database",
+        )
+        parser.add_argument(
+            "--memory-budget",
+            action="store",
+            type=int,
+            dest="memory_budget",
+            help=("Memory in MB allowed to the import, batch sizes are then adapted "
+                  "to the database throughput while staying under it"),
+        )
+        parser.add_argument(
+            "--local-batch-size",
+            action="store",
+            type=int,
+            dest="local_batch_size",
+            help="Institutions kept in memory before being written, default 10000",
+        )
+        parser.add_argument(
+            "--db-batch-size",
+            action="store",
+            type=int,
+            dest="db_batch_size",
+            help="Institutions written by query, default 100",
+        )
+        parser.add_argument(
+            "--process-batch-size",
+            action="store",
+            type=int,
+            dest="process_batch_size",
+            help="Unités légales processed at once, default 2000",
+        )
+        parser.add_argument(
+            "--database",
+            action="store",
+            dest="database",
+            help="Alias of the database to import into, default to DJANGO_SIRENE_IMPORT_DATABASE",
+        )
         parser.add_argument(
             "--date-from",
             action="store",
@@ -77,56 +160,104 @@ class Command(BaseCommand):
                   "Format 1970-12-31"),
         )
 
-    def _import_csv(self, data, importer_class, **options):
-        rows = io.TextIOWrapper(data, "iso-8859-1")
-        rows = csv.DictReader(rows, delimiter=",")
-
+    def _get_date_from(self, **options):
         try:
-            date_from = datetime.strptime(options["date_from"], "%d/%m/%Y")
+            return datetime.strptime(options["date_from"], "%d/%m/%Y")
         except (TypeError, ValueError):
-            date_from = None
+            return None
+
+    def _import_csv(self, data, importer_class, filename=None, **options):
+        rows = csv.DictReader(open_text(data), delimiter=",")
 
-        importer_class(
+        # importers keep their own defaults for sizes not given
+        batch_sizes = {
+            name: options[name]
+            for name in ("local_batch_size", "db_batch_size", "process_batch_size")
+            if options.get(name)
+        }
+        memory_budget = options.get("memory_budget")
+
+        # throughputs of past imports estimate the duration of --plan,
+        # logged changes refer to their import
+        import_run = ImportRun.objects.using(options.get("database")).create(
+            filename=filename or ""
+        )
+        importer = importer_class(
             rows,
-            date_from=date_from,
+            date_from=self._get_date_from(**options),
             offset=options.get("offset", "0"),
             force=options.get("force"),
+            quarantine_invalid=options.get("quarantine_invalid"),
+            pipelined=options.get("pipelined"),
+            memory_budget=memory_budget * 2 ** 20 if memory_budget else None,
+            reject_file=options.get("reject_file") or os.path.join(
+                self.local_csv_path, "sirene_rejects.csv"
+            ),
+            import_run=import_run,
+            using=options.get("database"),
             log=True,
-        ).run()
-
-    def _download_file(self, uri, filepath):
-        """Retrieve a file from a uri
+            **batch_sizes,
+        )
+        importer.run()
+        import_run.rows = importer.rows_count
+        import_run.fresh_rows = importer.fresh_rows_count
+        import_run.finished = timezone.now()
+        import_run.save()
 
-        :param uri: uri of file to download
-        :param filepath: filepath to store downloaded file
+    def _get_membership(self, database=None):
+        """Sirets in DB, loaded once for both files
         """
-        logger.debug("Downloading %s ...", uri)
-        urlretrieve(uri, filepath)
+        if getattr(self, "_membership", None) is None:
+            self._membership = SiretMembership(Institution.objects.using(database))
+        return self._membership
+
+    def _plan_csv(self, data, importer_class, filename=None, **options):
+        plan = plan_import(
+            open_text(data),
+            importer_class,
+            self._get_membership(options.get("database")),
+            date_from=self._get_date_from(**options),
+            force=options.get("force"),
+        )
+        self.stdout.write(
+            "%s: %d rows, %d fresh, %d to create, %d to compare for update, %d ignored"
+            % (filename, plan.rows, plan.fresh_rows, plan.to_create, plan.to_compare, plan.ignored)
+        )
+
+        throughput = ImportRun.objects.using(options.get("database")).throughput(filename)
+        if throughput:
+            duration = timedelta(seconds=round(plan.fresh_rows / throughput))
+            self.stdout.write(
+                "%s: estimated duration %s (%d rows/sec)" % (filename, duration, throughput)
+            )
+        else:
+            self.stdout.write("%s: no recorded import to estimate the duration" % filename)
+        return plan
+
+    def _create_registry(self):
+        return DownloadRegistry(
+            os.path.join(self.local_csv_path, "sirene_downloads.json"),
+            bandwidth=self.max_bandwidth * 1024 if self.max_bandwidth else None,
+        )
 
     def _get_file(self, filename, uri, **options):
+        """Download the file unless the local copy is intact and up to date
+        """
         filepath = os.path.join(self.local_csv_path, filename)
+        self.registry.fetch(uri, filepath, force=options.get("force"))
+        return zipfile.ZipFile(filepath, "r")
 
-        if options.get("force"):
-            logger.debug("Downloading data to file %s", filepath)
-            self._download_file(uri, filepath)
-            return zipfile.ZipFile(filepath, "r")
-
-        try:
-            zfile = zipfile.ZipFile(filepath, "r")
-            logger.debug("Using known file %s", filepath)
-            return zfile
-        except (zipfile.BadZipFile, FileNotFoundError):
-            logger.debug("Failed to open local file %s", filepath)
-            logger.debug("Downloading data to file %s", filepath)
-            self._download_file(uri, filepath)
-            return zipfile.ZipFile(filepath, "r")
-
-    def populate_with_file(self, filename, uri, importer_class, offset="0", **options):
+    def populate_with_file(self, filename, uri, importer_class, offset="0", zfile=None,
+                           **options):
+        """
+        :param zfile: the file when already downloaded
+        """
         if options["dry"]:
             print("%s in %s" % (uri, filename))
             return
 
-        zfile = self._get_file(filename, uri, **options)
+        if zfile is None:
+            zfile = self._get_file(filename, uri, **options)
         csv_filename = zfile.namelist()[0]
         assert os.path.splitext(csv_filename)[-1].lower() == ".csv"
 
@@ -137,8 +268,14 @@ class Command(BaseCommand):
             offset = 0
         options["offset"] = offset
 
-        with zfile.open(csv_filename) as csv_file:
-            self._import_csv(csv_file, importer_class, **options)
+        if options.get("plan"):
+            with open_zip_member(zfile, csv_filename, options.get("decompressor")) as csv_file:
+                self._plan_csv(csv_file, importer_class, filename=filename, **options)
+            zfile.close()
+            return
+
+        with open_zip_member(zfile, csv_filename, options.get("decompressor")) as csv_file:
+            self._import_csv(csv_file, importer_class, filename=filename, **options)
         zfile.close()
 
         logger.info("%s imported", csv_filename)
@@ -152,29 +289,59 @@ class Command(BaseCommand):
         uri_stocketablissement_dated = uri_stocketablissement % date_file
         uri_stockunitelegale_dated = uri_stockunitelegale % date_file
 
+        stocks = []
         if not options["skip_stocketablissement"]:
-            self.populate_with_file(
+            stocks.append((
                 filename_stocketablissement,
                 uri_stocketablissement_dated,
                 CSVEtablissementImporter,
-                offset=options.get("offset_etablissement") or 0,
-                **options,
-            )
-
+                options.get("offset_etablissement") or 0,
+            ))
         if not options["skip_stockunitelegale"]:
-            self.populate_with_file(
+            stocks.append((
                 filename_stockunitelegale,
                 uri_stockunitelegale_dated,
                 CSVUniteLegaleImporter,
-                offset=options.get("offset_stock") or 0,
-                **options,
-            )
+                options.get("offset_stock") or 0,
+            ))
+
+        if options["dry"] or not stocks:
+            for filename, uri, importer_class, offset in stocks:
+                self.populate_with_file(filename, uri, importer_class, offset=offset, **options)
+            return
+
+        self.max_bandwidth = options.get("max_bandwidth")
+        self.registry = self._create_registry()
+        # files are downloaded together while the first one is imported
+        with ThreadPoolExecutor(max_workers=len(stocks)) as executor:
+            downloads = [
+                executor.submit(self._get_file, filename, uri, **options)
+                for filename, uri, _, _ in stocks
+            ]
+            try:
+                for (filename, uri, importer_class, offset), download in zip(stocks, downloads):
+                    self.populate_with_file(
+                        filename,
+                        uri,
+                        importer_class,
+                        offset=offset,
+                        zfile=download.result(),
+                        **options,
+                    )
+            except BaseException:
+                # don't wait for the other downloads
+                self.registry.cancel()
+                raise
 
     def handle(self, *args, **options):
-        try:
-            toggle_postgres_vacuum(autovacuum_enabled=False)
+        options["database"] = options.get("database") or get_import_database()
+        if options.get("plan"):
+            self._handle(*args, **options)
+            return
+
+        backend = get_backend(options["database"])
+        with backend.bulk_load():
             self._handle(*args, **options)
-        except Exception:
-            raise
-        finally:
-            toggle_postgres_vacuum(autovacuum_enabled=True)
+        if not options.get("dry") and backend.materialized_views:
+            InstitutionStats.objects.using(options["database"]).refresh()
+            logger.info("Institution stats refreshed")
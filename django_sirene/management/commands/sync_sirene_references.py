@@ -0,0 +1,100 @@
+import csv
+import logging
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_sirene.cache import reference_cache
+from django_sirene.db_utils import bulk_upsert
+from django_sirene.models import Activity, LegalStatus
+from django_sirene.routers import get_import_database
+
+logger = logging.getLogger(__name__)
+
+# codes of the level used by the institutions, once the dots are removed:
+# NAF rev. 2 sub classes and level 3 legal categories
+CODE_PATTERNS = {
+    Activity: re.compile("[0-9]{4}[A-Z]"),
+    LegalStatus: re.compile("[0-9]{4}"),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Load NAF activities and legal categories labels from nomenclature files. "
+        "Files are CSV whose first two columns are the code and the label, "
+        "as published by INSEE (e.g. 01.11Z;Culture de céréales...)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--activities",
+            action="store",
+            dest="activities",
+            help="CSV file of the NAF rev. 2 sub classes",
+        )
+        parser.add_argument(
+            "--legal-statuses",
+            action="store",
+            dest="legal_statuses",
+            help="CSV file of the legal categories (catégories juridiques)",
+        )
+        parser.add_argument(
+            "--encoding",
+            action="store",
+            dest="encoding",
+            default="utf-8",
+            help="Encoding of the files, default to utf-8",
+        )
+        parser.add_argument(
+            "--database",
+            action="store",
+            dest="database",
+            help="Alias of the database written, default to DJANGO_SIRENE_IMPORT_DATABASE",
+        )
+
+    def _read_nomenclature(self, path, model, encoding):
+        """Yield (code, label) of a nomenclature file, codes cleaned like importers do
+
+        Lines whose code doesn't have the shape of the model (headers, upper
+        levels) are skipped.
+        """
+        code_pattern = CODE_PATTERNS[model]
+        name_length = model._meta.get_field("name").max_length
+
+        with open(path, newline="", encoding=encoding) as csv_file:
+            sample = csv_file.read(4096)
+            csv_file.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=";,\t")
+            except csv.Error:
+                dialect = csv.excel
+            for row in csv.reader(csv_file, dialect):
+                if len(row) < 2:
+                    continue
+                code = row[0].strip().replace(".", "")
+                label = row[1].strip()
+                if not code_pattern.fullmatch(code):
+                    continue
+                yield code, label[:name_length]
+
+    def sync(self, path, model, encoding, using="default"):
+        try:
+            rows = list(self._read_nomenclature(path, model, encoding))
+        except OSError as e:
+            raise CommandError("Can't read %s: %s" % (path, e))
+        count = bulk_upsert(model, rows, ["code", "name"], using=using)
+        logger.info("%d %s synchronized", count, model._meta.verbose_name_plural)
+        return count
+
+    def handle(self, *args, **options):
+        if not options["activities"] and not options["legal_statuses"]:
+            raise CommandError("Give at least one of --activities and --legal-statuses")
+
+        using = options.get("database") or get_import_database()
+        if options["activities"]:
+            self.sync(options["activities"], Activity, options["encoding"], using)
+        if options["legal_statuses"]:
+            self.sync(options["legal_statuses"], LegalStatus, options["encoding"], using)
+
+        reference_cache.bump_version()
@@ -1,10 +1,54 @@
 import datetime
 import logging
+import re
 
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections, models
+from django.db.models import F
+from django.db.models.functions import Coalesce
 from django_bulk_update.query import BulkUpdateQuerySet
 
+from .cache import (
+    RECORD_FIELDS,
+    RECORD_LEGAL_UNIT_FIELDS,
+    from_record,
+    get_cache,
+    get_records_version,
+    get_timeout,
+    reference_cache,
+    siren_key,
+    siret_key,
+    to_record,
+)
+from .db_utils import get_histogram_bounds
+from .helpers import get_siren
+from .loaders import get_loader
+
 logger = logging.getLogger(__name__)
 
+SEARCH_CONFIG = 'simple'
+
+
+def build_prefix_tsquery(text):
+    """Build a raw tsquery matching every word of text as a prefix
+
+    >>> build_prefix_tsquery("Boulangerie de l'Ouest")
+    "boulangerie:* & de:* & l:* & ouest:*"
+    """
+    terms = re.findall(r'\w+', text.lower())
+    return ' & '.join('%s:*' % term for term in terms)
+
+
+class ReferenceQuerySet(models.QuerySet):
+
+    def cached(self, force_check=False):
+        """Return all instances as a dict {code: instance} kept in process memory
+
+        :param force_check: check the version marker now instead of trusting
+            the copy for the check interval
+        """
+        return reference_cache.get_objects(self.model, force_check=force_check, using=self._db)
+
 
 class InstitutionQuerySet(BulkUpdateQuerySet):
 
@@ -13,10 +57,12 @@ class InstitutionQuerySet(BulkUpdateQuerySet):
         'id',
         'siret',
         'created',
+        # set at creation
+        'legal_unit',
         # set later
-        'legal_status',
         'headquarter',
-        'name',
+        # maintained by the database
+        'search_vector',
     ])
 
     # fields ignored from updated fields
@@ -39,14 +85,273 @@ class InstitutionQuerySet(BulkUpdateQuerySet):
     def actives(self):
         return self.filter(is_expired=False)
 
-    def bulk_update_no_pk(self, objs, batch_size=None):
+    def search(self, text, ranked=True):
+        """Search institutions by siret prefix or by words of their names
+
+        Names are matched through the GIN indexed ``search_vector`` columns of
+        the institution (commercial name) and of its legal unit (name), each
+        word being used as a prefix. All the words are looked for in one of them.
+
+        :param text: siret (or its beginning) or words to look for
+        :param ranked: annotate a ``rank`` and order the results by it
+        """
+        digits = text.replace(' ', '')
+        if digits.isdigit():
+            return self.filter(siret__startswith=digits)
+
+        raw_query = build_prefix_tsquery(text)
+        if not raw_query:
+            return self.none()
+
+        query = SearchQuery(raw_query, config=SEARCH_CONFIG, search_type='raw')
+        # the legal unit keeps its own vector, renaming it doesn't write its institutions.
+        # Each vector is looked up through its own GIN index, an OR across the join
+        # would scan both tables
+        legal_unit_model = self.model._meta.get_field('legal_unit').related_model
+        by_commercial_name = self.model._base_manager.filter(search_vector=query).values('pk')
+        by_name = self.model._base_manager.filter(
+            legal_unit__in=legal_unit_model._base_manager.filter(
+                search_vector=query
+            ).values('siren')
+        ).values('pk')
+        queryset = self.filter(pk__in=by_commercial_name.union(by_name))
+        if ranked:
+            queryset = queryset.annotate(
+                rank=(
+                    Coalesce(SearchRank(F('search_vector'), query), 0.0)
+                    + Coalesce(SearchRank(F('legal_unit__search_vector'), query), 0.0)
+                )
+            ).order_by('-rank', 'siret')
+        return queryset
+
+    def records(self):
+        """Yield the values of RECORD_FIELDS, name and legal status read from the legal unit
+
+        ``updated`` is the last update of the institution or of its legal unit.
+        """
+        fields = [field for field in RECORD_FIELDS if field not in RECORD_LEGAL_UNIT_FIELDS]
+        for values in self.values(
+            *fields,
+            legal_unit_updated=F('legal_unit__updated'),
+            **{field: F(path) for field, path in RECORD_LEGAL_UNIT_FIELDS.items()}
+        ):
+            legal_unit_updated = values.pop('legal_unit_updated')
+            if legal_unit_updated and legal_unit_updated > values['updated']:
+                values['updated'] = legal_unit_updated
+            yield values
+
+    def _lookup_queryset(self):
+        # cached records don't depend on filters, look up the whole table
+        return InstitutionQuerySet(self.model, using=self.db)
+
+    def get_many_by_siret(self, sirets):
+        """Return cached records of institutions as a dict {siret: record}
+
+        Records are dicts of RECORD_FIELDS, unknown sirets are left out.
+        Cache misses are fetched in a single query.
+
+        :param sirets: iterable of sirets
+        """
+        return self._get_many_by_siret(sirets, get_records_version())
+
+    def _get_many_by_siret(self, sirets, version):
+        sirets = set(sirets)
+        cache = get_cache()
+        cached = cache.get_many([siret_key(siret, version) for siret in sirets])
+
+        records = {}
+        missing = []
+        for siret in sirets:
+            key = siret_key(siret, version)
+            if key in cached:
+                records[siret] = from_record(cached[key])
+            else:
+                missing.append(siret)
+
+        if missing:
+            fetched = {
+                values['siret']: values
+                for values in self._lookup_queryset()
+                .filter(siret__any=missing)
+                .records()
+            }
+            cache.set_many(
+                {siret_key(siret, version): to_record(fetched.get(siret)) for siret in missing},
+                get_timeout(),
+            )
+            records.update(fetched)
+
+        return {siret: record for siret, record in records.items() if record}
+
+    def get_by_siret(self, siret):
+        """Return the cached record of an institution or None
+        """
+        return self.get_many_by_siret([siret]).get(siret)
+
+    def get_many_by_siren(self, sirens):
+        """Return cached records of institutions by siren as a dict {siren: [record]}
+
+        Records of a siren are ordered by siret, unknown sirens are left out.
+        Cache misses are fetched in a single query.
+
+        :param sirens: iterable of sirens
+        """
+        sirens = set(sirens)
+        cache = get_cache()
+        version = get_records_version()
+        keys = {siren: siren_key(siren, version) for siren in sirens}
+        cached = cache.get_many(list(keys.values()))
+
+        missing = [siren for siren in sirens if keys[siren] not in cached]
+        sirets_by_siren = {
+            siren: cached[keys[siren]] for siren in sirens if keys[siren] in cached
+        }
+        records_by_siret = self._get_many_by_siret(
+            (siret for sirets in sirets_by_siren.values() for siret in sirets), version
+        )
+        records = {
+            siren: [records_by_siret[siret] for siret in sirets if siret in records_by_siret]
+            for siren, sirets in sirets_by_siren.items()
+        }
+
+        if missing:
+            fetched = {siren: [] for siren in missing}
+            for values in (
+                self._lookup_queryset()
+                .filter(legal_unit__any=missing)
+                .order_by('siret')
+                .records()
+            ):
+                fetched[get_siren(values['siret'])].append(values)
+
+            timeout = get_timeout()
+            to_cache = {}
+            for siren, siren_records in fetched.items():
+                to_cache[keys[siren]] = [values['siret'] for values in siren_records]
+                for values in siren_records:
+                    to_cache[siret_key(values['siret'], version)] = to_record(values)
+            cache.set_many(to_cache, timeout)
+            records.update(fetched)
+
+        return {siren: siren_records for siren, siren_records in records.items() if siren_records}
+
+    def get_by_siren(self, siren):
+        """Return cached records of all institutions of a siren, ordered by siret
+        """
+        return self.get_many_by_siren([siren]).get(siren, [])
+
+    async def aget_many_by_siret(self, sirets):
+        """Async get_many_by_siret, lookups of concurrent coroutines share one query
+        """
+        loader = get_loader(('siret', self.db), self.get_many_by_siret)
+        return await loader.load_many(sirets)
+
+    async def aget_by_siret(self, siret):
+        return (await self.aget_many_by_siret([siret])).get(siret)
+
+    async def aget_many_by_siren(self, sirens):
+        """Async get_many_by_siren, lookups of concurrent coroutines share one query
+        """
+        loader = get_loader(('siren', self.db), self.get_many_by_siren)
+        return await loader.load_many(sirens)
+
+    async def aget_by_siren(self, siren):
+        return (await self.aget_many_by_siren([siren])).get(siren, [])
+
+    def iter_chunks(self, size=1000, order_by='siret', fields=None, partition=None):
+        """Iterate over the queryset by chunks using keyset pagination
+
+        Each chunk is a short indexed query ``WHERE key > last ORDER BY key LIMIT size``,
+        in its own transaction, so the cost doesn't grow with the position in the
+        table and no transaction stays open between chunks.
+
+        :param size: number of institutions per chunk
+        :param order_by: unique key to paginate on, 'siret' or 'pk'
+        :param fields: yield values() dicts of these fields instead of instances,
+            the key is always included
+        :param partition: (start, end) siret bounds from siret_partitions(), to share
+            the scan between several workers
+        :yield: lists of institutions or dicts
+        """
+        if order_by not in ('siret', 'pk', 'id'):
+            raise ValueError('order_by must be a unique key: siret or pk')
+        key = 'id' if order_by == 'pk' else order_by
+
+        queryset = self.order_by(key)
+        if partition:
+            if key != 'siret':
+                raise ValueError('partitions are siret ranges, order by siret')
+            start, end = partition
+            if start is not None:
+                queryset = queryset.filter(siret__gte=start)
+            if end is not None:
+                queryset = queryset.filter(siret__lt=end)
+        if fields is not None:
+            fields = list(fields)
+            queryset = queryset.values(*(fields if key in fields else fields + [key]))
+
+        last = None
+        while True:
+            chunk_queryset = queryset if last is None else queryset.filter(**{key + '__gt': last})
+            chunk = list(chunk_queryset[:size])
+            if not chunk:
+                return
+            yield chunk
+            if len(chunk) < size:
+                return
+            last = chunk[-1][key] if fields is not None else getattr(chunk[-1], key)
+
+    def siret_partitions(self, count):
+        """Split the siret space in count disjoint (start, end) ranges
+
+        Bounds come from the histogram of the planner statistics so partitions hold
+        about the same number of rows, or from an even split of the siret digits
+        when the table has never been analyzed.
+
+        :param count: number of partitions
+        :return: list of (start, end) bounds, start included, end excluded,
+            None for open ends
+        """
+        bounds = get_histogram_bounds(self.model, 'siret', using=self.db)
+        if len(bounds) > count:
+            step = len(bounds) / count
+            splits = [bounds[int(i * step)] for i in range(1, count)]
+        else:
+            splits = [str(10 ** 14 * i // count).zfill(14) for i in range(1, count)]
+        starts = [None] + splits
+        ends = splits + [None]
+        return list(zip(starts, ends))
+
+    def _changed_fields(self, institution, obj):
+        """Names of the fields which differ between the stored institution and obj
+        """
+        changed_fields = []
+        for fieldname, value in obj.__dict__.items():
+            if fieldname not in self.update_fields - self.ignored_updated_fields:
+                continue
+
+            if str(getattr(institution, fieldname)) != str(value):
+                logger.debug(
+                    'Add %s because %s change - old:%s, new:%s' % (
+                        institution.siret,
+                        fieldname,
+                        getattr(institution, fieldname),
+                        value,
+                    )
+                )
+                changed_fields.append(self.model._meta.get_field(fieldname).name)
+        return changed_fields
+
+    def bulk_update_no_pk(self, objs, batch_size=None, changes=None):
         """Find modified instances and build a queryset with them
         Differs from django's bulk update because objs don't need to have a pk to be updated
 
         :param data: list Institutions
+        :param changes: dict filled with the names of the changed fields by siret
+        :return: set of sirets actually updated
         """
         if not objs:
-            return
+            return set()
 
         institutions_by_siret = {
             o.siret: o
@@ -59,22 +364,13 @@ class InstitutionQuerySet(BulkUpdateQuerySet):
         # First loop to verify if update is required
         siret_require_update = set()
         for institution in institutions:
-            obj = institutions_by_siret[institution.siret]
-            for fieldname, value in obj.__dict__.items():
-                if fieldname not in self.update_fields - self.ignored_updated_fields:
-                    continue
-
-                if str(getattr(institution, fieldname)) != str(value):
-                    logger.debug(
-                        'Add %s because %s change - old:%s, new:%s' % (
-                            institution.siret,
-                            fieldname,
-                            getattr(institution, fieldname),
-                            value,
-                        )
-                    )
-                    siret_require_update.add(institution.siret)
-                    break
+            changed_fields = self._changed_fields(
+                institution, institutions_by_siret[institution.siret]
+            )
+            if changed_fields:
+                siret_require_update.add(institution.siret)
+                if changes is not None:
+                    changes[institution.siret] = changed_fields
 
         # Second loop to update only required
         if siret_require_update:
@@ -93,3 +389,85 @@ class InstitutionQuerySet(BulkUpdateQuerySet):
                 batch_size=batch_size,
                 update_fields=self.update_fields,
             )
+
+        return siret_require_update
+
+
+class ImportRunQuerySet(models.QuerySet):
+
+    def finished(self):
+        return self.filter(finished__isnull=False)
+
+    def throughput(self, filename, last=5):
+        """Fresh rows imported by second during the last finished imports of a file
+
+        :param filename: local name of the imported file
+        :param last: number of imports averaged
+        :return: rows by second or None when no import was recorded
+        """
+        runs = self.finished().filter(
+            filename=filename, fresh_rows__gt=0
+        ).order_by('-started')[:last]
+        fresh_rows = 0
+        duration = 0
+        for run in runs:
+            fresh_rows += run.fresh_rows
+            duration += (run.finished - run.started).total_seconds()
+        if not duration:
+            return None
+        return fresh_rows / duration
+
+
+class InstitutionChangeQuerySet(models.QuerySet):
+
+    def since(self, cursor=0):
+        """Changes logged after a cursor, oldest first
+
+        A consumer stores the id of the last change it processed and reads
+        the next ones from there. Imports must not run concurrently for
+        ids to follow the commit order.
+
+        :param cursor: id of the last processed change
+        """
+        return self.filter(id__gt=cursor).order_by('id')
+
+    def cursor(self):
+        """Id of the last logged change, 0 if there is none
+        """
+        last = self.order_by('-id').values_list('id', flat=True).first()
+        return last or 0
+
+    def prune(self, before):
+        """Delete changes logged before a date, once every consumer read them
+        """
+        return self.filter(created__lt=before).delete()
+
+
+class InstitutionStatsQuerySet(models.QuerySet):
+
+    def refresh(self, concurrently=True):
+        """Compute the counts again from the institutions
+
+        A concurrent refresh doesn't lock out the readers of the counts.
+        """
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                'REFRESH MATERIALIZED VIEW %s%s' % (
+                    'CONCURRENTLY ' if concurrently else '',
+                    connections[self.db].ops.quote_name(self.model._meta.db_table),
+                )
+            )
+
+    def count_by(self, *fields):
+        """Active institutions counted by some of department, activity and legal_status
+
+        :return: values queryset with the fields and ``institutions``
+        """
+        return self.values(*fields).annotate(
+            institutions=models.Sum('count')
+        ).order_by(*fields)
+
+    def total(self):
+        """Active institutions among the filtered counts
+        """
+        return self.aggregate(total=models.Sum('count'))['total'] or 0
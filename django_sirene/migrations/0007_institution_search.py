@@ -0,0 +1,53 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR_SQL = """
+    setweight(to_tsvector('simple', coalesce(%(row)s.commercial_name, '')), 'A')
+    || setweight(to_tsvector('simple', coalesce(%(row)s.name, '')), 'B')
+"""
+
+CREATE_TRIGGER = """
+CREATE FUNCTION django_sirene_institution_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := %(vector)s;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER t_institution_search_vector
+    BEFORE INSERT OR UPDATE OF name, commercial_name ON django_sirene_institution
+    FOR EACH ROW EXECUTE PROCEDURE django_sirene_institution_search_vector();
+
+UPDATE django_sirene_institution SET search_vector = %(backfill)s;
+""" % {
+    "vector": SEARCH_VECTOR_SQL % {"row": "NEW"},
+    "backfill": SEARCH_VECTOR_SQL % {"row": "django_sirene_institution"},
+}
+
+DROP_TRIGGER = """
+DROP TRIGGER t_institution_search_vector ON django_sirene_institution;
+DROP FUNCTION django_sirene_institution_search_vector();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_sirene', '0006_auto_20200615_0915'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='institution',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.AddIndex(
+            model_name='institution',
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=['search_vector'], name='i_institution_search'
+            ),
+        ),
+    ]
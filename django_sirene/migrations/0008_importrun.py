@@ -0,0 +1,23 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_sirene', '0007_institution_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(help_text='Local name of the imported file', max_length=255)),
+                ('started', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished', models.DateTimeField(help_text='Empty while running or if failed', null=True)),
+                ('rows', models.PositiveIntegerField(default=0, help_text='Rows read')),
+                ('fresh_rows', models.PositiveIntegerField(default=0, help_text='Rows updated since date_from')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+import django.contrib.postgres.fields
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_sirene', '0008_importrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstitutionChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('siret', models.CharField(max_length=14)),
+                ('change_type', models.CharField(choices=[('created', 'created'), ('updated', 'updated'), ('expired', 'expired')], max_length=7)),
+                ('changed_fields', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=32), blank=True, default=list, size=None)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('import_run', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='changes', to='django_sirene.importrun')),
+            ],
+        ),
+    ]
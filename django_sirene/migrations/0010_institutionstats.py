@@ -0,0 +1,44 @@
+from django.db import migrations, models
+
+CREATE_VIEW = """
+CREATE MATERIALIZED VIEW django_sirene_institutionstats AS
+SELECT
+    row_number() OVER (ORDER BY department, activity_id, legal_status_id) AS id,
+    department,
+    activity_id,
+    legal_status_id,
+    count(*) AS count
+FROM django_sirene_institution
+WHERE NOT is_expired
+GROUP BY department, activity_id, legal_status_id;
+
+-- required to refresh the view concurrently
+CREATE UNIQUE INDEX i_institutionstats_group
+    ON django_sirene_institutionstats (department, activity_id, legal_status_id);
+"""
+
+DROP_VIEW = "DROP MATERIALIZED VIEW django_sirene_institutionstats;"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_sirene', '0009_institutionchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstitutionStats',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('department', models.CharField(max_length=2)),
+                ('count', models.BigIntegerField()),
+            ],
+            options={
+                'verbose_name_plural': 'institution stats',
+                'db_table': 'django_sirene_institutionstats',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(CREATE_VIEW, DROP_VIEW),
+    ]
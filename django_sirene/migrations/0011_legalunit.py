@@ -0,0 +1,164 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+FILL_LEGAL_UNITS = """
+INSERT INTO django_sirene_legalunit (siren, name, legal_status_id, headquarter_nic, updated)
+SELECT DISTINCT ON (substr(siret, 1, 9))
+    substr(siret, 1, 9),
+    name,
+    legal_status_id,
+    CASE WHEN is_headquarter THEN substr(siret, 10, 5) ELSE '' END,
+    updated
+FROM django_sirene_institution
+ORDER BY substr(siret, 1, 9), is_headquarter DESC, updated DESC;
+
+UPDATE django_sirene_institution SET legal_unit_id = substr(siret, 1, 9);
+"""
+
+FILL_INSTITUTIONS = """
+UPDATE django_sirene_institution AS institution
+SET name = legal_unit.name, legal_status_id = legal_unit.legal_status_id
+FROM django_sirene_legalunit AS legal_unit
+WHERE legal_unit.siren = institution.legal_unit_id;
+"""
+
+STATS_VIEW = """
+CREATE MATERIALIZED VIEW django_sirene_institutionstats AS
+SELECT
+    row_number() OVER (ORDER BY department, activity_id, legal_status_id) AS id,
+    department,
+    activity_id,
+    legal_status_id,
+    count(*) AS count
+FROM %s
+WHERE NOT is_expired
+GROUP BY department, activity_id, legal_status_id;
+
+-- required to refresh the view concurrently
+CREATE UNIQUE INDEX i_institutionstats_group
+    ON django_sirene_institutionstats (department, activity_id, legal_status_id);
+"""
+
+DROP_STATS_VIEW = "DROP MATERIALIZED VIEW django_sirene_institutionstats;"
+
+# legal status of the institutions read from their legal unit
+CREATE_STATS_VIEW = STATS_VIEW % """
+    django_sirene_institution AS institution
+    LEFT JOIN django_sirene_legalunit AS legal_unit ON legal_unit.siren = institution.legal_unit_id
+"""
+
+CREATE_OLD_STATS_VIEW = STATS_VIEW % "django_sirene_institution"
+
+SEARCH_VECTOR_SQL = """
+    setweight(to_tsvector('simple', coalesce(%(commercial_name)s, '')), 'A')
+    || setweight(to_tsvector('simple', coalesce(%(name)s, '')), 'B')
+"""
+
+DROP_OLD_TRIGGER = """
+DROP TRIGGER t_institution_search_vector ON django_sirene_institution;
+DROP FUNCTION django_sirene_institution_search_vector();
+"""
+
+CREATE_OLD_TRIGGER = """
+CREATE FUNCTION django_sirene_institution_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := %(vector)s;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER t_institution_search_vector
+    BEFORE INSERT OR UPDATE OF name, commercial_name ON django_sirene_institution
+    FOR EACH ROW EXECUTE PROCEDURE django_sirene_institution_search_vector();
+""" % {
+    "vector": SEARCH_VECTOR_SQL % {"commercial_name": "NEW.commercial_name", "name": "NEW.name"},
+}
+
+# names come from the legal unit, institutions of a legal unit are only
+# written again when its name really changes
+CREATE_TRIGGERS = """
+CREATE FUNCTION django_sirene_institution_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := %(vector)s;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER t_institution_search_vector
+    BEFORE INSERT OR UPDATE OF commercial_name, legal_unit_id ON django_sirene_institution
+    FOR EACH ROW EXECUTE PROCEDURE django_sirene_institution_search_vector();
+
+CREATE FUNCTION django_sirene_legalunit_search_vector() RETURNS trigger AS $$
+BEGIN
+    UPDATE django_sirene_institution SET search_vector = %(legal_unit_vector)s
+    WHERE legal_unit_id = NEW.siren;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER t_legalunit_search_vector
+    AFTER UPDATE OF name ON django_sirene_legalunit
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE PROCEDURE django_sirene_legalunit_search_vector();
+""" % {
+    "vector": SEARCH_VECTOR_SQL % {
+        "commercial_name": "NEW.commercial_name",
+        "name": "(SELECT name FROM django_sirene_legalunit WHERE siren = NEW.legal_unit_id)",
+    },
+    "legal_unit_vector": SEARCH_VECTOR_SQL % {
+        "commercial_name": "django_sirene_institution.commercial_name",
+        "name": "NEW.name",
+    },
+}
+
+DROP_TRIGGERS = """
+DROP TRIGGER t_legalunit_search_vector ON django_sirene_legalunit;
+DROP FUNCTION django_sirene_legalunit_search_vector();
+DROP TRIGGER t_institution_search_vector ON django_sirene_institution;
+DROP FUNCTION django_sirene_institution_search_vector();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_sirene', '0010_institutionstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LegalUnit',
+            fields=[
+                ('siren', models.CharField(help_text='SIREN', max_length=9, primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, help_text='NOMEN_LONG', max_length=131)),
+                ('headquarter_nic', models.CharField(blank=True, help_text='NIC of the headquarter', max_length=5)),
+                ('updated', models.DateTimeField(auto_now=True, help_text='Updated locally')),
+                ('legal_status', models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='legal_units', to='django_sirene.legalstatus')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='institution',
+            name='legal_unit',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='institutions', to='django_sirene.legalunit'),
+        ),
+        # a rollback builds the old view once institutions are filled
+        migrations.RunSQL(DROP_STATS_VIEW, CREATE_OLD_STATS_VIEW),
+        migrations.RunSQL(FILL_LEGAL_UNITS, FILL_INSTITUTIONS),
+        migrations.RunSQL(DROP_OLD_TRIGGER, CREATE_OLD_TRIGGER),
+        # default for the column added back by a rollback, filled from the legal units
+        migrations.AlterField(
+            model_name='institution',
+            name='name',
+            field=models.CharField(default='', help_text='NOMEN_LONG', max_length=131),
+        ),
+        migrations.RemoveField(
+            model_name='institution',
+            name='legal_status',
+        ),
+        migrations.RemoveField(
+            model_name='institution',
+            name='name',
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS, DROP_TRIGGERS),
+        migrations.RunSQL(CREATE_STATS_VIEW, DROP_STATS_VIEW),
+    ]
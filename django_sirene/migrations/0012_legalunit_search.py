@@ -0,0 +1,111 @@
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+INSTITUTION_VECTOR_SQL = "setweight(to_tsvector('simple', coalesce(%s.commercial_name, '')), 'A')"
+
+LEGAL_UNIT_VECTOR_SQL = "setweight(to_tsvector('simple', coalesce(%s.name, '')), 'B')"
+
+# institutions and legal units each index their own names, renaming a legal
+# unit writes a single row
+CREATE_TRIGGERS = """
+DROP TRIGGER t_legalunit_search_vector ON django_sirene_legalunit;
+DROP FUNCTION django_sirene_legalunit_search_vector();
+DROP TRIGGER t_institution_search_vector ON django_sirene_institution;
+
+CREATE OR REPLACE FUNCTION django_sirene_institution_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := %(institution_vector)s;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER t_institution_search_vector
+    BEFORE INSERT OR UPDATE OF commercial_name ON django_sirene_institution
+    FOR EACH ROW EXECUTE PROCEDURE django_sirene_institution_search_vector();
+
+CREATE FUNCTION django_sirene_legalunit_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := %(legal_unit_vector)s;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER t_legalunit_search_vector
+    BEFORE INSERT OR UPDATE OF name ON django_sirene_legalunit
+    FOR EACH ROW EXECUTE PROCEDURE django_sirene_legalunit_search_vector();
+
+UPDATE django_sirene_legalunit SET search_vector = %(legal_unit_backfill)s;
+UPDATE django_sirene_institution SET search_vector = %(institution_backfill)s;
+""" % {
+    "institution_vector": INSTITUTION_VECTOR_SQL % "NEW",
+    "legal_unit_vector": LEGAL_UNIT_VECTOR_SQL % "NEW",
+    "legal_unit_backfill": LEGAL_UNIT_VECTOR_SQL % "django_sirene_legalunit",
+    "institution_backfill": INSTITUTION_VECTOR_SQL % "django_sirene_institution",
+}
+
+# triggers of 0011_legalunit, institutions indexing the name of their legal unit
+DROP_TRIGGERS = """
+DROP TRIGGER t_legalunit_search_vector ON django_sirene_legalunit;
+DROP TRIGGER t_institution_search_vector ON django_sirene_institution;
+
+CREATE OR REPLACE FUNCTION django_sirene_institution_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := %(institution_vector)s || coalesce((
+        SELECT %(legal_unit_vector)s FROM django_sirene_legalunit AS legal_unit
+        WHERE legal_unit.siren = NEW.legal_unit_id
+    ), '');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER t_institution_search_vector
+    BEFORE INSERT OR UPDATE OF commercial_name, legal_unit_id ON django_sirene_institution
+    FOR EACH ROW EXECUTE PROCEDURE django_sirene_institution_search_vector();
+
+CREATE OR REPLACE FUNCTION django_sirene_legalunit_search_vector() RETURNS trigger AS $$
+BEGIN
+    UPDATE django_sirene_institution
+    SET search_vector = %(institution_backfill)s || %(new_legal_unit_vector)s
+    WHERE legal_unit_id = NEW.siren;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER t_legalunit_search_vector
+    AFTER UPDATE OF name ON django_sirene_legalunit
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE PROCEDURE django_sirene_legalunit_search_vector();
+
+UPDATE django_sirene_institution SET search_vector = %(institution_backfill)s || coalesce((
+    SELECT %(legal_unit_vector)s FROM django_sirene_legalunit AS legal_unit
+    WHERE legal_unit.siren = django_sirene_institution.legal_unit_id
+), '');
+""" % {
+    "institution_vector": INSTITUTION_VECTOR_SQL % "NEW",
+    "legal_unit_vector": LEGAL_UNIT_VECTOR_SQL % "legal_unit",
+    "new_legal_unit_vector": LEGAL_UNIT_VECTOR_SQL % "NEW",
+    "institution_backfill": INSTITUTION_VECTOR_SQL % "django_sirene_institution",
+}
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_sirene', '0011_legalunit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='legalunit',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS, DROP_TRIGGERS),
+        migrations.AddIndex(
+            model_name='legalunit',
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=['search_vector'], name='i_legalunit_search'
+            ),
+        ),
+    ]
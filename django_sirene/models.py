@@ -1,14 +1,25 @@
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.utils import timezone
 
 from .helpers import get_nic, get_siren
-from .managers import InstitutionQuerySet
+from .managers import (
+    ImportRunQuerySet,
+    InstitutionChangeQuerySet,
+    InstitutionQuerySet,
+    InstitutionStatsQuerySet,
+    ReferenceQuerySet,
+)
 
 
 class Activity(models.Model):
     code = models.CharField(max_length=5, primary_key=True, help_text='APET700')
     name = models.CharField(max_length=65, help_text='LIBAPET')
 
+    objects = ReferenceQuerySet.as_manager()
+
     def __str__(self):
         return "%s (%s)" % (self.name, self.code)
 
@@ -17,6 +28,8 @@ class Municipality(models.Model):
     code = models.CharField(max_length=5, primary_key=True, help_text='DEPCOMEN')
     name = models.CharField(max_length=32, help_text='LIBCOM')
 
+    objects = ReferenceQuerySet.as_manager()
+
     def __str__(self):
         return "%s (%s)" % (self.name, self.code)
 
@@ -25,10 +38,38 @@ class LegalStatus(models.Model):
     code = models.CharField(max_length=4, primary_key=True, help_text='NJ')
     name = models.CharField(max_length=100, help_text='LIBNJ')
 
+    objects = ReferenceQuerySet.as_manager()
+
     def __str__(self):
         return "%s (%s)" % (self.name, self.code)
 
 
+class LegalUnit(models.Model):
+    """Unité légale, shared by the institutions of a siren
+    """
+    siren = models.CharField(max_length=9, primary_key=True, help_text='SIREN')
+    name = models.CharField(max_length=131, blank=True, help_text='NOMEN_LONG')
+    legal_status = models.ForeignKey(
+        LegalStatus,
+        related_name='legal_units',
+        on_delete=models.PROTECT,
+        null=True,
+    )
+    headquarter_nic = models.CharField(max_length=5, blank=True, help_text='NIC of the headquarter')
+    updated = models.DateTimeField(auto_now=True, help_text='Updated locally')
+
+    # maintained by a database trigger from name
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='i_legalunit_search'),
+        ]
+
+    def __str__(self):
+        return self.name or self.siren
+
+
 class Institution(models.Model):
     activity = models.ForeignKey(
         Activity,
@@ -47,8 +88,9 @@ class Institution(models.Model):
         related_name='subsidiaries',
     )
     is_headquarter = models.BooleanField(default=False)
-    legal_status = models.ForeignKey(
-        LegalStatus,
+    # created without name by the import of the institution
+    legal_unit = models.ForeignKey(
+        LegalUnit,
         related_name='institutions',
         on_delete=models.PROTECT,
         null=True,
@@ -59,7 +101,6 @@ class Institution(models.Model):
         on_delete=models.PROTECT,
         null=True,
     )
-    name = models.CharField(max_length=131, help_text='NOMEN_LONG')
     siret = models.CharField(
         max_length=14,
         db_index=True,
@@ -76,11 +117,62 @@ class Institution(models.Model):
     # legacy
     is_hidden = models.BooleanField(default=False, help_text='Ask to be hidden')
 
+    # maintained by a database trigger from commercial_name
+    search_vector = SearchVectorField(null=True, editable=False)
+
     objects = InstitutionQuerySet.as_manager()
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='i_institution_search'),
+        ]
+
     def __str__(self):
         return self.commercial_name if self.commercial_name else self.name
 
+    @property
+    def cached_activity(self):
+        """Activity read from the process cache, without query
+        """
+        return Activity.objects.cached().get(self.activity_id)
+
+    @property
+    def cached_legal_status(self):
+        """Legal status read from the process cache
+
+        Its code comes from the legal unit, a query unless the institution was
+        fetched with select_related('legal_unit').
+        """
+        return LegalStatus.objects.cached().get(self.legal_status_id)
+
+    # the legal unit holds the name and the legal status, select_related('legal_unit')
+    # saves a query by institution. Read only, they are written on the legal unit
+    def _get_legal_unit(self):
+        try:
+            return self.legal_unit
+        except LegalUnit.DoesNotExist:
+            # not written yet
+            return None
+
+    @property
+    def name(self):
+        legal_unit = self._get_legal_unit()
+        return legal_unit.name if legal_unit else ''
+
+    @property
+    def legal_status_id(self):
+        legal_unit = self._get_legal_unit()
+        return legal_unit.legal_status_id if legal_unit else None
+
+    @property
+    def legal_status(self):
+        legal_unit = self._get_legal_unit()
+        return legal_unit.legal_status if legal_unit else None
+
+    @property
+    def cached_municipality(self):
+        return Municipality.objects.cached().get(self.municipality_id)
+
     @property
     def siren(self):
         return get_siren(self.siret)
@@ -88,3 +180,83 @@ class Institution(models.Model):
     @property
     def nic(self):
         return get_nic(self.siret)
+
+
+class ImportRun(models.Model):
+    """Import of a stock file by populate_sirene_database
+    """
+    filename = models.CharField(max_length=255, help_text='Local name of the imported file')
+    started = models.DateTimeField(default=timezone.now)
+    finished = models.DateTimeField(null=True, help_text='Empty while running or if failed')
+    rows = models.PositiveIntegerField(default=0, help_text='Rows read')
+    fresh_rows = models.PositiveIntegerField(default=0, help_text='Rows updated since date_from')
+
+    objects = ImportRunQuerySet.as_manager()
+
+    def __str__(self):
+        return "%s (%s)" % (self.filename, self.started)
+
+
+class InstitutionChange(models.Model):
+    """Change of an institution made by an import, read by downstream consumers
+    """
+    CREATED = 'created'
+    UPDATED = 'updated'
+    EXPIRED = 'expired'
+    CHANGE_TYPES = (
+        (CREATED, 'created'),
+        (UPDATED, 'updated'),
+        (EXPIRED, 'expired'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    siret = models.CharField(max_length=14)
+    change_type = models.CharField(max_length=7, choices=CHANGE_TYPES)
+    changed_fields = ArrayField(models.CharField(max_length=32), default=list, blank=True)
+    import_run = models.ForeignKey(
+        ImportRun,
+        related_name='changes',
+        on_delete=models.SET_NULL,
+        null=True,
+    )
+    created = models.DateTimeField(default=timezone.now)
+
+    objects = InstitutionChangeQuerySet.as_manager()
+
+    def __str__(self):
+        return "%s %s" % (self.siret, self.change_type)
+
+
+class InstitutionStats(models.Model):
+    """Active institutions counted by department, activity and legal status
+
+    Materialized view refreshed by populate_sirene_database, created by the
+    migrations 0010_institutionstats and 0011_legalunit.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    department = models.CharField(max_length=2)
+    activity = models.ForeignKey(
+        Activity,
+        related_name='+',
+        on_delete=models.DO_NOTHING,
+        null=True,
+    )
+    legal_status = models.ForeignKey(
+        LegalStatus,
+        related_name='+',
+        on_delete=models.DO_NOTHING,
+        null=True,
+    )
+    count = models.BigIntegerField()
+
+    objects = InstitutionStatsQuerySet.as_manager()
+
+    class Meta:
+        managed = False
+        db_table = 'django_sirene_institutionstats'
+        verbose_name_plural = 'institution stats'
+
+    def __str__(self):
+        return "%s %s %s: %d" % (
+            self.department, self.activity_id, self.legal_status_id, self.count
+        )
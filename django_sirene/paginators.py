@@ -0,0 +1,24 @@
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+
+from .db_utils import estimate_count
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator estimating the count of unfiltered querysets
+
+    A ``COUNT(*)`` over the whole institution table takes seconds,
+    the planner statistics are good enough to display a total.
+    """
+
+    estimated = False
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, "query", None)
+        if query is not None and not query.where:
+            estimated = estimate_count(self.object_list.model, using=self.object_list.db)
+            if estimated is not None:
+                self.estimated = True
+                return estimated
+        return super().count
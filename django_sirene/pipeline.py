@@ -0,0 +1,70 @@
+import queue
+import threading
+
+# put by the producer once it is done
+_DONE = object()
+
+
+class PipelineStopped(Exception):
+    """The consumer stopped, the producer has to stop too"""
+
+
+class Pipeline:
+    """Run a producer in a thread and consume its items in the calling thread
+
+    Items go through a bounded queue: the producer is never more than
+    maxsize items ahead of the consumer, which keeps the memory capped.
+    The calling thread keeps its database connection for the consumer.
+    """
+
+    # seconds between two checks of the consumer state by a blocked producer
+    poll_interval = 0.1
+
+    def __init__(self, maxsize=4):
+        self.queue = queue.Queue(maxsize)
+        self.stopped = threading.Event()
+        self.error = None
+
+    def put(self, item):
+        """Hand an item over to the consumer, wait while the queue is full
+        """
+        while True:
+            if self.stopped.is_set():
+                raise PipelineStopped()
+            try:
+                self.queue.put(item, timeout=self.poll_interval)
+                return
+            except queue.Full:
+                continue
+
+    def _produce(self, produce):
+        try:
+            produce()
+        except PipelineStopped:
+            return
+        except BaseException as error:
+            self.error = error
+        try:
+            self.put(_DONE)
+        except PipelineStopped:
+            pass
+
+    def run(self, produce, consume):
+        """
+        :param produce: function calling put for each item
+        :param consume: function called with each item
+        """
+        thread = threading.Thread(target=self._produce, args=(produce,), daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = self.queue.get()
+                if item is _DONE:
+                    break
+                consume(item)
+        finally:
+            self.stopped.set()
+            thread.join()
+
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,96 @@
+import csv
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+from .helpers import SIREN_LENGTH, SIRET_LENGTH
+from .models import Institution
+
+NIC_FACTOR = 10 ** (SIRET_LENGTH - SIREN_LENGTH)
+
+ImportPlan = namedtuple("ImportPlan", ["rows", "fresh_rows", "to_create", "to_compare", "ignored"])
+
+
+class SiretMembership:
+    """Sirets of the database held as a sorted array of 64 bits integers
+
+    8 bytes by institution instead of a set of strings, both sirets and
+    sirens are looked up by bisection.
+    """
+
+    def __init__(self, queryset=None, chunk_size=100000):
+        queryset = Institution.objects.all() if queryset is None else queryset
+        self.sirets = array("q")
+        # sirets which are not numbers can't be stored in the array
+        self.others = set()
+        ordered = True
+        previous = -1
+        sirets = queryset.order_by("siret").values_list("siret", flat=True)
+        for siret in sirets.iterator(chunk_size=chunk_size):
+            if not siret.isdigit():
+                self.others.add(siret)
+                continue
+            number = int(siret)
+            # text order only matches numeric order for sirets of 14 digits
+            ordered = ordered and number >= previous
+            previous = number
+            self.sirets.append(number)
+        if not ordered:
+            self.sirets = array("q", sorted(self.sirets))
+
+    def __len__(self):
+        return len(self.sirets) + len(self.others)
+
+    def _index(self, number):
+        return bisect_left(self.sirets, number)
+
+    def contains_siret(self, siret):
+        if not siret.isdigit():
+            return siret in self.others
+        number = int(siret)
+        index = self._index(number)
+        return index < len(self.sirets) and self.sirets[index] == number
+
+    def contains_siren(self, siren):
+        if not siren.isdigit():
+            return any(other.startswith(siren) for other in self.others)
+        first = int(siren) * NIC_FACTOR
+        index = self._index(first)
+        return index < len(self.sirets) and self.sirets[index] < first + NIC_FACTOR
+
+
+def plan_import(csv_file, importer_class, membership, **kwargs):
+    """Count what an import of the file would do, without writing
+
+    Rows are read as lists, only the date and the key columns are looked at.
+
+    :param csv_file: text file of the stock
+    :param importer_class: importer which would import the file
+    :param membership: SiretMembership of the database
+    :param kwargs: importer options, date_from and force
+    :return: ImportPlan
+    """
+    importer = importer_class(None, **kwargs)
+    reader = csv.reader(csv_file, delimiter=",")
+    header = next(reader, [])
+    date_index = header.index(importer.date_field)
+    key_index = header.index(importer.key_field)
+    if importer.key_field == "siret":
+        contains = membership.contains_siret
+    else:
+        contains = membership.contains_siren
+
+    rows = fresh_rows = known = 0
+    for row in reader:
+        rows += 1
+        if not importer.force and not importer.is_fresh(row[date_index]):
+            continue
+        fresh_rows += 1
+        if contains(row[key_index]):
+            known += 1
+
+    unknown = fresh_rows - known
+    if importer.key_field == "siret":
+        return ImportPlan(rows, fresh_rows, to_create=unknown, to_compare=known, ignored=0)
+    # unites legales only update existing institutions
+    return ImportPlan(rows, fresh_rows, to_create=0, to_compare=known, ignored=unknown)
@@ -0,0 +1,51 @@
+import io
+import shlex
+import subprocess
+from contextlib import contextmanager
+
+# stock files are several GB, read them by large chunks
+READ_BUFFER_SIZE = 4 * 2 ** 20
+
+
+def open_text(data, buffer_size=READ_BUFFER_SIZE):
+    """Decode a binary stream of a stock file
+
+    Files are encoded in UTF-8, possibly with a byte order mark. Line
+    endings are left to the csv module so that values are kept as they are.
+
+    :param data: binary file object
+    :param buffer_size: bytes read from data at once
+    """
+    return io.TextIOWrapper(
+        io.BufferedReader(data, buffer_size), encoding="utf-8-sig", newline=""
+    )
+
+
+@contextmanager
+def open_zip_member(zfile, member, decompressor=None, buffer_size=READ_BUFFER_SIZE):
+    """Open a member of a zip file as a binary stream
+
+    :param zfile: ZipFile opened from a path
+    :param member: name of the member
+    :param decompressor: command writing the member to its standard output,
+        called with the zip path and the member name, e.g. ``unzip -p``.
+        The decompression then runs in another process.
+    """
+    if not decompressor:
+        with zfile.open(member) as data:
+            yield data
+        return
+
+    command = shlex.split(decompressor) + [zfile.filename, member]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=buffer_size)
+    try:
+        yield process.stdout
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.stdout.close()
+        process.wait()
+
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command)
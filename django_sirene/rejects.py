@@ -0,0 +1,45 @@
+import csv
+import os
+
+REJECT_FIELDS = (
+    "siret",
+    "siren",
+    "name",
+    "commercial_name",
+    "address",
+    "zipcode",
+    "department",
+    "municipality_id",
+    "activity_id",
+    "legal_status_id",
+    "workforce",
+    "creation_date",
+    "is_headquarter",
+    "is_expired",
+)
+
+
+class RejectWriter:
+    """CSV file of the institutions or legal units which could not be imported, with the reason
+
+    Rejects are rare, the file is only opened to append them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, institution, action, reason):
+        """
+        :param institution: rejected Institution or LegalUnit instance
+        :param action: create or update
+        :param reason: error raised by the database
+        """
+        write_header = not os.path.exists(self.path) or not os.path.getsize(self.path)
+        with open(self.path, "a", newline="", encoding="utf-8") as reject_file:
+            writer = csv.writer(reject_file)
+            if write_header:
+                writer.writerow(("action", "reason") + REJECT_FIELDS)
+            writer.writerow(
+                [action, str(reason).strip()]
+                + [getattr(institution, field, "") for field in REJECT_FIELDS]
+            )
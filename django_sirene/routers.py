@@ -0,0 +1,111 @@
+import time
+
+from django.conf import settings
+
+from .cache import KEY_PREFIX, get_cache
+from .db_utils import get_wal_position, has_replayed
+
+APP_LABEL = "django_sirene"
+
+
+def get_read_database():
+    return getattr(settings, "DJANGO_SIRENE_READ_DATABASE", None)
+
+
+def get_import_database():
+    return getattr(settings, "DJANGO_SIRENE_IMPORT_DATABASE", "default")
+
+
+def get_replication_lag():
+    return getattr(settings, "DJANGO_SIRENE_REPLICATION_LAG", 60)
+
+
+class ImportMarker:
+    """Last write of an import, shared by the processes through Django's cache
+
+    The marker holds the time of the write and, on PostgreSQL, the position
+    of the write-ahead log of the import database after it. The replica is
+    behind until it replayed this position, or for DJANGO_SIRENE_REPLICATION_LAG
+    seconds when the position is unknown. The marker and the replica are
+    checked at most once per check_interval seconds.
+    """
+
+    key = "%s:imports:last_write" % KEY_PREFIX
+    check_interval = 1
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._behind = False
+        self._checked_at = None
+
+    def mark(self, using):
+        """Record a committed write of an import to the database using
+        """
+        get_cache().set(self.key, (time.time(), get_wal_position(using)), None)
+        self._behind = True
+        self._checked_at = time.monotonic()
+
+    def _check(self, using):
+        marker = get_cache().get(self.key)
+        if not marker:
+            return False
+        written, position = marker
+        if time.time() - written >= get_replication_lag():
+            return False
+        if position is None:
+            return True
+        return not has_replayed(position, using)
+
+    def is_behind(self, using):
+        """Can the replica using miss writes of the last import
+        """
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            self._behind = self._check(using)
+        return self._behind
+
+
+import_marker = ImportMarker()
+
+
+def mark_import_write(sender, importer, **kwargs):
+    """Receiver of the import signals, reads go to the import database for a while
+    """
+    if get_read_database() is not None:
+        import_marker.mark(importer.using)
+
+
+class SireneRouter:
+    """Route django_sirene models to a read replica and to the import database
+
+    Reads go to DJANGO_SIRENE_READ_DATABASE, or to DJANGO_SIRENE_IMPORT_DATABASE
+    while the replica is behind the last import. Writes and migrations go to
+    DJANGO_SIRENE_IMPORT_DATABASE.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            return None
+        read_database = get_read_database()
+        if read_database is None or import_marker.is_behind(read_database):
+            return get_import_database()
+        return read_database
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            return None
+        return get_import_database()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._meta.app_label == APP_LABEL and obj2._meta.app_label == APP_LABEL:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label != APP_LABEL:
+            return None
+        # the replica gets the tables from its primary
+        return db == get_import_database()
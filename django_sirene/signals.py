@@ -0,0 +1,12 @@
+from django.dispatch import Signal
+
+# bulk writes of imports don't send post_save, these signals are sent instead
+# once a batch is committed, with the sirets of its institutions as a frozenset:
+#   institutions_created(sender=importer class, importer, sirets)
+#   institutions_updated(sender=importer class, importer, sirets)
+institutions_created = Signal()
+institutions_updated = Signal()
+
+# sent once an importer went through all its rows:
+#   import_finished(sender=importer class, importer, rows, fresh_rows, rejected)
+import_finished = Signal()
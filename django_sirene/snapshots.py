@@ -0,0 +1,296 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.migrations.recorder import MigrationRecorder
+
+from .cache import bump_records_version, reference_cache
+from .db_utils import copy_from, get_backend
+from .downloads import file_checksum
+from .models import (
+    Activity,
+    ImportRun,
+    Institution,
+    InstitutionChange,
+    InstitutionStats,
+    LegalStatus,
+    LegalUnit,
+    Municipality,
+)
+from .readers import READ_BUFFER_SIZE
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = "django_sirene/1"
+MANIFEST_FILENAME = "manifest.json"
+
+# tables of a snapshot
+SNAPSHOT_MODELS = (Activity, LegalStatus, Municipality, LegalUnit, Institution, ImportRun)
+# tables emptied by a load, the change log refers to the import runs replaced
+CLEARED_MODELS = (InstitutionChange,)
+
+
+class SnapshotError(Exception):
+    """A snapshot can't be loaded in this database"""
+
+
+def get_migration(using="default"):
+    """Last django_sirene migration applied to a database
+    """
+    applied = MigrationRecorder(connections[using]).applied_migrations()
+    names = [name for app_label, name in applied if app_label == "django_sirene"]
+    return max(names) if names else None
+
+
+def _quote(connection, name):
+    return connection.ops.quote_name(name)
+
+
+def _copy_sql(connection, model, direction):
+    return "COPY %s (%s) %s WITH (FORMAT binary)" % (
+        _quote(connection, model._meta.db_table),
+        ", ".join(_quote(connection, field.column) for field in model._meta.concrete_fields),
+        direction,
+    )
+
+
+def _copy_to(cursor, sql, output):
+    if hasattr(cursor, "copy_expert"):
+        # psycopg2, size is positional for the debug cursor of Django
+        cursor.copy_expert(sql, output, READ_BUFFER_SIZE)
+        return
+    with cursor.copy(sql) as copy:
+        for data in copy:
+            output.write(data)
+
+
+def export_snapshot(directory, using="default"):
+    """Write the django_sirene tables to directory with PostgreSQL binary COPY
+
+    Tables are read in a single repeatable read transaction, a manifest lists
+    their files with their rows and checksums.
+
+    :return: manifest dict
+    """
+    connection = connections[using]
+    os.makedirs(directory, exist_ok=True)
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "created": datetime.now().isoformat(),
+        "migration": get_migration(using),
+        "tables": [],
+    }
+
+    # tables of the snapshot must be consistent with each other
+    isolate = not connection.in_atomic_block
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if isolate:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        for model in SNAPSHOT_MODELS:
+            start = time.time()
+            filename = "%s.copy" % model._meta.db_table
+            path = os.path.join(directory, filename)
+            with open(path, "wb") as output:
+                _copy_to(cursor, _copy_sql(connection, model, "TO STDOUT"), output)
+            rows = cursor.rowcount
+            manifest["tables"].append({
+                "model": model._meta.label_lower,
+                "table": model._meta.db_table,
+                "file": filename,
+                "columns": [field.column for field in model._meta.concrete_fields],
+                "rows": rows,
+                "size": os.path.getsize(path),
+                "checksum": file_checksum(path),
+            })
+            logger.info(
+                "%d rows of %s exported after %0.0fs",
+                rows, model._meta.db_table, time.time() - start,
+            )
+
+    with open(os.path.join(directory, MANIFEST_FILENAME), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    return manifest
+
+
+def read_manifest(directory, using="default", verify=True):
+    """Read and check the manifest of a snapshot against a database
+
+    :param verify: compare the size and checksum of each file with the manifest
+    :raise SnapshotError: the snapshot doesn't match the database or its files
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST_FILENAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError) as error:
+        raise SnapshotError("Can't read the manifest of %s: %s" % (directory, error))
+
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError("Unknown snapshot format %s" % manifest.get("format"))
+    migration = get_migration(using)
+    if manifest["migration"] != migration:
+        raise SnapshotError(
+            "Snapshot exported at migration %s, database is at %s"
+            % (manifest["migration"], migration)
+        )
+
+    models_by_label = {model._meta.label_lower: model for model in SNAPSHOT_MODELS}
+    for table in manifest["tables"]:
+        model = models_by_label.get(table["model"])
+        if model is None:
+            raise SnapshotError("Unknown table %s" % table["model"])
+        if table["columns"] != [field.column for field in model._meta.concrete_fields]:
+            raise SnapshotError("Columns of %s don't match the model" % table["table"])
+        if verify:
+            _verify_file(directory, table)
+    return manifest
+
+
+def _verify_file(directory, table):
+    path = os.path.join(directory, table["file"])
+    try:
+        intact = (
+            os.path.getsize(path) == table["size"]
+            and file_checksum(path) == table["checksum"]
+        )
+    except OSError:
+        intact = False
+    if not intact:
+        raise SnapshotError("%s is missing or corrupt" % path)
+
+
+def check_outside_references(cursor, tables):
+    """Fail when tables outside the snapshot have foreign keys to tables truncated
+
+    :raise SnapshotError: naming the foreign keys
+    """
+    cursor.execute(
+        "SELECT conrelid::regclass::text, conname, confrelid::regclass::text "
+        "FROM pg_constraint WHERE contype = 'f' "
+        "AND confrelid::regclass::text = ANY(%s) AND conrelid::regclass::text <> ALL(%s)",
+        [tables, tables],
+    )
+    references = cursor.fetchall()
+    if references:
+        raise SnapshotError(
+            "Tables outside the snapshot refer to its tables, drop their foreign keys "
+            "or load into another database: %s" % ", ".join(
+                "%s.%s to %s" % reference for reference in sorted(references)
+            )
+        )
+
+
+class SchemaDefinitions:
+    """Constraints and indexes of tables, dropped before a load and built after
+    """
+
+    def __init__(self, cursor, tables):
+        self.cursor = cursor
+        self.tables = tables
+        self.keys = []
+        self.foreign_keys = []
+        self.indexes = []
+
+    def _query(self, sql, params):
+        self.cursor.execute(sql, params)
+        return self.cursor.fetchall()
+
+    def drop(self):
+        constraints = self._query(
+            "SELECT conrelid::regclass::text, conname, contype, pg_get_constraintdef(oid) "
+            "FROM pg_constraint "
+            "WHERE conrelid::regclass::text = ANY(%s) AND contype IN ('p', 'u', 'f')",
+            [self.tables],
+        )
+        for table, name, constraint_type, definition in constraints:
+            if constraint_type == "f":
+                self.foreign_keys.append((table, name, definition))
+            else:
+                self.keys.append((table, name, definition))
+
+        # indexes backing the constraints are dropped with them
+        names = [name for _, name, _, _ in constraints]
+        self.indexes = self._query(
+            "SELECT tablename, indexname, indexdef FROM pg_indexes "
+            "WHERE schemaname = current_schema() AND tablename = ANY(%s) "
+            "AND indexname <> ALL(%s)",
+            [self.tables, names],
+        )
+
+        for table, name, _ in self.foreign_keys + self.keys:
+            self.cursor.execute("ALTER TABLE %s DROP CONSTRAINT %s" % (table, name))
+        for _, name, _ in self.indexes:
+            self.cursor.execute("DROP INDEX %s" % name)
+        logger.info(
+            "%d constraints and %d indexes dropped",
+            len(self.foreign_keys) + len(self.keys), len(self.indexes),
+        )
+
+    def create(self):
+        start = time.time()
+        for table, name, definition in self.keys:
+            self.cursor.execute("ALTER TABLE %s ADD CONSTRAINT %s %s" % (table, name, definition))
+        for _, _, definition in self.indexes:
+            self.cursor.execute(definition)
+        for table, name, definition in self.foreign_keys:
+            self.cursor.execute("ALTER TABLE %s ADD CONSTRAINT %s %s" % (table, name, definition))
+        logger.info("Constraints and indexes built after %0.0fs", time.time() - start)
+
+
+def load_snapshot(directory, using="default", verify=True):
+    """Replace the django_sirene tables with a snapshot
+
+    Constraints and indexes are dropped, the tables truncated and copied from
+    the files, then constraints and indexes built again, all in one transaction.
+    The change log is emptied and the cached records left behind.
+
+    :return: manifest dict
+    :raise SnapshotError: the snapshot doesn't match the database or its files,
+        or tables outside the snapshot refer to its tables
+    """
+    manifest = read_manifest(directory, using, verify=verify)
+    connection = connections[using]
+    tables = [table["table"] for table in manifest["tables"]]
+    models_by_table = {model._meta.db_table: model for model in SNAPSHOT_MODELS}
+
+    cleared = tables + [model._meta.db_table for model in CLEARED_MODELS]
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        # constraints can't be dropped while their deferred checks are pending
+        cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        # TRUNCATE without CASCADE refuses them, fail before any change
+        check_outside_references(cursor, cleared)
+        schema = SchemaDefinitions(cursor, cleared)
+        schema.drop()
+        cursor.execute(
+            "TRUNCATE %s" % ", ".join(_quote(connection, table) for table in cleared)
+        )
+        for table in manifest["tables"]:
+            start = time.time()
+            model = models_by_table[table["table"]]
+            quoted_table = _quote(connection, table["table"])
+            # values of the snapshot are copied as they are, search vectors included
+            cursor.execute("ALTER TABLE %s DISABLE TRIGGER USER" % quoted_table)
+            with open(os.path.join(directory, table["file"]), "rb") as data:
+                copy_from(cursor, _copy_sql(connection, model, "FROM STDIN"), data)
+            cursor.execute("ALTER TABLE %s ENABLE TRIGGER USER" % quoted_table)
+            logger.info(
+                "%d rows of %s loaded after %0.0fs",
+                table["rows"], table["table"], time.time() - start,
+            )
+        schema.create()
+
+        models = [models_by_table[table] for table in tables]
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
+        for table in tables:
+            cursor.execute("ANALYZE %s" % _quote(connection, table))
+
+    if get_backend(using).materialized_views:
+        InstitutionStats.objects.using(using).refresh(concurrently=False)
+    reference_cache.bump_version()
+    bump_records_version()
+    return manifest
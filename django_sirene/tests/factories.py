@@ -23,17 +23,28 @@ class MunicipalityFactory(factory.django.DjangoModelFactory):
 
 
 class LegalStatusFactory(factory.django.DjangoModelFactory):
-    code = fuzzy.FuzzyText(length=4)
+    # fuzzy codes of 4 letters collide when creating a thousand of them
+    code = factory.Sequence(lambda n: format(n, 'x').zfill(4)[-4:])
     name = fuzzy.FuzzyText(length=20)
 
     class Meta:
         model = models.LegalStatus
 
 
+class LegalUnitFactory(factory.django.DjangoModelFactory):
+    siren = factory.Sequence(lambda n: '{}'.format(n).zfill(9))
+    name = factory.Sequence(lambda n: 'name-{}'.format(n))
+    legal_status = factory.SubFactory(LegalStatusFactory)
+
+    class Meta:
+        model = models.LegalUnit
+        # institutions of a siren share the legal unit of the first one
+        django_get_or_create = ('siren',)
+
+
 class InstitutionFactory(factory.django.DjangoModelFactory):
-    siret = factory.Sequence(lambda n: '{}'.format(n).zfill(14))
+    siret = factory.Sequence(lambda n: '{}'.format(n).zfill(9) + '00011')
 
-    name = factory.Sequence(lambda n: 'name-{}'.format(n))
     commercial_name = factory.Sequence(lambda n: 'commercial_name-{}'.format(n))
     address = factory.Sequence(lambda n: '{} route vers Mars'.format(n))
     zipcode = '44000'
@@ -43,7 +54,16 @@ class InstitutionFactory(factory.django.DjangoModelFactory):
 
     municipality = factory.SubFactory(MunicipalityFactory)
     activity = factory.SubFactory(ActivityFactory)
-    legal_status = factory.SubFactory(LegalStatusFactory)
+    legal_unit = factory.SubFactory(
+        LegalUnitFactory,
+        siren=factory.LazyAttribute(lambda o: o.factory_parent.siret[:9]),
+        name=factory.SelfAttribute('..name'),
+        legal_status=factory.SelfAttribute('..legal_status'),
+    )
+
+    class Params:
+        name = factory.Sequence(lambda n: 'name-{}'.format(n))
+        legal_status = factory.SubFactory(LegalStatusFactory)
 
     class Meta:
         model = models.Institution
@@ -1,9 +1,9 @@
-from io import StringIO
+from io import BytesIO
 
 
 class FakeOpenFile:
     def __enter__(self, *args):
-        return StringIO("")
+        return BytesIO(b"")
 
     def __exit__(self, *args):
         pass
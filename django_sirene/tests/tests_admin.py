@@ -0,0 +1,51 @@
+import mock
+from django.contrib import admin
+from django.test import RequestFactory, TestCase
+
+from ..admin import AFTER_VAR, InstitutionAdmin
+from ..models import Institution
+from .factories import InstitutionFactory
+
+
+class InstitutionChangeListTestCase(TestCase):
+
+    def setUp(self):
+        self.model_admin = InstitutionAdmin(Institution, admin.site)
+        self.model_admin.scalable_changelist = True
+        self.model_admin.list_per_page = 2
+        self.headquarter = InstitutionFactory(siret="12345678900011")
+        self.institutions = [self.headquarter] + [
+            InstitutionFactory(siret="1234567890002%d" % i, headquarter=self.headquarter)
+            for i in range(3)
+        ]
+
+    def _changelist(self, **params):
+        request = RequestFactory().get("/", params)
+        request.user = mock.Mock(is_active=True, is_staff=True, has_perm=lambda *args: True)
+        return self.model_admin.get_changelist_instance(request)
+
+    def test_first_page(self):
+        changelist = self._changelist()
+        self.assertEqual(changelist.result_list, self.institutions[:2])
+        self.assertFalse(changelist.first_url)
+        self.assertEqual(changelist.next_url, "?%s=%s" % (AFTER_VAR, self.institutions[1].siret))
+
+    def test_next_page(self):
+        changelist = self._changelist(after=self.institutions[1].siret)
+        self.assertEqual(changelist.result_list, self.institutions[2:])
+        self.assertEqual(changelist.first_url, "?")
+        self.assertIsNone(changelist.next_url)
+
+    def test_position_is_dropped_from_other_links(self):
+        changelist = self._changelist(after=self.institutions[1].siret, is_expired__exact=0)
+        self.assertNotIn(AFTER_VAR, changelist.params)
+        self.assertNotIn(AFTER_VAR, changelist.get_query_string({"q": "dupont"}))
+        self.assertEqual(changelist.result_list, self.institutions[2:])
+
+    def test_headquarters_are_prefetched(self):
+        changelist = self._changelist(after=self.institutions[1].siret)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [institution.headquarter.name for institution in changelist.result_list],
+                [self.headquarter.name] * 2,
+            )
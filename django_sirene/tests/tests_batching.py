@@ -0,0 +1,39 @@
+import mock
+from django.test import SimpleTestCase
+
+from ..batching import AdaptiveBatchSize, get_rss
+
+
+@mock.patch("django_sirene.batching.get_rss", return_value=100 * 2 ** 20)
+class AdaptiveBatchSizeTestCase(SimpleTestCase):
+
+    def test_grows_while_throughput_improves(self, mock_rss):
+        batch_size = AdaptiveBatchSize(1000, memory_budget=1000 * 2 ** 20)
+        self.assertEqual(batch_size.update(1000, 1), 1500)
+        self.assertEqual(batch_size.update(1500, 1), 2250)
+        # same throughput, the size is kept
+        self.assertEqual(batch_size.update(2250, 1.5), 2250)
+        # worse throughput, the size goes back
+        self.assertEqual(batch_size.update(2250, 3), 1500)
+
+    def test_backs_off_near_memory_budget(self, mock_rss):
+        batch_size = AdaptiveBatchSize(1000, memory_budget=110 * 2 ** 20)
+        self.assertEqual(batch_size.update(1000, 1), 500)
+        self.assertEqual(batch_size.update(500, 0.1), 250)
+
+    def test_bounds(self, mock_rss):
+        batch_size = AdaptiveBatchSize(10, minimum=100, maximum=200)
+        self.assertEqual(batch_size.size, 100)
+        self.assertEqual(batch_size.update(100, 1), 150)
+        self.assertEqual(batch_size.update(150, 0.1), 200)
+        self.assertEqual(batch_size.update(200, 0.01), 200)
+
+    def test_empty_batch(self, mock_rss):
+        batch_size = AdaptiveBatchSize(1000)
+        self.assertEqual(batch_size.update(0, 0), 1000)
+
+
+class GetRSSTestCase(SimpleTestCase):
+
+    def test_get_rss(self):
+        self.assertGreater(get_rss(), 2 ** 20)
@@ -1,19 +1,39 @@
-from datetime import datetime
+import csv
+import os
+import tempfile
+import threading
+import zipfile
+from datetime import datetime, timedelta
 from io import StringIO
+from unittest import skipUnless
 
 import mock
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
+from django.utils import timezone
 
+from ..management.commands.dump_sirene import pyarrow
+from ..models import Activity, ImportRun, Institution, LegalStatus
+from .factories import ActivityFactory, InstitutionFactory, LegalStatusFactory
 from .mocks import FakeZfile
 
+# counters read from the importers once they ran
+IMPORTER_COUNTS = {"return_value.rows_count": 0, "return_value.fresh_rows_count": 0}
+
 
 @mock.patch(
     "django_sirene.management.commands.populate_sirene_database.Command._get_file",
     return_value=FakeZfile(),
 )
-@mock.patch("django_sirene.management.commands.populate_sirene_database.CSVUniteLegaleImporter")
-@mock.patch("django_sirene.management.commands.populate_sirene_database.CSVEtablissementImporter")
+@mock.patch(
+    "django_sirene.management.commands.populate_sirene_database.CSVUniteLegaleImporter",
+    **IMPORTER_COUNTS
+)
+@mock.patch(
+    "django_sirene.management.commands.populate_sirene_database.CSVEtablissementImporter",
+    **IMPORTER_COUNTS
+)
 class PopulateSireneDatabaseTest(TestCase):
 
     command = "populate_sirene_database"
@@ -138,33 +158,32 @@ class PopulateSireneDatabaseTest(TestCase):
         date = "2020-01-02"
         # not specified
         call_command(self.command, stdout=self.out)
-        self.assertEqual(
-            mock_get_file.call_args_list[0][0],
-            ('etablissement.zip',
-             'http://files.data.gouv.fr/insee-sirene/StockEtablissement_utf8.zip')
-        )
-        self.assertEqual(
-            mock_get_file.call_args_list[1][0],
-            ('unitelegale.zip',
-             'http://files.data.gouv.fr/insee-sirene/StockUniteLegale_utf8.zip')
+        # both files are downloaded concurrently
+        self.assertCountEqual(
+            [call[0] for call in mock_get_file.call_args_list],
+            [
+                ('etablissement.zip',
+                 'http://files.data.gouv.fr/insee-sirene/StockEtablissement_utf8.zip'),
+                ('unitelegale.zip',
+                 'http://files.data.gouv.fr/insee-sirene/StockUniteLegale_utf8.zip'),
+            ]
         )
 
         mock_get_file.reset_mock()
 
         # Date
         call_command(self.command, "--date-file=" + date, stdout=self.out)
-        self.assertEqual(
-            mock_get_file.call_args_list[0][0],
-            ('etablissement.zip',
-             'http://files.data.gouv.fr/insee-sirene/2020-01-02-StockEtablissement_utf8.zip')
-        )
-        self.assertEqual(
-            mock_get_file.call_args_list[1][0],
-            ('unitelegale.zip',
-             'http://files.data.gouv.fr/insee-sirene/2020-01-02-StockUniteLegale_utf8.zip')
+        self.assertCountEqual(
+            [call[0] for call in mock_get_file.call_args_list],
+            [
+                ('etablissement.zip',
+                 'http://files.data.gouv.fr/insee-sirene/2020-01-02-StockEtablissement_utf8.zip'),
+                ('unitelegale.zip',
+                 'http://files.data.gouv.fr/insee-sirene/2020-01-02-StockUniteLegale_utf8.zip'),
+            ]
         )
 
-    @mock.patch("django_sirene.management.commands.populate_sirene_database.toggle_postgres_vacuum")
+    @mock.patch("django_sirene.db_utils.toggle_postgres_vacuum")
     def test_db_vacuum_is_restored_even_when_import_fails(
         self, mock_vaccum, mock_etablissement_importer, mock_unitelegale_importer, mock_get_file
     ):
@@ -172,3 +191,335 @@ class PopulateSireneDatabaseTest(TestCase):
         with self.assertRaises(Exception):
             call_command(self.command, stdout=self.out)
         self.assertTrue(mock_vaccum.called)
+
+    def test_command_batch_sizes(
+        self, mock_etablissement_importer, mock_unitelegale_importer, mock_get_file
+    ):
+        call_command(self.command, "--skip-StockUniteLegale", stdout=self.out)
+        self._assert_mock_kwarg_call(mock_etablissement_importer, "memory_budget", None)
+        self.assertNotIn("local_batch_size", mock_etablissement_importer.call_args.kwargs)
+
+        call_command(
+            self.command,
+            "--skip-StockUniteLegale",
+            "--memory-budget=512",
+            "--local-batch-size=500",
+            "--db-batch-size=50",
+            stdout=self.out,
+        )
+        self._assert_mock_kwarg_call(mock_etablissement_importer, "memory_budget", 512 * 2 ** 20)
+        self._assert_mock_kwarg_call(mock_etablissement_importer, "local_batch_size", 500)
+        self._assert_mock_kwarg_call(mock_etablissement_importer, "db_batch_size", 50)
+        self.assertNotIn("process_batch_size", mock_etablissement_importer.call_args.kwargs)
+
+    def test_command_pipelined(
+        self, mock_etablissement_importer, mock_unitelegale_importer, mock_get_file
+    ):
+        call_command(self.command, "--skip-StockUniteLegale", stdout=self.out)
+        self._assert_mock_kwarg_call(mock_etablissement_importer, "pipelined", False)
+        call_command(self.command, "--skip-StockUniteLegale", "--pipelined", stdout=self.out)
+        self._assert_mock_kwarg_call(mock_etablissement_importer, "pipelined", True)
+
+    def test_command_database(
+        self, mock_etablissement_importer, mock_unitelegale_importer, mock_get_file
+    ):
+        call_command(self.command, "--skip-StockUniteLegale", stdout=self.out)
+        self._assert_mock_kwarg_call(mock_etablissement_importer, "using", "default")
+
+        # "imports" isn't configured, every access to it is mocked
+        with mock.patch.multiple(
+            "django_sirene.management.commands.populate_sirene_database",
+            get_backend=mock.DEFAULT,
+            ImportRun=mock.DEFAULT,
+            InstitutionStats=mock.DEFAULT,
+        ) as mocks:
+            call_command(
+                self.command, "--skip-StockUniteLegale", "--database=imports", stdout=self.out
+            )
+        mocks["get_backend"].assert_called_once_with("imports")
+        mocks["ImportRun"].objects.using.assert_called_once_with("imports")
+        mocks["InstitutionStats"].objects.using.assert_called_once_with("imports")
+        self._assert_mock_kwarg_call(mock_etablissement_importer, "using", "imports")
+
+    def test_command_downloads_during_import(
+        self, mock_etablissement_importer, mock_unitelegale_importer, mock_get_file
+    ):
+        unite_legale_downloaded = threading.Event()
+
+        def get_file(filename, uri, **options):
+            if filename == "unitelegale.zip":
+                unite_legale_downloaded.set()
+            return FakeZfile()
+
+        mock_get_file.side_effect = get_file
+        mock_etablissement_importer.return_value.run.side_effect = (
+            lambda: self.assertTrue(unite_legale_downloaded.wait(5))
+        )
+        call_command(self.command, stdout=self.out)
+        mock_unitelegale_importer.return_value.run.assert_called_once()
+
+    @mock.patch(
+        "django_sirene.management.commands.populate_sirene_database.Command._create_registry"
+    )
+    def test_command_cancels_downloads_when_import_fails(
+        self, mock_registry, mock_etablissement_importer, mock_unitelegale_importer, mock_get_file
+    ):
+        mock_etablissement_importer.return_value.run.side_effect = ValueError
+        with self.assertRaises(ValueError):
+            call_command(self.command, stdout=self.out)
+        # both downloads share one registry
+        mock_registry.assert_called_once()
+        mock_registry.return_value.cancel.assert_called_once()
+        mock_unitelegale_importer.assert_not_called()
+
+    def test_command_records_import_runs(
+        self, mock_etablissement_importer, mock_unitelegale_importer, mock_get_file
+    ):
+        mock_etablissement_importer.return_value.rows_count = 10
+        mock_etablissement_importer.return_value.fresh_rows_count = 3
+        call_command(self.command, "--skip-StockUniteLegale", stdout=self.out)
+        import_run = ImportRun.objects.get()
+        self.assertEqual(import_run.filename, "etablissement.zip")
+        self.assertEqual(import_run.rows, 10)
+        self.assertEqual(import_run.fresh_rows, 3)
+        self.assertIsNotNone(import_run.finished)
+
+    @mock.patch("django_sirene.managers.InstitutionStatsQuerySet.refresh")
+    @mock.patch('builtins.print')
+    def test_command_refreshes_stats(
+        self,
+        mock_print,
+        mock_refresh,
+        mock_etablissement_importer,
+        mock_unitelegale_importer,
+        mock_get_file,
+    ):
+        call_command(self.command, "--dry", stdout=self.out)
+        mock_refresh.assert_not_called()
+        call_command(self.command, stdout=self.out)
+        mock_refresh.assert_called_once_with()
+
+        # other databases have no materialized view
+        with mock.patch("django_sirene.db_utils.PostgresBackend.materialized_views", False):
+            call_command(self.command, stdout=self.out)
+        mock_refresh.assert_called_once_with()
+
+
+class PopulateSireneDatabasePlanTest(TestCase):
+
+    command = "populate_sirene_database"
+
+    def setUp(self):
+        InstitutionFactory(siret="12345678900011")
+        self.directory = tempfile.TemporaryDirectory()
+        now = datetime.now().isoformat()
+        self.etablissement_zip = self._write_zip("etablissement.zip", (
+            "siret,dateDernierTraitementEtablissement\n"
+            "12345678900011,%s\n"
+            "12345678900029,%s\n"
+            "12345678900037,2000-01-01T00:00:00\n" % (now, now)
+        ))
+        self.unite_legale_zip = self._write_zip("unitelegale.zip", (
+            "siren,dateDernierTraitementUniteLegale\n"
+            "123456789,%s\n" % now
+        ))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _write_zip(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with zipfile.ZipFile(path, "w") as zfile:
+            zfile.writestr(name.replace(".zip", ".csv"), content)
+        return path
+
+    def _get_file(self, filename, uri, **options):
+        return zipfile.ZipFile(os.path.join(self.directory.name, filename))
+
+    def test_plan(self):
+        out = StringIO()
+        with mock.patch(
+            "django_sirene.management.commands.populate_sirene_database.Command._get_file",
+            side_effect=self._get_file,
+        ), mock.patch("django_sirene.db_utils.toggle_postgres_vacuum") as mock_vacuum:
+            call_command(self.command, "--plan", stdout=out)
+
+        self.assertIn(
+            "etablissement.zip: 3 rows, 2 fresh, 1 to create, 1 to compare for update, 0 ignored",
+            out.getvalue(),
+        )
+        self.assertIn(
+            "unitelegale.zip: 1 rows, 1 fresh, 0 to create, 1 to compare for update, 0 ignored",
+            out.getvalue(),
+        )
+        self.assertIn("etablissement.zip: no recorded import", out.getvalue())
+        mock_vacuum.assert_not_called()
+        self.assertEqual(Institution.objects.count(), 1)
+        self.assertFalse(ImportRun.objects.exists())
+
+    def test_plan_estimates_duration(self):
+        started = timezone.now()
+        ImportRun.objects.create(
+            filename="etablissement.zip",
+            started=started,
+            finished=started + timedelta(seconds=10),
+            rows=100,
+            fresh_rows=20,
+        )
+        out = StringIO()
+        with mock.patch(
+            "django_sirene.management.commands.populate_sirene_database.Command._get_file",
+            side_effect=self._get_file,
+        ):
+            call_command(self.command, "--plan", "--skip-StockUniteLegale", stdout=out)
+        # 2 fresh rows at 2 rows/sec
+        self.assertIn("etablissement.zip: estimated duration 0:00:01 (2 rows/sec)", out.getvalue())
+
+
+class DumpSireneTest(TestCase):
+
+    command = "dump_sirene"
+
+    def setUp(self):
+        self.hq = InstitutionFactory(siret="12345678900011", is_headquarter=True, department="44")
+        self.sub = InstitutionFactory(siret="12345678900029", department="44")
+        self.expired = InstitutionFactory(siret="98765432100011", is_expired=True, department="75")
+
+    def _dump_csv(self, *args):
+        out = StringIO()
+        call_command(self.command, "-", *args, stdout=out)
+        return list(csv.DictReader(StringIO(out.getvalue())))
+
+    def test_dump_csv(self):
+        rows = self._dump_csv()
+        self.assertEqual(len(rows), 3)
+        row = next(row for row in rows if row["siret"] == self.hq.siret)
+        self.assertEqual(row["name"], self.hq.name)
+        self.assertEqual(row["activity_code"], self.hq.activity.code)
+        self.assertEqual(row["activity_name"], self.hq.activity.name)
+        self.assertEqual(row["municipality_name"], self.hq.municipality.name)
+        self.assertEqual(row["legal_status_name"], self.hq.legal_status.name)
+
+    def test_dump_filters(self):
+        self.assertEqual(
+            {row["siret"] for row in self._dump_csv("--actives")},
+            {self.hq.siret, self.sub.siret},
+        )
+        self.assertEqual(
+            [row["siret"] for row in self._dump_csv("--headquarters")], [self.hq.siret]
+        )
+        self.assertEqual(
+            [row["siret"] for row in self._dump_csv("--department=75")], [self.expired.siret]
+        )
+
+    def test_dump_in_chunks(self):
+        self.assertEqual(len(self._dump_csv("--chunk-size=2")), 3)
+
+    @skipUnless(pyarrow, "pyarrow is not installed")
+    def test_dump_parquet(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sirene.parquet")
+            call_command(self.command, path, "--format=parquet", "--chunk-size=2")
+            table = pyarrow.parquet.read_table(path)
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(
+            sorted(table.column("siret").to_pylist()),
+            [self.hq.siret, self.sub.siret, self.expired.siret],
+        )
+
+    def test_dump_parquet_requires_a_file(self):
+        with self.assertRaises(CommandError):
+            call_command(self.command, "-", "--format=parquet")
+
+
+class SyncSireneReferencesTest(TestCase):
+
+    command = "sync_sirene_references"
+
+    def _write_file(self, directory, name, content):
+        path = os.path.join(directory, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def test_sync_references(self):
+        ActivityFactory(code="0111Z", name="")
+        LegalStatusFactory(code="5710", name="")
+        with tempfile.TemporaryDirectory() as directory:
+            activities = self._write_file(
+                directory,
+                "naf.csv",
+                "Code;Intitulé\n"
+                "A;AGRICULTURE, SYLVICULTURE ET PÊCHE\n"
+                "01.11Z;Culture de céréales (à l'exception du riz), de légumineuses et de graines\n"
+                "01.12Z;Culture du riz\n"
+                "01.12Z;Culture du riz\n",
+            )
+            legal_statuses = self._write_file(
+                directory, "cj.csv", "Code,Libellé\n5710,SAS\n5499,SARL\n"
+            )
+            call_command(
+                self.command,
+                "--activities=" + activities,
+                "--legal-statuses=" + legal_statuses,
+            )
+
+        self.assertEqual(
+            Activity.objects.get(code="0111Z").name,
+            "Culture de céréales (à l'exception du riz), de légumineuses et de",
+        )
+        self.assertEqual(Activity.objects.get(code="0112Z").name, "Culture du riz")
+        self.assertFalse(Activity.objects.filter(code="A").exists())
+        self.assertEqual(
+            dict(LegalStatus.objects.values_list("code", "name")),
+            {"5710": "SAS", "5499": "SARL"},
+        )
+
+    def test_sync_skips_upper_levels(self):
+        with tempfile.TemporaryDirectory() as directory:
+            activities = self._write_file(
+                directory,
+                "naf.csv",
+                "Code;Intitulé\n"
+                "A;Agriculture, sylviculture et pêche\n"
+                "01;Culture et production animale\n"
+                "01.1;Cultures non permanentes\n"
+                "01.11;Culture de céréales\n"
+                "01.11Z;Culture de céréales\n",
+            )
+            legal_statuses = self._write_file(
+                directory,
+                "cj.csv",
+                "Code;Libellé\n"
+                "5;Société commerciale\n"
+                "57;Société par actions simplifiée\n"
+                "5710;SAS, société par actions simplifiée\n",
+            )
+            call_command(
+                self.command,
+                "--activities=" + activities,
+                "--legal-statuses=" + legal_statuses,
+            )
+
+        self.assertEqual(list(Activity.objects.values_list("code", flat=True)), ["0111Z"])
+        self.assertEqual(list(LegalStatus.objects.values_list("code", flat=True)), ["5710"])
+
+    @mock.patch(
+        "django_sirene.management.commands.sync_sirene_references.bulk_upsert",
+        return_value=0,
+    )
+    def test_sync_database(self, mock_upsert):
+        with tempfile.TemporaryDirectory() as directory:
+            legal_statuses = self._write_file(directory, "cj.csv", "Code,Libellé\n5710,SAS\n")
+            call_command(self.command, "--legal-statuses=" + legal_statuses)
+            self.assertEqual(mock_upsert.call_args.kwargs["using"], "default")
+            call_command(
+                self.command, "--legal-statuses=" + legal_statuses, "--database=imports"
+            )
+            self.assertEqual(mock_upsert.call_args.kwargs["using"], "imports")
+
+    def test_sync_requires_a_file(self):
+        with self.assertRaises(CommandError):
+            call_command(self.command)
+        with self.assertRaises(CommandError):
+            call_command(self.command, "--activities=/does/not/exist.csv")
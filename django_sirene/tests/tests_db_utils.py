@@ -1,8 +1,24 @@
 import mock
 
+from django.db import connection
 from django.test import TestCase
 
-from django_sirene.db_utils import toggle_postgres_vacuum
+from django_sirene.db_utils import (
+    DatabaseBackend,
+    PostgresBackend,
+    estimate_count,
+    get_backend,
+    toggle_postgres_vacuum,
+)
+from django_sirene.models import Institution
+from django_sirene.paginators import EstimatedCountPaginator
+
+from .factories import (
+    ActivityFactory,
+    InstitutionFactory,
+    LegalUnitFactory,
+    MunicipalityFactory,
+)
 
 
 @mock.patch("django.db.backends.utils.CursorWrapper.execute")
@@ -19,3 +35,116 @@ class ToggleVacuumTestCase(TestCase):
             mock_db.call_args.args,
             ("ALTER TABLE django_sirene_institution SET (autovacuum_enabled=False)", )
         )
+
+
+class BackendTestCase(TestCase):
+
+    def _get_setting(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW %s" % name)
+            return cursor.fetchone()[0]
+
+    def _get_autovacuum(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reloptions FROM pg_class WHERE relname = 'django_sirene_institution'"
+            )
+            return cursor.fetchone()[0] or []
+
+    def test_get_backend(self):
+        self.assertIsInstance(get_backend(), PostgresBackend)
+        with mock.patch.object(connection, "vendor", "oracle"):
+            self.assertIs(type(get_backend()), DatabaseBackend)
+
+    def test_postgres_bulk_load(self):
+        with get_backend().bulk_load():
+            self.assertEqual(self._get_setting("synchronous_commit"), "off")
+            self.assertIn("autovacuum_enabled=false", self._get_autovacuum())
+        self.assertEqual(self._get_setting("synchronous_commit"), "on")
+        self.assertIn("autovacuum_enabled=true", self._get_autovacuum())
+
+    def test_restored_when_import_fails(self):
+        with self.assertRaises(ValueError), get_backend().bulk_load():
+            raise ValueError
+        self.assertEqual(self._get_setting("synchronous_commit"), "on")
+
+    def _build_institutions(self):
+        legal_unit = LegalUnitFactory(siren="123456789")
+        return [
+            InstitutionFactory.build(
+                siret="12345678900011",
+                legal_unit=legal_unit,
+                activity=None,
+                municipality=None,
+                address="1 RUE\tDU\\PORT\nBAT. A",
+                commercial_name="BOULANGERIE",
+                creation_date=None,
+                is_headquarter=True,
+            ),
+            InstitutionFactory.build(
+                siret="12345678900029",
+                legal_unit=legal_unit,
+                activity=ActivityFactory(),
+                municipality=MunicipalityFactory(),
+            ),
+        ]
+
+    def test_postgres_insert(self):
+        institutions = self._build_institutions()
+        get_backend().insert(Institution, institutions)
+
+        headquarter = Institution.objects.get(siret="12345678900011")
+        self.assertEqual(headquarter.address, "1 RUE\tDU\\PORT\nBAT. A")
+        self.assertIsNone(headquarter.creation_date)
+        self.assertIsNone(headquarter.activity_id)
+        self.assertTrue(headquarter.is_headquarter)
+        self.assertIsNotNone(headquarter.updated)
+        # the search vector is still computed by the trigger
+        self.assertEqual(Institution.objects.search("boulangerie").get(), headquarter)
+        subsidiary = Institution.objects.get(siret="12345678900029")
+        self.assertEqual(subsidiary.creation_date, institutions[1].creation_date)
+        self.assertEqual(subsidiary.activity_id, institutions[1].activity_id)
+
+    def test_default_insert(self):
+        institutions = self._build_institutions()
+        with mock.patch.object(connection, "vendor", "oracle"):
+            get_backend().insert(Institution, institutions, batch_size=1)
+        self.assertEqual(Institution.objects.count(), 2)
+
+    def test_session_setting_restored(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SET synchronous_commit TO local")
+        with get_backend().bulk_load():
+            self.assertEqual(self._get_setting("synchronous_commit"), "off")
+        self.assertEqual(self._get_setting("synchronous_commit"), "local")
+
+
+class EstimateCountTestCase(TestCase):
+
+    def test_estimate_count(self):
+        InstitutionFactory.create_batch(3)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE django_sirene_institution")
+        self.assertEqual(estimate_count(Institution), 3)
+
+    def test_paginator_estimates_unfiltered_querysets(self):
+        InstitutionFactory.create_batch(3)
+        with mock.patch(
+            "django_sirene.paginators.estimate_count", return_value=1000
+        ) as mock_estimate:
+            paginator = EstimatedCountPaginator(Institution.objects.order_by("siret"), 10)
+            self.assertEqual(paginator.count, 1000)
+            self.assertTrue(paginator.estimated)
+            # the statistics of the database the queryset reads
+            mock_estimate.assert_called_once_with(Institution, using="default")
+
+            paginator = EstimatedCountPaginator(Institution.objects.actives().order_by("siret"), 10)
+            self.assertEqual(paginator.count, 3)
+            self.assertFalse(paginator.estimated)
+
+    def test_paginator_counts_when_never_analyzed(self):
+        InstitutionFactory.create_batch(3)
+        with mock.patch("django_sirene.paginators.estimate_count", return_value=None):
+            paginator = EstimatedCountPaginator(Institution.objects.order_by("siret"), 10)
+            self.assertEqual(paginator.count, 3)
+            self.assertFalse(paginator.estimated)
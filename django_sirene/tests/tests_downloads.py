@@ -0,0 +1,191 @@
+import io
+import json
+import os
+import tempfile
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import URLError
+
+import mock
+from django.test import SimpleTestCase
+
+from ..downloads import BandwidthLimiter, DownloadError, DownloadRegistry, file_checksum
+from ..management.commands.populate_sirene_database import Command
+
+
+def _zip_content(text):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as zfile:
+        zfile.writestr("StockEtablissement_utf8.csv", text)
+    return data.getvalue()
+
+
+class StockHandler(BaseHTTPRequestHandler):
+    content = b""
+    etag = '"1"'
+    last_modified = "Mon, 01 Jun 2020 00:00:00 GMT"
+    # bytes announced but not sent
+    missing = 0
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.content) + self.missing))
+        self.send_header("ETag", self.etag)
+        self.send_header("Last-Modified", self.last_modified)
+        self.end_headers()
+        self.wfile.write(self.content)
+
+    def log_message(self, *args):
+        return
+
+
+@mock.patch("django_sirene.downloads.time.sleep")
+@mock.patch("django_sirene.downloads.time.monotonic", return_value=0)
+class BandwidthLimiterTestCase(SimpleTestCase):
+
+    def test_consume(self, mock_monotonic, mock_sleep):
+        limiter = BandwidthLimiter(1000)
+        # the first second is allowed at once
+        limiter.consume(1000)
+        mock_sleep.assert_not_called()
+
+        limiter.consume(500)
+        mock_sleep.assert_called_once_with(0.5)
+
+        mock_monotonic.return_value = 2
+        limiter.consume(500)
+        mock_sleep.assert_called_once()
+
+    def test_chunk_size(self, mock_monotonic, mock_sleep):
+        self.assertEqual(BandwidthLimiter(10 * 2 ** 20).chunk_size, 2 ** 20)
+        self.assertEqual(BandwidthLimiter(1000).chunk_size, 2 ** 14)
+
+
+class DownloadRegistryTestCase(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StockHandler)
+        cls.uri = "http://127.0.0.1:%d/StockEtablissement_utf8.zip" % cls.server.server_port
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "etablissement.zip")
+        self.registry_path = os.path.join(self.directory.name, "registry.json")
+        self.registry = DownloadRegistry(self.registry_path)
+        StockHandler.content = _zip_content("siret\n00000000000000\n")
+        StockHandler.etag = '"1"'
+        StockHandler.missing = 0
+        StockHandler.requests = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_download_is_recorded(self):
+        self.assertTrue(self.registry.fetch(self.uri, self.path))
+        with open(self.path, "rb") as local_file:
+            self.assertEqual(local_file.read(), StockHandler.content)
+
+        with open(self.registry_path) as registry_file:
+            entry = json.load(registry_file)[self.uri]
+        self.assertEqual(entry["path"], self.path)
+        self.assertEqual(entry["size"], len(StockHandler.content))
+        self.assertEqual(entry["checksum"], file_checksum(self.path))
+        self.assertEqual(entry["etag"], '"1"')
+        self.assertEqual(entry["last_modified"], StockHandler.last_modified)
+
+    def test_unchanged_file_is_not_downloaded(self):
+        self.registry.fetch(self.uri, self.path)
+        registry = DownloadRegistry(self.registry_path)
+        self.assertFalse(registry.fetch(self.uri, self.path))
+        self.assertEqual(StockHandler.requests[-1]["If-None-Match"], '"1"')
+        self.assertEqual(StockHandler.requests[-1]["If-Modified-Since"], StockHandler.last_modified)
+
+    def test_changed_file_is_downloaded(self):
+        self.registry.fetch(self.uri, self.path)
+        StockHandler.content = _zip_content("siret\n00000000000001\n")
+        StockHandler.etag = '"2"'
+        self.assertTrue(self.registry.fetch(self.uri, self.path))
+        self.assertEqual(self.registry.get(self.uri)["etag"], '"2"')
+        self.assertTrue(self.registry.verify(self.uri, self.path))
+
+    def test_corrupt_file_is_downloaded_again(self):
+        self.registry.fetch(self.uri, self.path)
+        with open(self.path, "r+b") as local_file:
+            local_file.write(b"XX")
+        self.assertFalse(self.registry.verify(self.uri, self.path))
+
+        self.assertTrue(self.registry.fetch(self.uri, self.path))
+        self.assertNotIn("If-None-Match", StockHandler.requests[-1])
+        self.assertTrue(self.registry.verify(self.uri, self.path))
+
+    def test_force(self):
+        self.registry.fetch(self.uri, self.path)
+        self.assertTrue(self.registry.fetch(self.uri, self.path, force=True))
+        self.assertNotIn("If-None-Match", StockHandler.requests[-1])
+
+    def test_truncated_download(self):
+        self.registry.fetch(self.uri, self.path)
+        StockHandler.etag = '"2"'
+        StockHandler.missing = 10
+        with self.assertRaises(DownloadError):
+            self.registry.fetch(self.uri, self.path)
+        # the previous file is kept
+        self.assertTrue(self.registry.verify(self.uri, self.path))
+        self.assertFalse(os.path.exists(self.path + ".part"))
+
+    def test_unreachable_server(self):
+        self.registry.fetch(self.uri, self.path)
+        uri = self.uri.replace(str(self.server.server_port), "1")
+        self.registry.entries[uri] = self.registry.get(self.uri)
+        self.assertFalse(self.registry.fetch(uri, self.path))
+
+        with self.assertRaises(URLError):
+            self.registry.fetch(uri, self.path, force=True)
+
+    def test_bandwidth(self):
+        registry = DownloadRegistry(self.registry_path, bandwidth=1000)
+        with mock.patch.object(registry.limiter, "consume") as mock_consume:
+            registry.fetch(self.uri, self.path)
+        self.assertEqual(
+            sum(call[0][0] for call in mock_consume.call_args_list), len(StockHandler.content)
+        )
+
+    def test_cancel(self):
+        self.registry.fetch(self.uri, self.path)
+        StockHandler.etag = '"2"'
+        self.registry.cancel()
+        with self.assertRaises(DownloadError):
+            self.registry.fetch(self.uri, self.path)
+        self.assertFalse(os.path.exists(self.path + ".part"))
+        self.assertEqual(self.registry.get(self.uri)["etag"], '"1"')
+
+    def test_command_get_file(self):
+        command = Command()
+        command.local_csv_path = self.directory.name
+        command.registry = command._create_registry()
+        zfile = command._get_file("etablissement.zip", self.uri)
+        self.assertEqual(zfile.namelist(), ["StockEtablissement_utf8.csv"])
+        zfile.close()
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, "sirene_downloads.json")))
+
+    def test_command_max_bandwidth(self):
+        command = Command()
+        command.local_csv_path = self.directory.name
+        command.max_bandwidth = 100
+        self.assertEqual(command._create_registry().limiter.rate, 100 * 1024)
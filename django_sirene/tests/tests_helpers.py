@@ -1,6 +1,14 @@
+import mock
 from django.test import TestCase
 
-from django_sirene.helpers import get_nic, get_siren
+from django_sirene import helpers
+from django_sirene.helpers import (
+    get_nic,
+    get_siren,
+    is_valid_siren,
+    is_valid_siret,
+    validate_sirets,
+)
 
 
 class HelperTestCase(TestCase):
@@ -12,3 +20,39 @@ class HelperTestCase(TestCase):
 
     def test_get_nic(self):
         self.assertEqual(get_nic(self.siret), "000")
+
+
+class ValidationTestCase(TestCase):
+
+    sirets = [
+        "73282932000074",
+        "73282932000075",
+        "35600000049837",
+        "35600000049838",
+        "7328293200007",
+        "7328293200007A",
+        # digits of other scripts
+        "7328293200007\u00b2",
+        "\u0667" * 14,
+        "",
+        None,
+    ]
+    expected = [True, False, True, False, False, False, False, False, False, False]
+
+    def test_is_valid_siren(self):
+        self.assertTrue(is_valid_siren("732829320"))
+        self.assertFalse(is_valid_siren("732829321"))
+        self.assertFalse(is_valid_siren("73282932"))
+        self.assertFalse(is_valid_siren("73282932\u00b2"))
+        self.assertFalse(is_valid_siren(None))
+
+    def test_is_valid_siret(self):
+        self.assertEqual([is_valid_siret(siret) for siret in self.sirets], self.expected)
+
+    def test_validate_sirets(self):
+        self.assertEqual(validate_sirets(self.sirets), self.expected)
+        self.assertEqual(validate_sirets([]), [])
+
+    def test_validate_sirets_without_numpy(self):
+        with mock.patch.object(helpers, "numpy", None):
+            self.assertEqual(validate_sirets(self.sirets), self.expected)
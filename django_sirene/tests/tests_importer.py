@@ -1,10 +1,23 @@
+import csv
+import os
+import tempfile
 from datetime import date, datetime, timedelta
 from math import ceil
 
-from django.test import TestCase
+import mock
+from django.db import OperationalError
+from django.test import TestCase, override_settings
 
+from ..cache import reference_cache
 from ..importers import CSVEtablissementImporter, CSVUniteLegaleImporter
-from ..models import Activity, Institution, Municipality
+from ..models import (
+    Activity,
+    ImportRun,
+    Institution,
+    InstitutionChange,
+    LegalUnit,
+    Municipality,
+)
 from .factories import InstitutionFactory, LegalStatusFactory
 
 
@@ -62,8 +75,15 @@ BASE_UNITE_ROW = {
 }
 
 
+class ImporterTestCase(TestCase):
+
+    def setUp(self):
+        # references cached by a previous test may have been rolled back
+        reference_cache.clear()
+
+
 # ETABLISSEMENT ###
-class ImportEtablissementCreationTestCase(TestCase):
+class ImportEtablissementCreationTestCase(ImporterTestCase):
     def test_import_institutions_from_csv(self):
         """Assert we create institutions when import from csv
         """
@@ -85,6 +105,7 @@ class ImportEtablissementCreationTestCase(TestCase):
         self.assertEqual(institution.zipcode, "04000")
         self.assertFalse(institution.is_expired)
         # will be assigned later
+        self.assertEqual(institution.legal_unit_id, "000000000")
         self.assertEqual(institution.name, "")
         self.assertEqual(institution.headquarter, None)
         self.assertEqual(institution.legal_status, None)
@@ -133,7 +154,183 @@ class ImportEtablissementCreationTestCase(TestCase):
         self.assertEqual(Institution.objects.count(), 1)
 
 
-class ImportEtablissementUpdateTestCase(TestCase):
+class ImportEtablissementInvalidSiretTestCase(ImporterTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.rows = []
+        for siret in ("73282932000074", "73282932000075"):
+            row = BASE_ETABLISSEMENT_ROW.copy()
+            row.update({"siret": siret})
+            self.rows.append(row)
+
+    def test_invalid_sirets_are_counted(self):
+        importer = CSVEtablissementImporter(self.rows)
+        importer.run()
+        self.assertEqual(importer.invalid_sirets_count, 1)
+        self.assertEqual(Institution.objects.count(), 2)
+
+    def test_invalid_sirets_are_quarantined(self):
+        importer = CSVEtablissementImporter(self.rows, quarantine_invalid=True)
+        importer.run()
+        self.assertEqual(importer.invalid_sirets_count, 1)
+        self.assertEqual(importer.quarantined_sirets, ["73282932000075"])
+        self.assertEqual(
+            list(Institution.objects.values_list("siret", flat=True)), ["73282932000074"]
+        )
+
+
+class DeadlockDetected(Exception):
+    """Driver error as raised by psycopg2"""
+    pgcode = "40P01"
+
+
+class ImportEtablissementRejectTestCase(ImporterTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.reject_file = os.path.join(self.directory.name, "rejects.csv")
+        self.rows = [
+            dict(BASE_ETABLISSEMENT_ROW, siret=str(i).zfill(14)) for i in range(6)
+        ]
+        # too long for the column
+        self.rows[1]["enseigne1Etablissement"] = "X" * 60
+        # duplicated in the batch
+        self.rows[4]["siret"] = self.rows[3]["siret"]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _deadlock(self):
+        error = OperationalError("deadlock detected")
+        error.__cause__ = DeadlockDetected()
+        return error
+
+    def test_offending_rows_are_rejected(self):
+        importer = CSVEtablissementImporter(self.rows, reject_file=self.reject_file)
+        importer.run()
+        self.assertEqual(importer.rejected_count, 2)
+        self.assertEqual(
+            sorted(Institution.objects.values_list("siret", flat=True)),
+            ["00000000000000", "00000000000002", "00000000000003", "00000000000005"],
+        )
+
+        with open(self.reject_file) as reject_file:
+            rejects = list(csv.DictReader(reject_file))
+        self.assertEqual(
+            [(reject["action"], reject["siret"]) for reject in rejects],
+            [("create", "00000000000001"), ("create", "00000000000003")],
+        )
+        self.assertIn("too long", rejects[0]["reason"])
+        self.assertIn("duplicate key", rejects[1]["reason"])
+
+    def test_transient_errors_are_retried(self):
+        importer = CSVEtablissementImporter(self.rows[:1], retry_delay=0)
+        errors = [self._deadlock(), self._deadlock()]
+        bulk_create = importer._bulk_create
+
+        def _bulk_create(institutions):
+            if errors:
+                raise errors.pop()
+            return bulk_create(institutions)
+
+        with mock.patch.object(
+            importer, "_bulk_create", side_effect=_bulk_create
+        ) as mock_bulk_create:
+            importer.run()
+        self.assertEqual(mock_bulk_create.call_count, 3)
+        self.assertEqual(Institution.objects.count(), 1)
+
+    def test_retries_are_bounded(self):
+        importer = CSVEtablissementImporter(self.rows[:1], retry_delay=0, max_retries=2)
+        with mock.patch.object(importer, "_bulk_create", side_effect=self._deadlock()):
+            with self.assertRaises(OperationalError):
+                importer.run()
+
+    def test_other_operational_errors_are_raised(self):
+        importer = CSVEtablissementImporter(self.rows[:1], retry_delay=0)
+        error = OperationalError("server closed the connection")
+        with mock.patch.object(importer, "_bulk_create", side_effect=error) as mock_bulk_create:
+            with self.assertRaises(OperationalError):
+                importer.run()
+        mock_bulk_create.assert_called_once()
+
+
+class ImportPipelinedTestCase(ImporterTestCase):
+
+    def test_import_etablissement(self):
+        rows = [dict(BASE_ETABLISSEMENT_ROW, siret=str(i).zfill(14)) for i in range(25)]
+        InstitutionFactory(siret=rows[0]["siret"], name="OLD NAME")
+
+        importer = CSVEtablissementImporter(
+            rows, local_batch_size=4, queue_size=2, pipelined=True
+        )
+        importer.run()
+        self.assertEqual(Institution.objects.count(), 25)
+        self.assertEqual(
+            Institution.objects.filter(commercial_name="INSTITUTION TEST").count(), 25
+        )
+        self.assertTrue(Activity.objects.filter(code="AA10A").exists())
+        self.assertIsNone(importer.pipeline)
+
+    def test_import_unite_legale(self):
+        objs = [InstitutionFactory(siret=str(i).zfill(9) + "00001") for i in range(10)]
+        rows = [
+            dict(BASE_UNITE_ROW, siren=obj.siren, nicSiegeUniteLegale=obj.nic) for obj in objs
+        ]
+
+        CSVUniteLegaleImporter(rows, process_batch_size=3, pipelined=True).run()
+        self.assertEqual(
+            Institution.objects.filter(
+                legal_unit__name="SUPER INSTITUTION TEST", is_headquarter=True
+            ).count(),
+            10,
+        )
+
+    def test_write_error_is_raised(self):
+        rows = [dict(BASE_ETABLISSEMENT_ROW, siret=str(i).zfill(14)) for i in range(25)]
+        importer = CSVEtablissementImporter(rows, local_batch_size=4, pipelined=True)
+        with mock.patch.object(
+            importer, "_bulk_create", side_effect=OperationalError("server closed")
+        ):
+            with self.assertRaises(OperationalError):
+                importer.run()
+
+
+@mock.patch("django_sirene.batching.get_rss", return_value=100 * 2 ** 20)
+class ImportAdaptiveBatchSizeTestCase(ImporterTestCase):
+
+    def _get_rows(self, count):
+        return [
+            dict(BASE_ETABLISSEMENT_ROW, siret=str(i).zfill(14)) for i in range(count)
+        ]
+
+    def test_fixed_batch_size_without_memory_budget(self, mock_rss):
+        importer = CSVEtablissementImporter(self._get_rows(300), local_batch_size=100)
+        importer.run()
+        self.assertEqual(importer.local_batch_size, 100)
+        self.assertEqual(Institution.objects.count(), 300)
+
+    def test_batch_size_adapts_to_memory_budget(self, mock_rss):
+        # a single full batch is measured, the remaining rows are written at the end
+        importer = CSVEtablissementImporter(
+            self._get_rows(150), local_batch_size=100, memory_budget=1000 * 2 ** 20
+        )
+        importer.run()
+        self.assertEqual(importer.local_batch_size, 150)
+        self.assertEqual(Institution.objects.count(), 150)
+
+    def test_batch_size_backs_off_near_memory_budget(self, mock_rss):
+        importer = CSVEtablissementImporter(
+            self._get_rows(300), local_batch_size=200, memory_budget=110 * 2 ** 20
+        )
+        importer.run()
+        self.assertEqual(importer.local_batch_size, 100)
+        self.assertEqual(Institution.objects.count(), 300)
+
+
+class ImportEtablissementUpdateTestCase(ImporterTestCase):
     def test_update_institutions_from_csv(self):
         """Assert we create institutions when import from csv
         """
@@ -176,6 +373,20 @@ class ImportEtablissementUpdateTestCase(TestCase):
         self.assertTrue(dbo.is_expired)
         self.assertNotEqual(old_date, dbo.updated)
 
+    def test_unchanged_institutions_are_not_counted(self):
+        CSVEtablissementImporter([BASE_ETABLISSEMENT_ROW.copy()]).run()
+        changed = BASE_ETABLISSEMENT_ROW.copy()
+        changed.update({"siret": "00000000000001"})
+        CSVEtablissementImporter([changed]).run()
+        changed.update({"trancheEffectifsEtablissement": "12"})
+
+        importer = CSVEtablissementImporter([BASE_ETABLISSEMENT_ROW.copy(), changed])
+        with self.assertLogs("django_sirene.importers", "INFO") as logs:
+            importer.run()
+        self.assertEqual(importer.created_count, 0)
+        self.assertEqual(importer.updated_count, 1)
+        self.assertIn("1 institutions updated, 1 unchanged", "\n".join(logs.output))
+
     def test_recreate_an_expired_institution(self):
         expired = InstitutionFactory(is_expired=True)
         row = _get_row_from_object(expired)
@@ -185,7 +396,65 @@ class ImportEtablissementUpdateTestCase(TestCase):
         self.assertEqual(Institution.objects.actives().count(), 1)
 
 
-class ImportEtablissementFromDateTestCase(TestCase):
+@override_settings(DJANGO_SIRENE_CHANGE_LOG=True)
+class ImportChangeLogTestCase(ImporterTestCase):
+    def test_created(self):
+        import_run = ImportRun.objects.create(filename="StockEtablissement_utf8.zip")
+        CSVEtablissementImporter([BASE_ETABLISSEMENT_ROW.copy()], import_run=import_run).run()
+        change = InstitutionChange.objects.get()
+        self.assertEqual(change.siret, "00000000000000")
+        self.assertEqual(change.change_type, InstitutionChange.CREATED)
+        self.assertEqual(change.changed_fields, [])
+        self.assertEqual(change.import_run, import_run)
+
+    def test_updated_fields(self):
+        CSVEtablissementImporter([BASE_ETABLISSEMENT_ROW.copy()], log_changes=False).run()
+        row = BASE_ETABLISSEMENT_ROW.copy()
+        row.update({"enseigne1Etablissement": "NEW NAME", "trancheEffectifsEtablissement": "12"})
+        CSVEtablissementImporter([row]).run()
+        change = InstitutionChange.objects.get()
+        self.assertEqual(change.siret, "00000000000000")
+        self.assertEqual(change.change_type, InstitutionChange.UPDATED)
+        self.assertCountEqual(change.changed_fields, ["commercial_name", "workforce"])
+
+    def test_expired(self):
+        CSVEtablissementImporter([BASE_ETABLISSEMENT_ROW.copy()], log_changes=False).run()
+        row = BASE_ETABLISSEMENT_ROW.copy()
+        row.update({"etatAdministratifEtablissement": "F"})
+        CSVEtablissementImporter([row]).run()
+        change = InstitutionChange.objects.get()
+        self.assertEqual(change.change_type, InstitutionChange.EXPIRED)
+        self.assertEqual(change.changed_fields, ["is_expired"])
+
+    def test_unchanged_is_not_logged(self):
+        CSVEtablissementImporter([BASE_ETABLISSEMENT_ROW.copy()], log_changes=False).run()
+        CSVEtablissementImporter([BASE_ETABLISSEMENT_ROW.copy()]).run()
+        self.assertFalse(InstitutionChange.objects.exists())
+
+    def test_unite_legale_updated(self):
+        dbo = InstitutionFactory(siret="00000000000000")
+        CSVUniteLegaleImporter([BASE_UNITE_ROW.copy()]).run()
+        change = InstitutionChange.objects.get()
+        self.assertEqual(change.siret, dbo.siret)
+        self.assertEqual(change.change_type, InstitutionChange.UPDATED)
+        self.assertIn("name", change.changed_fields)
+
+    def test_unite_legale_changed_fields(self):
+        InstitutionFactory(siret="00000000000000")
+        CSVUniteLegaleImporter([BASE_UNITE_ROW.copy()], log_changes=False).run()
+        row = dict(BASE_UNITE_ROW, denominationUniteLegale="NEW NAME")
+        CSVUniteLegaleImporter([row]).run()
+        CSVUniteLegaleImporter([row]).run()
+        change = InstitutionChange.objects.get()
+        self.assertEqual(change.changed_fields, ["name"])
+
+    @override_settings(DJANGO_SIRENE_CHANGE_LOG=False)
+    def test_disabled(self):
+        CSVEtablissementImporter([BASE_ETABLISSEMENT_ROW.copy()]).run()
+        self.assertFalse(InstitutionChange.objects.exists())
+
+
+class ImportEtablissementFromDateTestCase(ImporterTestCase):
 
     today = datetime.now()
     date_from = datetime(1990, 10, 10)
@@ -246,7 +515,7 @@ class ImportEtablissementFromDateTestCase(TestCase):
         self.assertEqual(Institution.objects.count(), 1)
 
 
-class ImportEtablissementOffsetTestCase(TestCase):
+class ImportEtablissementOffsetTestCase(ImporterTestCase):
 
     def test_import_row_when_no_offset(self):
         row = BASE_ETABLISSEMENT_ROW
@@ -265,7 +534,7 @@ class ImportEtablissementOffsetTestCase(TestCase):
 
 
 # UNITE LEGALE ###
-class ImportUniteLegaleTestCase(TestCase):
+class ImportUniteLegaleTestCase(ImporterTestCase):
     def test_update_legal_status(self):
         ls = LegalStatusFactory()
         dbo = InstitutionFactory(legal_status=None)
@@ -335,8 +604,54 @@ class ImportUniteLegaleTestCase(TestCase):
         self.assertEqual(sub.name, "SUPER INSTITUTION TEST")
         self.assertEqual(sub.legal_status, ls)
 
+    def test_legal_unit_is_updated(self):
+        InstitutionFactory(siret="00000000000000")
+        sub = InstitutionFactory(siret="00000000009876")
+        CSVUniteLegaleImporter([BASE_UNITE_ROW.copy()]).run()
+        legal_unit = LegalUnit.objects.get()
+        self.assertEqual(legal_unit.name, "SUPER INSTITUTION TEST")
+        self.assertEqual(legal_unit.headquarter_nic, "00000")
+
+        # headquarter unchanged, institutions aren't written again
+        sub.refresh_from_db()
+        row = dict(BASE_UNITE_ROW, denominationUniteLegale="NEW NAME")
+        CSVUniteLegaleImporter([row]).run()
+        self.assertEqual(LegalUnit.objects.get().name, "NEW NAME")
+        self.assertEqual(Institution.objects.get(pk=sub.pk).updated, sub.updated)
 
-class ImportUniteLegaleFromDateTestCase(TestCase):
+    def test_unchanged_row_is_skipped(self):
+        InstitutionFactory(siret="00000000000000")
+        CSVUniteLegaleImporter([BASE_UNITE_ROW.copy()]).run()
+        updated = LegalUnit.objects.get().updated
+
+        importer = CSVUniteLegaleImporter([BASE_UNITE_ROW.copy()])
+        importer.run()
+        self.assertEqual(importer.skipped_count, 1)
+        self.assertEqual(LegalUnit.objects.get().updated, updated)
+
+    def test_headquarter_change_is_not_skipped(self):
+        hq = InstitutionFactory(siret="00000000000000")
+        sub = InstitutionFactory(siret="00000000009876")
+        CSVUniteLegaleImporter([BASE_UNITE_ROW.copy()]).run()
+        Institution.objects.filter(pk=sub.pk).update(is_headquarter=True, headquarter=None)
+
+        importer = CSVUniteLegaleImporter([BASE_UNITE_ROW.copy()])
+        importer.run()
+        self.assertEqual(importer.skipped_count, 0)
+        sub.refresh_from_db()
+        self.assertFalse(sub.is_headquarter)
+        self.assertEqual(sub.headquarter, hq)
+
+    def test_unknown_legal_unit_is_ignored(self):
+        row = BASE_UNITE_ROW.copy()
+        row.update({"siren": "999999999"})
+        importer = CSVUniteLegaleImporter([row])
+        importer.run()
+        self.assertFalse(LegalUnit.objects.exists())
+        self.assertEqual(importer.unknown_count, 1)
+
+
+class ImportUniteLegaleFromDateTestCase(ImporterTestCase):
 
     today = datetime.now()
     date_from = datetime(1990, 10, 10)
@@ -345,6 +660,7 @@ class ImportUniteLegaleFromDateTestCase(TestCase):
     old = datetime(1980, 1, 1).isoformat()
 
     def setUp(self):
+        super().setUp()
         self.dbo = InstitutionFactory(siret="00000000000000", is_headquarter=False)
 
     # DEFAULT
@@ -401,9 +717,10 @@ class ImportUniteLegaleFromDateTestCase(TestCase):
         self.assertTrue(self.dbo.is_headquarter)
 
 
-class ImportUniteLegaleOffsetTestCase(TestCase):
+class ImportUniteLegaleOffsetTestCase(ImporterTestCase):
 
     def setUp(self):
+        super().setUp()
         self.dbo = InstitutionFactory(siret="00000000000000", is_headquarter=False)
 
     def test_import_row_when_no_offset(self):
@@ -426,7 +743,11 @@ class ImportUniteLegaleOffsetTestCase(TestCase):
 
 
 # PERFORMANCE ###
-class ImportEtablissementQueriesTestCase(TestCase):
+# each written batch is a transaction, a savepoint inside tests
+SAVEPOINT_QUERIES = 2
+
+
+class ImportEtablissementQueriesTestCase(ImporterTestCase):
 
     n = 31
     nb_batch = 7
@@ -435,14 +756,15 @@ class ImportEtablissementQueriesTestCase(TestCase):
     def test_import_etablissement(self):
         rows = [_get_row_from_object(InstitutionFactory()) for _ in range(self.n)]
         # creation
-        with self.assertNumQueries(7):
+        with self.assertNumQueries(7 + SAVEPOINT_QUERIES):
             CSVEtablissementImporter(rows, filename="").run()
         self.assertEqual(Institution.objects.count(), self.n)
         self.assertEqual(Activity.objects.count(), self.n)
         self.assertEqual(Municipality.objects.count(), self.n)
 
         # update
-        with self.assertNumQueries(5):
+        # references are served by the process cache
+        with self.assertNumQueries(2 + SAVEPOINT_QUERIES):
             CSVEtablissementImporter(rows, filename="").run()
         self.assertEqual(Institution.objects.count(), self.n)
         self.assertEqual(Activity.objects.count(), self.n)
@@ -452,21 +774,22 @@ class ImportEtablissementQueriesTestCase(TestCase):
 
         rows = [_get_row_from_object(InstitutionFactory()) for _ in range(self.n)]
         # creation
-        with self.assertNumQueries(6 + self.nb_batch):
+        with self.assertNumQueries(6 + self.nb_batch + SAVEPOINT_QUERIES):
             CSVEtablissementImporter(rows, filename="", db_batch_size=self.db_batch_size).run()
         self.assertEqual(Institution.objects.count(), self.n)
         self.assertEqual(Activity.objects.count(), self.n)
         self.assertEqual(Municipality.objects.count(), self.n)
 
         # update
-        with self.assertNumQueries(5):
+        # references are served by the process cache
+        with self.assertNumQueries(2 + SAVEPOINT_QUERIES):
             CSVEtablissementImporter(rows, filename="", db_batch_size=self.db_batch_size).run()
         self.assertEqual(Institution.objects.count(), self.n)
         self.assertEqual(Activity.objects.count(), self.n)
         self.assertEqual(Municipality.objects.count(), self.n)
 
 
-class ImportUniteLegaleQueriesTestCase(TestCase):
+class ImportUniteLegaleQueriesTestCase(ImporterTestCase):
 
     n = 31
     nb_batch = 7
@@ -482,32 +805,35 @@ class ImportUniteLegaleQueriesTestCase(TestCase):
         }
 
     def test_import_unite_legale_all_are_headquarters(self):
-        objs = [InstitutionFactory(is_headquarter=False) for _ in range(self.n)]
-        for i, obj in enumerate(objs):
+        objs = [
             # sirets are XX000000000000 instead of 000000000000XX
-            obj.siret = (str(i) + "9").ljust(14, "0")
-            obj.save()
+            InstitutionFactory(is_headquarter=False, siret=(str(i) + "9").ljust(14, "0"))
+            for i in range(self.n)
+        ]
         rows = [self._get_unite_row_for_obj(obj) for obj in objs]
 
         # create
-        with self.assertNumQueries(3):
+        # legal units and institutions are read, then both written
+        with self.assertNumQueries(5 + SAVEPOINT_QUERIES):
             CSVUniteLegaleImporter(rows, filename="").run()
         # update
-        with self.assertNumQueries(3):
+        # references are served by the process cache
+        # rows are unchanged, nothing is written
+        with self.assertNumQueries(2):
             CSVUniteLegaleImporter(rows, filename="").run()
 
         self.assertFalse(Institution.objects.filter(is_headquarter=False).exists())
 
     def test_import_unite_legale_all_are_headquarters_batch(self):
-        objs = [InstitutionFactory(is_headquarter=False) for _ in range(self.n)]
-        for i, obj in enumerate(objs):
+        objs = [
             # sirets are XX000000000000 instead of 000000000000XX
-            obj.siret = (str(i) + "9").ljust(14, "0")
-            obj.save()
+            InstitutionFactory(is_headquarter=False, siret=(str(i) + "9").ljust(14, "0"))
+            for i in range(self.n)
+        ]
         rows = [self._get_unite_row_for_obj(obj) for obj in objs]
 
         # create
-        with self.assertNumQueries(self.nb_batch * 2 + 1):
+        with self.assertNumQueries(self.nb_batch * (4 + SAVEPOINT_QUERIES) + 1):
             CSVUniteLegaleImporter(
                 rows,
                 filename="",
@@ -515,7 +841,8 @@ class ImportUniteLegaleQueriesTestCase(TestCase):
                 db_batch_size=self.process_batch_size,
             ).run()
         # update
-        with self.assertNumQueries(self.nb_batch * 2 + 1):
+        # references are served by the process cache
+        with self.assertNumQueries(self.nb_batch * 2):
             CSVUniteLegaleImporter(
                 rows,
                 filename="",
@@ -539,10 +866,13 @@ class ImportUniteLegaleQueriesTestCase(TestCase):
                 InstitutionFactory(is_headquarter=False, siret=siren + str(j + 1).zfill(4))
 
         # create
-        with self.assertNumQueries(4):
+        # institutions are written by two batches
+        with self.assertNumQueries(6 + SAVEPOINT_QUERIES):
             CSVUniteLegaleImporter(rows, filename="", db_batch_size=self.n ** 2).run()
         # update
-        with self.assertNumQueries(4):
+        # references are served by the process cache
+        # rows are unchanged, nothing is written
+        with self.assertNumQueries(2):
             CSVUniteLegaleImporter(rows, filename="", db_batch_size=self.n ** 2).run()
 
         self.assertEqual(Institution.objects.filter(is_headquarter=True).count(), nb_headquarters)
@@ -562,7 +892,7 @@ class ImportUniteLegaleQueriesTestCase(TestCase):
                 InstitutionFactory(is_headquarter=False, siret=siren + str(j + 1).zfill(4))
 
         # create
-        with self.assertNumQueries(2 * self.nb_batch + 1):
+        with self.assertNumQueries((4 + SAVEPOINT_QUERIES) * self.nb_batch + 1):
             CSVUniteLegaleImporter(
                 rows,
                 filename="",
@@ -570,7 +900,8 @@ class ImportUniteLegaleQueriesTestCase(TestCase):
                 db_batch_size=self.n ** 2,
             ).run()
         # update
-        with self.assertNumQueries(2 * self.nb_batch + 1):
+        # references are served by the process cache
+        with self.assertNumQueries(2 * self.nb_batch):
             CSVUniteLegaleImporter(
                 rows,
                 filename="",
@@ -0,0 +1,41 @@
+import asyncio
+
+from django.test import SimpleTestCase, override_settings
+
+from ..loaders import BatchLoader
+
+
+@override_settings(DJANGO_SIRENE_LOOKUP_BATCH_WINDOW=0.01)
+class BatchLoaderTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.fetched = []
+
+    def fetch(self, keys):
+        self.fetched.append(sorted(keys))
+        return {key: key.upper() for key in keys}
+
+    def test_window_coalesces_lookups(self):
+        loader = BatchLoader(self.fetch)
+
+        async def lookups():
+            return await asyncio.gather(loader.load("a"), loader.load("b"), loader.load("c"))
+
+        self.assertEqual(asyncio.run(lookups()), ["A", "B", "C"])
+        self.assertEqual(self.fetched, [["a", "b", "c"]])
+
+    def test_load_after_max_size_flush(self):
+        loader = BatchLoader(self.fetch, max_batch_size=2)
+
+        async def lookups():
+            first = asyncio.ensure_future(loader.load("a"))
+            await asyncio.sleep(0)
+            # fills the batch while the window of the first lookup is open
+            second = asyncio.ensure_future(loader.load("b"))
+            await asyncio.sleep(0)
+            # opens a new window
+            third = asyncio.ensure_future(loader.load("c"))
+            return await asyncio.wait_for(asyncio.gather(first, second, third), timeout=1)
+
+        self.assertEqual(asyncio.run(lookups()), ["A", "B", "C"])
+        self.assertEqual(self.fetched, [["a", "b"], ["c"]])
@@ -0,0 +1,373 @@
+import asyncio
+from datetime import timedelta
+
+import mock
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.exceptions import FieldError
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from ..importers import CSVEtablissementImporter, CSVUniteLegaleImporter
+from ..cache import reference_cache
+from ..managers import InstitutionQuerySet, build_prefix_tsquery
+from ..models import Activity, Institution, InstitutionChange, InstitutionStats
+from .factories import ActivityFactory, InstitutionFactory, LegalStatusFactory
+from .tests_importer import BASE_UNITE_ROW, ImporterTestCase, _get_row_from_object
+
+
+class SearchTestCase(TestCase):
+
+    def setUp(self):
+        self.bakery = InstitutionFactory(
+            siret="12345678900011",
+            name="BOULANGERIE DE L'OUEST",
+            commercial_name="",
+        )
+        self.butcher = InstitutionFactory(
+            siret="98765432100011",
+            name="SARL DUPONT",
+            commercial_name="BOUCHERIE DUPONT",
+        )
+
+    def test_build_prefix_tsquery(self):
+        self.assertEqual(
+            build_prefix_tsquery("Boulangerie de l'Ouest"),
+            "boulangerie:* & de:* & l:* & ouest:*",
+        )
+        self.assertEqual(build_prefix_tsquery("  & | !"), "")
+
+    def test_search_by_name(self):
+        self.assertEqual(list(Institution.objects.search("boulang ouest")), [self.bakery])
+
+    def test_search_by_commercial_name(self):
+        self.assertEqual(list(Institution.objects.search("boucherie")), [self.butcher])
+
+    def test_search_by_siret(self):
+        self.assertEqual(list(Institution.objects.search("123 456")), [self.bakery])
+
+    def test_search_without_words(self):
+        self.assertFalse(Institution.objects.search("!!").exists())
+
+    def test_search_is_ranked(self):
+        other = InstitutionFactory(name="DUPONT", commercial_name="")
+        results = list(Institution.objects.search("dupont"))
+        # commercial name weights more than name
+        self.assertEqual(results, [self.butcher, other])
+        self.assertGreater(results[0].rank, results[1].rank)
+
+    def test_search_vector_follows_updates(self):
+        self.bakery.legal_unit.name = "PATISSERIE"
+        self.bakery.legal_unit.save()
+        self.assertFalse(Institution.objects.search("boulangerie").exists())
+        self.assertEqual(list(Institution.objects.search("patisserie")), [self.bakery])
+
+        Institution.objects.filter(pk=self.butcher.pk).update(commercial_name="")
+        self.assertFalse(Institution.objects.search("boucherie").exists())
+
+    def test_search_uses_both_indexes(self):
+        with connection.cursor() as cursor:
+            # the few rows of the tests would be scanned otherwise
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("SET LOCAL enable_indexscan = off")
+        plan = Institution.objects.search("dupont").explain()
+        self.assertIn("i_institution_search", plan)
+        self.assertIn("i_legalunit_search", plan)
+
+    def test_legal_unit_rename_leaves_institutions(self):
+        def get_row_version():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT ctid FROM django_sirene_institution WHERE id = %s", [self.bakery.pk]
+                )
+                return cursor.fetchone()[0]
+
+        row_version = get_row_version()
+        self.bakery.legal_unit.name = "PATISSERIE"
+        self.bakery.legal_unit.save()
+        self.assertEqual(get_row_version(), row_version)
+
+
+class LookupTestCase(ImporterTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.hq = InstitutionFactory(siret="12345678900011", name="HQ")
+        self.sub = InstitutionFactory(siret="12345678900029")
+        self.other = InstitutionFactory(siret="98765432100011", name="OTHER")
+
+    def test_get_by_siret(self):
+        with self.assertNumQueries(1):
+            record = Institution.objects.get_by_siret(self.hq.siret)
+        self.assertEqual(record["id"], self.hq.pk)
+        self.assertEqual(record["name"], "HQ")
+        self.assertEqual(record["municipality_id"], self.hq.municipality_id)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Institution.objects.get_by_siret(self.hq.siret), record)
+
+    def test_get_by_siret_unknown_is_cached(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(Institution.objects.get_by_siret("00000000000000"))
+        with self.assertNumQueries(0):
+            self.assertIsNone(Institution.objects.get_by_siret("00000000000000"))
+
+    def test_get_many_by_siret_fetches_misses_at_once(self):
+        Institution.objects.get_by_siret(self.hq.siret)
+        with self.assertNumQueries(1):
+            records = Institution.objects.get_many_by_siret(
+                [self.hq.siret, self.other.siret, "00000000000000"]
+            )
+        self.assertEqual(set(records), {self.hq.siret, self.other.siret})
+        self.assertEqual(records[self.other.siret]["name"], "OTHER")
+
+    def test_any_lookup_is_scoped(self):
+        self.assertEqual(
+            list(Institution.objects.filter(siret__any=[self.hq.siret])), [self.hq]
+        )
+        with self.assertRaises(FieldError):
+            Institution.objects.filter(commercial_name__any=["HQ"])
+        with self.assertRaises(FieldError):
+            Institution.objects.filter(activity__any=["0111Z"])
+
+    def test_get_by_siren(self):
+        with self.assertNumQueries(1):
+            records = Institution.objects.get_by_siren(self.hq.siren)
+        self.assertEqual([r["siret"] for r in records], [self.hq.siret, self.sub.siret])
+        with self.assertNumQueries(0):
+            self.assertEqual(Institution.objects.get_by_siren(self.hq.siren), records)
+            Institution.objects.get_by_siret(self.sub.siret)
+
+    def test_importers_invalidate_touched_sirets(self):
+        Institution.objects.get_by_siren(self.hq.siren)
+        other = InstitutionFactory()
+        Institution.objects.get_by_siret(other.siret)
+
+        row = BASE_UNITE_ROW.copy()
+        row.update({"siren": self.hq.siren, "nicSiegeUniteLegale": self.hq.nic})
+        with self.captureOnCommitCallbacks(execute=True):
+            CSVUniteLegaleImporter([row]).run()
+
+        self.assertEqual(
+            Institution.objects.get_by_siret(self.sub.siret)["name"], row["denominationUniteLegale"]
+        )
+        self.assertEqual(
+            Institution.objects.get_by_siren(self.hq.siren)[1]["headquarter_id"], self.hq.pk
+        )
+        # untouched sirets stay cached
+        with self.assertNumQueries(0):
+            Institution.objects.get_by_siret(other.siret)
+
+    def test_creation_invalidates_unknown_siret(self):
+        row = _get_row_from_object(InstitutionFactory.build(
+            siret="55555555500011",
+            municipality=self.hq.municipality,
+            activity=self.hq.activity,
+        ))
+        self.assertIsNone(Institution.objects.get_by_siret(row["siret"]))
+        with self.captureOnCommitCallbacks(execute=True):
+            CSVEtablissementImporter([row]).run()
+        self.assertIsNotNone(Institution.objects.get_by_siret(row["siret"]))
+
+
+class AsyncLookupTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.hq = InstitutionFactory(siret="12345678900011", name="HQ")
+        self.sub = InstitutionFactory(siret="12345678900029")
+
+    def test_concurrent_lookups_share_one_query(self):
+        async def lookups():
+            return await asyncio.gather(
+                Institution.objects.aget_by_siret(self.hq.siret),
+                Institution.objects.aget_by_siret(self.sub.siret),
+                Institution.objects.aget_by_siren(self.hq.siren),
+                Institution.objects.aget_by_siret("00000000000000"),
+            )
+
+        # one query for sirets, one for sirens
+        with self.assertNumQueries(2) as queries:
+            hq, sub, siren_records, missing = async_to_sync(lookups)()
+        self.assertEqual(hq["name"], "HQ")
+        # the name is the one of the legal unit
+        self.assertEqual(sub["name"], "HQ")
+        self.assertEqual([r["siret"] for r in siren_records], [self.hq.siret, self.sub.siret])
+        self.assertIsNone(missing)
+        self.assertIn("= ANY(", queries[0]["sql"])
+
+    async def test_lookup_errors_are_raised_to_every_caller(self):
+        with mock.patch.object(
+            InstitutionQuerySet, "get_many_by_siret", side_effect=ValueError
+        ):
+            results = await asyncio.gather(
+                Institution.objects.aget_by_siret(self.hq.siret),
+                Institution.objects.aget_by_siret(self.sub.siret),
+                return_exceptions=True,
+            )
+        self.assertIsInstance(results[0], ValueError)
+        self.assertIsInstance(results[1], ValueError)
+
+
+class IterChunksTestCase(TestCase):
+
+    def setUp(self):
+        self.institutions = [
+            InstitutionFactory(siret=str(i * 7).zfill(14), is_expired=i % 2 == 0)
+            for i in range(10)
+        ]
+
+    def test_iter_chunks(self):
+        with self.assertNumQueries(4):
+            chunks = list(Institution.objects.iter_chunks(3))
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 3, 1])
+        self.assertEqual([i for chunk in chunks for i in chunk], self.institutions)
+
+    def test_iter_chunks_stops_on_exact_end(self):
+        with self.assertNumQueries(3):
+            chunks = list(Institution.objects.iter_chunks(5))
+        self.assertEqual([len(chunk) for chunk in chunks], [5, 5])
+
+    def test_iter_chunks_filtered_values_by_pk(self):
+        chunks = list(Institution.objects.actives().iter_chunks(2, order_by="pk", fields=["siret"]))
+        self.assertEqual(
+            [values for chunk in chunks for values in chunk],
+            [{"siret": i.siret, "id": i.pk} for i in self.institutions if not i.is_expired],
+        )
+
+    def test_iter_chunks_requires_a_unique_key(self):
+        with self.assertRaises(ValueError):
+            next(Institution.objects.iter_chunks(2, order_by="name"))
+
+    def test_partitions_cover_the_table(self):
+        for analyzed in (False, True):
+            if analyzed:
+                with connection.cursor() as cursor:
+                    cursor.execute("ANALYZE django_sirene_institution")
+            partitions = Institution.objects.siret_partitions(3)
+            self.assertEqual(len(partitions), 3)
+            sirets = [
+                i.siret
+                for partition in partitions
+                for chunk in Institution.objects.iter_chunks(2, partition=partition)
+                for i in chunk
+            ]
+            self.assertEqual(sirets, [i.siret for i in self.institutions])
+
+
+class ReferenceCacheTestCase(ImporterTestCase):
+
+    def test_cached_is_loaded_once(self):
+        activity = ActivityFactory()
+        with self.assertNumQueries(1):
+            self.assertEqual(Activity.objects.cached(), {activity.code: activity})
+        with self.assertNumQueries(0):
+            Activity.objects.cached(force_check=True)
+
+    def test_cached_by_database(self):
+        activity = ActivityFactory()
+        Activity.objects.cached()
+        # the copy read through the router isn't the one of an explicit database
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                Activity.objects.using("default").cached(), {activity.code: activity}
+            )
+        with self.assertNumQueries(0):
+            Activity.objects.using("default").cached()
+
+    def test_cached_is_reloaded_when_version_changes(self):
+        Activity.objects.cached()
+        activity = ActivityFactory()
+        self.assertNotIn(activity.code, Activity.objects.cached())
+
+        reference_cache.bump_version()
+        self.assertIn(activity.code, Activity.objects.cached())
+
+    def test_institution_cached_relateds(self):
+        institution = InstitutionFactory()
+        institution = Institution.objects.select_related("legal_unit").get(pk=institution.pk)
+        with self.assertNumQueries(3):
+            self.assertEqual(institution.cached_activity.code, institution.activity_id)
+            self.assertEqual(institution.cached_municipality.code, institution.municipality_id)
+            self.assertEqual(institution.cached_legal_status.code, institution.legal_status_id)
+        with self.assertNumQueries(0):
+            self.assertEqual(institution.cached_activity.code, institution.activity_id)
+            self.assertEqual(institution.cached_municipality.code, institution.municipality_id)
+            self.assertEqual(institution.cached_legal_status.code, institution.legal_status_id)
+
+        # without the join the legal unit is fetched once
+        institution = Institution.objects.get(pk=institution.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(institution.cached_legal_status.code, institution.legal_status_id)
+            self.assertEqual(institution.name, institution.legal_unit.name)
+
+    def test_importer_bumps_version_when_creating_references(self):
+        Activity.objects.cached()
+        row = BASE_UNITE_ROW.copy()
+        row.update({"categorieJuridiqueUniteLegale": "9999"})
+        InstitutionFactory(siret="00000000000000")
+        CSVUniteLegaleImporter([row]).run()
+        self.assertEqual(Institution.objects.get().cached_legal_status.code, "9999")
+
+
+class InstitutionChangeTestCase(TestCase):
+    def _log(self, siret, change_type=InstitutionChange.UPDATED):
+        return InstitutionChange.objects.create(siret=siret, change_type=change_type)
+
+    def test_cursor_without_changes(self):
+        self.assertEqual(InstitutionChange.objects.cursor(), 0)
+
+    def test_since_cursor(self):
+        first = self._log("00000000000001", InstitutionChange.CREATED)
+        cursor = InstitutionChange.objects.cursor()
+        self.assertEqual(cursor, first.id)
+        second = self._log("00000000000002")
+        third = self._log("00000000000001", InstitutionChange.EXPIRED)
+        self.assertEqual(list(InstitutionChange.objects.since(cursor)), [second, third])
+        self.assertEqual(list(InstitutionChange.objects.since()), [first, second, third])
+
+    def test_prune(self):
+        old = self._log("00000000000001")
+        InstitutionChange.objects.filter(id=old.id).update(
+            created=timezone.now() - timedelta(days=8)
+        )
+        recent = self._log("00000000000002")
+        InstitutionChange.objects.prune(before=timezone.now() - timedelta(days=7))
+        self.assertEqual(list(InstitutionChange.objects.all()), [recent])
+
+
+class InstitutionStatsTestCase(TestCase):
+    def setUp(self):
+        self.activity = ActivityFactory()
+        self.legal_status = LegalStatusFactory()
+        for department in ("44", "44", "85"):
+            InstitutionFactory(
+                department=department, activity=self.activity, legal_status=self.legal_status
+            )
+        InstitutionFactory(department="44", activity=self.activity, legal_status=None)
+        InstitutionFactory(department="44", is_expired=True)
+
+    def test_refresh(self):
+        self.assertEqual(InstitutionStats.objects.total(), 0)
+        InstitutionStats.objects.refresh()
+        self.assertEqual(InstitutionStats.objects.total(), 4)
+        InstitutionFactory(department="85")
+        InstitutionStats.objects.refresh(concurrently=False)
+        self.assertEqual(InstitutionStats.objects.total(), 5)
+
+    def test_count_by(self):
+        InstitutionStats.objects.refresh()
+        self.assertEqual(
+            list(InstitutionStats.objects.count_by("department")),
+            [{"department": "44", "institutions": 3}, {"department": "85", "institutions": 1}],
+        )
+        self.assertEqual(
+            list(InstitutionStats.objects.filter(department="44").count_by("legal_status")),
+            [
+                {"legal_status": self.legal_status.code, "institutions": 2},
+                {"legal_status": None, "institutions": 1},
+            ],
+        )
+        self.assertEqual(InstitutionStats.objects.filter(activity=self.activity).total(), 4)
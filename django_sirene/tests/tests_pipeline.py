@@ -0,0 +1,58 @@
+import threading
+
+from django.test import SimpleTestCase
+
+from ..pipeline import Pipeline
+
+
+class PipelineTestCase(SimpleTestCase):
+
+    def test_items_are_consumed_in_order(self):
+        pipeline = Pipeline(maxsize=2)
+        consumed = []
+        pipeline.run(lambda: [pipeline.put(i) for i in range(10)], consumed.append)
+        self.assertEqual(consumed, list(range(10)))
+
+    def test_producer_waits_for_the_consumer(self):
+        pipeline = Pipeline(maxsize=2)
+        produced = []
+        ahead = []
+
+        def produce():
+            for i in range(10):
+                pipeline.put(i)
+                produced.append(i)
+
+        def consume(item):
+            ahead.append(len(produced) - item)
+
+        pipeline.run(produce, consume)
+        # the queue holds 2 items, the producer holds a third one
+        self.assertLessEqual(max(ahead), 3)
+
+    def test_producer_error_is_raised(self):
+        pipeline = Pipeline()
+
+        def produce():
+            pipeline.put(1)
+            raise ValueError("bad row")
+
+        consumed = []
+        with self.assertRaisesMessage(ValueError, "bad row"):
+            pipeline.run(produce, consumed.append)
+        self.assertEqual(consumed, [1])
+
+    def test_consumer_error_stops_the_producer(self):
+        pipeline = Pipeline(maxsize=1)
+        threads = threading.active_count()
+
+        def produce():
+            while True:
+                pipeline.put(1)
+
+        def consume(item):
+            raise ValueError("db down")
+
+        with self.assertRaisesMessage(ValueError, "db down"):
+            pipeline.run(produce, consume)
+        self.assertEqual(threading.active_count(), threads)
@@ -0,0 +1,101 @@
+import csv
+from datetime import datetime, timedelta
+from io import StringIO
+
+from django.test import TestCase
+
+from ..importers import CSVEtablissementImporter, CSVUniteLegaleImporter
+from ..planning import SiretMembership, plan_import
+from .factories import InstitutionFactory
+
+
+def _to_csv(rows):
+    output = StringIO()
+    writer = csv.DictWriter(output, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    output.seek(0)
+    return output
+
+
+class SiretMembershipTestCase(TestCase):
+
+    def setUp(self):
+        InstitutionFactory(siret="12345678900011")
+        InstitutionFactory(siret="98765432100022")
+        InstitutionFactory(siret="ABC")
+
+    def test_contains_siret(self):
+        membership = SiretMembership()
+        self.assertEqual(len(membership), 3)
+        self.assertTrue(membership.contains_siret("12345678900011"))
+        self.assertTrue(membership.contains_siret("98765432100022"))
+        self.assertTrue(membership.contains_siret("ABC"))
+        self.assertFalse(membership.contains_siret("12345678900012"))
+        self.assertFalse(membership.contains_siret("99999999999999"))
+
+    def test_contains_siren(self):
+        membership = SiretMembership()
+        self.assertTrue(membership.contains_siren("123456789"))
+        self.assertTrue(membership.contains_siren("987654321"))
+        self.assertFalse(membership.contains_siren("123456788"))
+        self.assertFalse(membership.contains_siren("999999999"))
+
+    def test_unordered_sirets(self):
+        InstitutionFactory(siret="5")
+        membership = SiretMembership()
+        self.assertTrue(membership.contains_siret("5"))
+        self.assertTrue(membership.contains_siret("12345678900011"))
+
+
+class PlanImportTestCase(TestCase):
+
+    def setUp(self):
+        InstitutionFactory(siret="12345678900011")
+        self.membership = SiretMembership()
+        self.fresh = datetime.now().isoformat()
+        self.old = (datetime.now() - timedelta(days=365)).isoformat()
+
+    def test_plan_etablissement(self):
+        csv_file = _to_csv([
+            {"siret": "12345678900011", "dateDernierTraitementEtablissement": self.fresh},
+            {"siret": "12345678900029", "dateDernierTraitementEtablissement": self.fresh},
+            {"siret": "12345678900037", "dateDernierTraitementEtablissement": self.old},
+            {"siret": "12345678900045", "dateDernierTraitementEtablissement": ""},
+        ])
+        plan = plan_import(csv_file, CSVEtablissementImporter, self.membership)
+        self.assertEqual(plan.rows, 4)
+        self.assertEqual(plan.fresh_rows, 2)
+        self.assertEqual(plan.to_create, 1)
+        self.assertEqual(plan.to_compare, 1)
+        self.assertEqual(plan.ignored, 0)
+
+    def test_plan_etablissement_force(self):
+        csv_file = _to_csv([
+            {"siret": "12345678900011", "dateDernierTraitementEtablissement": self.old},
+            {"siret": "12345678900029", "dateDernierTraitementEtablissement": ""},
+        ])
+        plan = plan_import(csv_file, CSVEtablissementImporter, self.membership, force=True)
+        self.assertEqual(plan.fresh_rows, 2)
+        self.assertEqual(plan.to_create, 1)
+        self.assertEqual(plan.to_compare, 1)
+
+    def test_plan_unite_legale(self):
+        csv_file = _to_csv([
+            {"siren": "123456789", "dateDernierTraitementUniteLegale": self.fresh},
+            {"siren": "987654321", "dateDernierTraitementUniteLegale": self.fresh},
+            {"siren": "123456788", "dateDernierTraitementUniteLegale": self.old},
+        ])
+        plan = plan_import(csv_file, CSVUniteLegaleImporter, self.membership)
+        self.assertEqual(plan.rows, 3)
+        self.assertEqual(plan.fresh_rows, 2)
+        self.assertEqual(plan.to_create, 0)
+        self.assertEqual(plan.to_compare, 1)
+        self.assertEqual(plan.ignored, 1)
+
+    def test_plan_writes_nothing(self):
+        csv_file = _to_csv([
+            {"siret": "12345678900029", "dateDernierTraitementEtablissement": self.fresh},
+        ])
+        with self.assertNumQueries(0):
+            plan_import(csv_file, CSVEtablissementImporter, self.membership)
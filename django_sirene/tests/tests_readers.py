@@ -0,0 +1,79 @@
+import csv
+import os
+import shutil
+import subprocess
+import tempfile
+import zipfile
+from unittest import skipUnless
+
+from django.test import SimpleTestCase
+
+from ..importers import CSVEtablissementImporter
+from ..models import Institution
+from ..readers import open_text, open_zip_member
+from .tests_importer import BASE_ETABLISSEMENT_ROW, ImporterTestCase
+
+CONTENT = (
+    "﻿siret,enseigne1Etablissement\r\n"
+    '00000000000000,"CAFÉ DE L\'ÉGLISE"\r\n'
+    '00000000000001,"LIGNE 1\r\nLIGNE 2"\r\n'
+).encode("utf-8")
+
+
+class ReadersTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "stock.zip")
+        with zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED) as zfile:
+            zfile.writestr("stock.csv", CONTENT)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _read(self, decompressor=None):
+        with zipfile.ZipFile(self.path) as zfile:
+            with open_zip_member(zfile, "stock.csv", decompressor) as data:
+                return list(csv.DictReader(open_text(data, buffer_size=16)))
+
+    def test_open_text(self):
+        rows = self._read()
+        self.assertEqual(
+            rows,
+            [
+                {"siret": "00000000000000", "enseigne1Etablissement": "CAFÉ DE L'ÉGLISE"},
+                {"siret": "00000000000001", "enseigne1Etablissement": "LIGNE 1\r\nLIGNE 2"},
+            ],
+        )
+
+    @skipUnless(shutil.which("unzip"), "unzip is not installed")
+    def test_decompressor(self):
+        self.assertEqual(self._read("unzip -p"), self._read())
+
+    def test_decompressor_failure(self):
+        with self.assertRaises(subprocess.CalledProcessError):
+            self._read("false")
+
+
+class ReadUnchangedRowsTestCase(ImporterTestCase):
+
+    def _import(self, path):
+        with open(path, "rb") as data:
+            CSVEtablissementImporter(csv.DictReader(open_text(data))).run()
+
+    def test_unchanged_rows_are_not_updated(self):
+        row = dict(BASE_ETABLISSEMENT_ROW, enseigne1Etablissement="CAFÉ DE L'ÉGLISE")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "stock.csv")
+            with open(path, "w", newline="", encoding="utf-8") as csv_file:
+                writer = csv.DictWriter(csv_file, fieldnames=list(row))
+                writer.writeheader()
+                writer.writerow(row)
+
+            self._import(path)
+            updated = Institution.objects.get().updated
+            self._import(path)
+
+        institution = Institution.objects.get()
+        self.assertEqual(institution.commercial_name, "CAFÉ DE L'ÉGLISE")
+        self.assertEqual(institution.updated, updated)
@@ -0,0 +1,97 @@
+import mock
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from ..db_utils import get_wal_position, has_replayed
+from ..importers import CSVEtablissementImporter
+from ..models import Activity, Institution
+from ..routers import SireneRouter, import_marker
+from .tests_importer import BASE_ETABLISSEMENT_ROW, ImporterTestCase
+
+
+class FakeCache(dict):
+    def set(self, key, value, timeout=None):
+        self[key] = value
+
+
+@override_settings(DJANGO_SIRENE_READ_DATABASE="replica", DJANGO_SIRENE_IMPORT_DATABASE="primary")
+@mock.patch("django_sirene.routers.get_wal_position", return_value="0/3000060")
+class SireneRouterTestCase(SimpleTestCase):
+    def setUp(self):
+        self.router = SireneRouter()
+        patcher = mock.patch("django_sirene.routers.get_cache", return_value=FakeCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        import_marker.clear()
+        self.addCleanup(import_marker.clear)
+
+    def test_routes(self, mock_position):
+        self.assertEqual(self.router.db_for_read(Institution), "replica")
+        self.assertEqual(self.router.db_for_write(Institution), "primary")
+        self.assertTrue(self.router.allow_migrate("primary", "django_sirene"))
+        self.assertFalse(self.router.allow_migrate("replica", "django_sirene"))
+
+    def test_other_apps(self, mock_position):
+        model = mock.Mock(**{"_meta.app_label": "auth"})
+        self.assertIsNone(self.router.db_for_read(model))
+        self.assertIsNone(self.router.db_for_write(model))
+        self.assertIsNone(self.router.allow_migrate("replica", "auth"))
+        self.assertIsNone(self.router.allow_relation(model, Activity()))
+
+    @override_settings(DJANGO_SIRENE_READ_DATABASE=None)
+    def test_without_replica(self, mock_position):
+        self.assertEqual(self.router.db_for_read(Institution), "primary")
+
+    @mock.patch("django_sirene.routers.has_replayed", return_value=False)
+    def test_reads_from_primary_until_replayed(self, mock_replayed, mock_position):
+        import_marker.mark("primary")
+        self.assertEqual(self.router.db_for_read(Institution), "primary")
+
+        # other processes see the marker
+        import_marker.clear()
+        self.assertEqual(self.router.db_for_read(Institution), "primary")
+        mock_replayed.assert_called_once_with("0/3000060", "replica")
+
+        # the replica is checked again after the interval only
+        mock_replayed.return_value = True
+        self.assertEqual(self.router.db_for_read(Institution), "primary")
+        with mock.patch("django_sirene.routers.time.monotonic", return_value=10 ** 9):
+            self.assertEqual(self.router.db_for_read(Institution), "replica")
+
+    @override_settings(DJANGO_SIRENE_REPLICATION_LAG=30)
+    @mock.patch("django_sirene.routers.has_replayed")
+    def test_lag_window_without_position(self, mock_replayed, mock_position):
+        mock_position.return_value = None
+        with mock.patch("django_sirene.routers.time.time", return_value=1000):
+            import_marker.mark("primary")
+        import_marker.clear()
+        with mock.patch("django_sirene.routers.time.time", return_value=1029):
+            self.assertEqual(self.router.db_for_read(Institution), "primary")
+        import_marker.clear()
+        with mock.patch("django_sirene.routers.time.time", return_value=1030):
+            self.assertEqual(self.router.db_for_read(Institution), "replica")
+        mock_replayed.assert_not_called()
+
+
+class ImportMarkerTestCase(ImporterTestCase):
+    def setUp(self):
+        super().setUp()
+        import_marker.clear()
+        self.addCleanup(import_marker.clear)
+
+    @override_settings(DJANGO_SIRENE_READ_DATABASE="default")
+    def test_import_marks_writes(self):
+        with mock.patch.object(import_marker, "mark") as mock_mark:
+            with self.captureOnCommitCallbacks(execute=True):
+                CSVEtablissementImporter([BASE_ETABLISSEMENT_ROW.copy()]).run()
+        mock_mark.assert_called_once_with("default")
+
+    def test_no_marks_without_replica(self):
+        with mock.patch.object(import_marker, "mark") as mock_mark:
+            CSVEtablissementImporter([BASE_ETABLISSEMENT_ROW.copy()]).run()
+        mock_mark.assert_not_called()
+
+
+class ReplicationTestCase(TestCase):
+    def test_primary_has_nothing_to_replay(self):
+        position = get_wal_position()
+        self.assertTrue(has_replayed(position, "default"))
@@ -0,0 +1,86 @@
+from contextlib import contextmanager
+
+from django.db import transaction
+
+from ..importers import CSVEtablissementImporter, CSVUniteLegaleImporter
+from ..signals import import_finished, institutions_created, institutions_updated
+from .factories import InstitutionFactory
+from .tests_importer import BASE_ETABLISSEMENT_ROW, BASE_UNITE_ROW, ImporterTestCase
+
+
+@contextmanager
+def receive(signal):
+    """Collect the keyword arguments of each sending of signal
+    """
+    received = []
+
+    def receiver(sender, **kwargs):
+        received.append(dict(kwargs, sender=sender))
+
+    signal.connect(receiver)
+    try:
+        yield received
+    finally:
+        signal.disconnect(receiver)
+
+
+class ImportSignalsTestCase(ImporterTestCase):
+    def test_institutions_created(self):
+        rows = [BASE_ETABLISSEMENT_ROW.copy(), dict(BASE_ETABLISSEMENT_ROW, siret="00000000000001")]
+        with receive(institutions_created) as received:
+            with self.captureOnCommitCallbacks(execute=True):
+                CSVEtablissementImporter(rows).run()
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]["sender"], CSVEtablissementImporter)
+        self.assertEqual(received[0]["sirets"], {"00000000000000", "00000000000001"})
+
+    def test_sent_by_batch(self):
+        rows = [dict(BASE_ETABLISSEMENT_ROW, siret="0000000000000%d" % i) for i in range(5)]
+        with receive(institutions_created) as received:
+            with self.captureOnCommitCallbacks(execute=True):
+                CSVEtablissementImporter(rows, local_batch_size=2).run()
+        self.assertEqual([len(kwargs["sirets"]) for kwargs in received], [2, 2, 1])
+
+    def test_institutions_updated(self):
+        CSVEtablissementImporter([BASE_ETABLISSEMENT_ROW.copy()]).run()
+        row = dict(BASE_ETABLISSEMENT_ROW, enseigne1Etablissement="NEW NAME")
+        with receive(institutions_created) as created, receive(institutions_updated) as updated:
+            with self.captureOnCommitCallbacks(execute=True):
+                CSVEtablissementImporter([row]).run()
+        self.assertEqual(created, [])
+        self.assertEqual(updated[0]["sirets"], {"00000000000000"})
+
+    def test_unchanged_institutions(self):
+        CSVEtablissementImporter([BASE_ETABLISSEMENT_ROW.copy()]).run()
+        with receive(institutions_updated) as received:
+            CSVEtablissementImporter([BASE_ETABLISSEMENT_ROW.copy()]).run()
+        self.assertEqual(received, [])
+
+    def test_unite_legale_updated(self):
+        InstitutionFactory(siret="00000000000000")
+        InstitutionFactory(siret="00000000009876")
+        with receive(institutions_updated) as received:
+            with self.captureOnCommitCallbacks(execute=True):
+                CSVUniteLegaleImporter([BASE_UNITE_ROW.copy()]).run()
+        self.assertEqual(received[0]["sender"], CSVUniteLegaleImporter)
+        self.assertEqual(received[0]["sirets"], {"00000000000000", "00000000009876"})
+
+    def test_not_sent_when_rolled_back(self):
+        with receive(institutions_created) as received:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                with self.assertRaises(ValueError):
+                    with transaction.atomic():
+                        CSVEtablissementImporter([BASE_ETABLISSEMENT_ROW.copy()]).run()
+                        raise ValueError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(received, [])
+
+    def test_import_finished(self):
+        rows = [BASE_ETABLISSEMENT_ROW.copy(), dict(BASE_ETABLISSEMENT_ROW, siret="123")]
+        with receive(import_finished) as received:
+            importer = CSVEtablissementImporter(rows)
+            importer.run()
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0]["importer"], importer)
+        self.assertEqual(received[0]["rows"], 2)
+        self.assertEqual(received[0]["fresh_rows"], 2)
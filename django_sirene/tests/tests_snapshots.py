@@ -0,0 +1,115 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase
+
+from ..models import ImportRun, Institution, InstitutionChange, InstitutionStats
+from ..snapshots import MANIFEST_FILENAME, SnapshotError, export_snapshot, load_snapshot
+from .factories import InstitutionFactory
+
+
+class SnapshotTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.headquarter = InstitutionFactory(name="SUPER INSTITUTION")
+        self.subsidiary = InstitutionFactory(headquarter=self.headquarter)
+        self.import_run = ImportRun.objects.create(filename="etablissement.zip", rows=2)
+
+    def _get_indexes(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname FROM pg_indexes WHERE tablename = 'django_sirene_institution'"
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def _edit_manifest(self, **changes):
+        path = os.path.join(self.directory.name, MANIFEST_FILENAME)
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+        manifest.update(changes)
+        with open(path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+
+    def test_export(self):
+        manifest = export_snapshot(self.directory.name)
+        tables = {table["table"]: table for table in manifest["tables"]}
+        self.assertEqual(tables["django_sirene_institution"]["rows"], 2)
+        self.assertEqual(tables["django_sirene_importrun"]["rows"], 1)
+        self.assertNotIn("django_sirene_institutionchange", tables)
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, MANIFEST_FILENAME)))
+
+    def test_load(self):
+        export_snapshot(self.directory.name)
+        indexes = self._get_indexes()
+        subsidiary_pk = self.subsidiary.pk
+        self.subsidiary.delete()
+        InstitutionFactory()
+        InstitutionChange.objects.create(
+            siret="00000000000001", change_type=InstitutionChange.CREATED
+        )
+
+        load_snapshot(self.directory.name)
+        self.assertCountEqual(
+            Institution.objects.values_list("siret", flat=True),
+            [self.headquarter.siret, self.subsidiary.siret],
+        )
+        self.assertEqual(Institution.objects.get(pk=subsidiary_pk).headquarter, self.headquarter)
+        self.assertEqual(ImportRun.objects.get().rows, 2)
+        self.assertFalse(InstitutionChange.objects.exists())
+        self.assertEqual(self._get_indexes(), indexes)
+        self.assertEqual(InstitutionStats.objects.total(), 2)
+        # search vectors come from the snapshot and the trigger is back
+        self.assertEqual(Institution.objects.search("super").get(), self.headquarter)
+        self.assertEqual(InstitutionFactory(name="OTHER").pk, subsidiary_pk + 1)
+        self.assertTrue(Institution.objects.search("other").exists())
+
+    def test_migration_mismatch(self):
+        export_snapshot(self.directory.name)
+        self._edit_manifest(migration="0001_initial")
+        with self.assertRaises(SnapshotError):
+            load_snapshot(self.directory.name)
+        self.assertEqual(Institution.objects.count(), 2)
+
+    def test_cached_records_invalidated(self):
+        export_snapshot(self.directory.name)
+        # written without invalidation, like the tables replaced by a load
+        Institution.objects.filter(pk=self.subsidiary.pk).update(commercial_name="CACHED")
+        record = Institution.objects.get_by_siret(self.subsidiary.siret)
+        self.assertEqual(record["commercial_name"], "CACHED")
+        self.assertEqual(len(Institution.objects.get_by_siren(self.subsidiary.siret[:9])), 1)
+
+        load_snapshot(self.directory.name)
+        record = Institution.objects.get_by_siret(self.subsidiary.siret)
+        self.assertEqual(record["commercial_name"], self.subsidiary.commercial_name)
+
+    def test_outside_references(self):
+        export_snapshot(self.directory.name)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE outside_reference "
+                "(institution_id integer REFERENCES django_sirene_institution (id))"
+            )
+        with self.assertRaisesRegex(SnapshotError, "outside_reference"):
+            load_snapshot(self.directory.name)
+        self.assertEqual(Institution.objects.count(), 2)
+
+    def test_corrupt_file(self):
+        export_snapshot(self.directory.name)
+        with open(os.path.join(self.directory.name, "django_sirene_institution.copy"), "ab") as f:
+            f.write(b"\0")
+        with self.assertRaises(SnapshotError):
+            load_snapshot(self.directory.name)
+
+    def test_commands(self):
+        call_command("export_sirene_snapshot", self.directory.name, stdout=StringIO())
+        self.subsidiary.delete()
+        call_command("load_sirene_snapshot", self.directory.name, stdout=StringIO())
+        self.assertEqual(Institution.objects.count(), 2)
+        with self.assertRaises(CommandError):
+            call_command("load_sirene_snapshot", "/nonexistent", stdout=StringIO())
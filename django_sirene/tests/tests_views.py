@@ -0,0 +1,81 @@
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from .factories import InstitutionFactory
+
+
+@override_settings(ROOT_URLCONF="django_sirene.tests.urls")
+class InstitutionLookupViewTestCase(TestCase):
+
+    def setUp(self):
+        self.hq = InstitutionFactory(siret="12345678900011")
+        self.sub = InstitutionFactory(siret="12345678900029")
+        self.other = InstitutionFactory(siret="98765432100011")
+        self.url = reverse("django_sirene:institution-lookup")
+
+    def test_lookup_by_sirets_and_sirens(self):
+        # one select between the savepoint queries of ATOMIC_REQUESTS
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                self.url, {"siret": "%s,00000000000000" % self.other.siret, "siren": "123456789"}
+            )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(
+            [record["siret"] for record in data["results"]],
+            [self.hq.siret, self.sub.siret, self.other.siret],
+        )
+        self.assertEqual(data["results"][0]["name"], self.hq.name)
+        self.assertEqual(data["not_found"], ["00000000000000"])
+
+    def test_lookup_requires_parameters(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+    @override_settings(DJANGO_SIRENE_LOOKUP_MAX_ITEMS=2)
+    def test_lookup_is_limited(self):
+        response = self.client.get(self.url, {"siret": ["1", "2"], "siren": "3"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_lookup_is_read_only(self):
+        self.assertEqual(self.client.post(self.url, {"siret": self.hq.siret}).status_code, 405)
+
+    def test_conditional_requests(self):
+        response = self.client.get(self.url, {"siret": self.hq.siret})
+        self.assertIn("Last-Modified", response)
+        etag = response["ETag"]
+
+        response = self.client.get(self.url, {"siret": self.hq.siret}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.hq.save()
+        response = self.client.get(self.url, {"siret": self.hq.siret}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+@override_settings(ROOT_URLCONF="django_sirene.tests.urls")
+class AsyncInstitutionLookupViewTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.hq = InstitutionFactory(siret="12345678900011")
+        self.sub = InstitutionFactory(siret="12345678900029")
+        self.other = InstitutionFactory(siret="98765432100011")
+        self.url = reverse("django_sirene:institution-lookup-async")
+
+    async def test_lookup_by_sirets_and_sirens(self):
+        response = await self.async_client.get(
+            self.url, {"siret": "%s,00000000000000" % self.other.siret, "siren": "123456789"}
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(
+            [record["siret"] for record in data["results"]],
+            [self.hq.siret, self.sub.siret, self.other.siret],
+        )
+        self.assertEqual(data["not_found"], ["00000000000000"])
+
+    async def test_lookup_is_read_only(self):
+        response = await self.async_client.post(self.url, {"siret": self.hq.siret})
+        self.assertEqual(response.status_code, 405)
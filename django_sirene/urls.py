@@ -0,0 +1,12 @@
+from django.urls import path
+
+from .views import InstitutionLookupView, institution_lookup_async
+
+app_name = "django_sirene"
+
+urlpatterns = [
+    path("institutions/", InstitutionLookupView.as_view(), name="institution-lookup"),
+    path(
+        "async/institutions/", institution_lookup_async, name="institution-lookup-async"
+    ),
+]
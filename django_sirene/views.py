@@ -0,0 +1,129 @@
+import hashlib
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponseNotAllowed, JsonResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views import View
+
+from .helpers import get_siren
+from .models import Institution
+
+
+def get_max_items():
+    return getattr(settings, "DJANGO_SIRENE_LOOKUP_MAX_ITEMS", 100)
+
+
+def _get_list_param(request, name):
+    """Read a parameter given as ?name=a,b or ?name=a&name=b
+    """
+    values = []
+    for value in request.GET.getlist(name):
+        values.extend(v.strip() for v in value.split(",") if v.strip())
+    return values
+
+
+def _get_etag(records):
+    digest = hashlib.md5()
+    for record in records:
+        digest.update(("%s:%s;" % (record["siret"], record["updated"].isoformat())).encode())
+    return quote_etag(digest.hexdigest())
+
+
+def _get_last_modified(records):
+    if not records:
+        return None
+    last_modified = max(record["updated"] for record in records)
+    if not timezone.is_aware(last_modified):
+        last_modified = timezone.make_aware(last_modified, dt_timezone.utc)
+    return int(last_modified.timestamp())
+
+
+def parse_lookup_params(request):
+    """Return the requested sirets and sirens, and an error response if invalid
+    """
+    sirets = set(_get_list_param(request, "siret"))
+    sirens = set(_get_list_param(request, "siren"))
+
+    if not sirets and not sirens:
+        error = "siret or siren parameter is required"
+    elif len(sirets) + len(sirens) > get_max_items():
+        error = "at most %d sirets and sirens per request" % get_max_items()
+    else:
+        return sirets, sirens, None
+    return sirets, sirens, JsonResponse({"error": error}, status=400)
+
+
+def lookup_response(request, sirets, sirens, records):
+    """Build the JSON response, or a 304 if the client copy is still valid
+
+    :param records: records found, ordered by siret
+    """
+    etag = _get_etag(records)
+    last_modified = _get_last_modified(records)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        found_sirets = {record["siret"] for record in records}
+        found_sirens = {get_siren(siret) for siret in found_sirets}
+        response = JsonResponse(
+            {
+                "results": records,
+                "not_found": sorted((sirets - found_sirets) | (sirens - found_sirens)),
+            }
+        )
+
+    response["ETag"] = etag
+    if last_modified:
+        response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
+class InstitutionLookupView(View):
+    """Read only JSON lookup of institutions by sirets and sirens
+
+    ``GET ?siret=<siret>,<siret>&siren=<siren>`` returns the records found with
+    a single indexed query, along with ETag and Last-Modified headers built from
+    the ``updated`` field of the institutions.
+    """
+
+    http_method_names = ["get", "head"]
+
+    def get_records(self, sirets, sirens):
+        return list(
+            Institution.objects.filter(Q(siret__in=sirets) | Q(legal_unit__in=sirens))
+            .order_by("siret")
+            .records()
+        )
+
+    def get(self, request, *args, **kwargs):
+        sirets, sirens, error_response = parse_lookup_params(request)
+        if error_response:
+            return error_response
+        records = self.get_records(sirets, sirens)
+        return lookup_response(request, sirets, sirens, records)
+
+
+@transaction.non_atomic_requests
+async def institution_lookup_async(request):
+    """Async variant of InstitutionLookupView for ASGI deployments
+
+    Lookups of concurrent requests are coalesced in a single query and served
+    from the cache of the lookup API.
+    """
+    if request.method not in ("GET", "HEAD"):
+        return HttpResponseNotAllowed(["GET", "HEAD"])
+
+    sirets, sirens, error_response = parse_lookup_params(request)
+    if error_response:
+        return error_response
+
+    records = await Institution.objects.aget_many_by_siret(sirets)
+    for siren_records in (await Institution.objects.aget_many_by_siren(sirens)).values():
+        records.update((record["siret"], record) for record in siren_records)
+    records = [records[siret] for siret in sorted(records)]
+    return lookup_response(request, sirets, sirens, records)